@@ -60,7 +60,7 @@ def list_hex_repr(vals):
     return ret
 
 def coeffs_hex_repr(npoints):
-    coeffs = util.generate_lagrange_coeffs(npoints - 1)
+    coeffs = util.lagrange_coeffs(npoints - 1)
 
     ret = 'localparam [`F_NBITS*' + str(npoints) + '*' + str(npoints) + "-1:0] coeffs_param =\n  {  "
     first = True
@@ -0,0 +1,7 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# giraffebench module
+
+pass
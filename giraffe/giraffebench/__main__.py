@@ -0,0 +1,32 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# giraffebench runner
+
+import sys
+import os.path
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
+
+import giraffebench.engines as engines
+import giraffebench.fieldarith as fieldarith
+import giraffebench.memory as memory
+import giraffebench.parallel as parallel
+
+BENCHMARKS = { 'engines': engines
+             , 'fieldarith': fieldarith
+             , 'memory': memory
+             , 'parallel': parallel
+             }
+
+if len(sys.argv) > 1:
+    names = sys.argv[1:]
+else:
+    names = sorted(BENCHMARKS.keys())
+
+for name in names:
+    if name not in BENCHMARKS:
+        print "Unknown benchmark %s (choices: %s)" % (name, ", ".join(sorted(BENCHMARKS.keys())))
+        sys.exit(1)
+
+    BENCHMARKS[name].run_bench()
@@ -0,0 +1,52 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# benchmark the layer prover engines against each other
+
+# hack: this benchmark lives in a subdir
+import sys
+import os.path
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
+
+import random
+import time
+
+from giraffelib import fieldvec, randutil
+from giraffelib.circuitprover import ENGINES
+from giraffelib.circuitverifier import CircuitVerifier
+
+def time_prover(engine, nInBits, nCopyBits, nLayers, nRuns=3):
+    # same circuit for every engine and backend
+    state = random.getstate()
+    random.seed(nInBits * nCopyBits * nLayers)
+
+    (in0vv, in1vv, typvv) = randutil.rand_layers(nLayers, nInBits)
+    inputs = randutil.rand_inputs(nInBits, 2 ** nCopyBits)
+    random.setstate(state)
+
+    # best of nRuns, since the engines' difference is a small part of the whole run
+    best = None
+    for _ in range(0, nRuns):
+        ver = CircuitVerifier(2 ** nCopyBits, 2**nInBits, in0vv, in1vv, typvv)
+        ver.engine = engine
+        ver.build_prover()
+
+        start = time.time()
+        ver.run(inputs)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_bench(nInBits=14, nCopyBits=2, nLayers=2):
+    print "layer prover engines: 2^%d gates x 2^%d copies x %d layers" % (nInBits, nCopyBits, nLayers)
+    print "%-7s  %s" % ("backend", "  ".join([ "%10s" % engine for engine in sorted(ENGINES) ]))
+
+    for backend in ["ref"] + [ name for name in fieldvec.available() if fieldvec.backends[name].vectorized ]:
+        fieldvec.set_backend(backend)
+        times = [ time_prover(engine, nInBits, nCopyBits, nLayers) for engine in sorted(ENGINES) ]
+        print "%-7s  %s" % (backend, "  ".join([ "%10.3f" % elapsed for elapsed in times ]))
+    fieldvec.set_backend("ref")
+
+if __name__ == "__main__":
+    run_bench()
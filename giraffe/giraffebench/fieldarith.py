@@ -0,0 +1,73 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# benchmark field backends at different prime sizes
+
+# hack: this benchmark lives in a subdir
+import sys
+import os.path
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
+
+import random
+import time
+
+from giraffelib import fieldvec, randutil, util
+from giraffelib.circuitverifier import CircuitVerifier
+from giraffelib.defs import Defs
+from giraffelib.layercompute import LayerComputeBeta, LayerComputeV
+
+PRIMES = [ (61, 2 ** 61 - 1)
+         , (64, 2 ** 63 + 2 ** 19 + 1)
+         , (127, 2 ** 127 - 1)
+         , (255, 2 ** 255 - 19)
+         ]
+
+def time_fold(nbits):
+    inputs = [ Defs.gen_random() for _ in range(0, 2 ** nbits) ]
+    zvals = [ Defs.gen_random() for _ in range(0, nbits) ]
+
+    start = time.time()
+    lcv = LayerComputeV(nbits)
+    lcv.set_inputs(inputs)
+    for z in zvals:
+        lcv.next_round(z)
+    LayerComputeBeta(nbits, zvals)
+    return time.time() - start
+
+def time_verifier(nInBits, nCopies, nLayers):
+    # same circuit for every backend
+    state = random.getstate()
+    random.seed(nInBits * nCopies * nLayers)
+
+    (in0vv, in1vv, typvv) = randutil.rand_layers(nLayers, nInBits)
+    random.setstate(state)
+
+    inputs = randutil.rand_inputs(nInBits, nCopies)
+
+    start = time.time()
+    ver = CircuitVerifier(nCopies, 2**nInBits, in0vv, in1vv, typvv)
+    ver.build_prover()
+    ver.run(inputs)
+    return time.time() - start
+
+def run_bench(foldBits=16, nInBits=6, nCopies=64, nLayers=3):
+    print "field backends: fold/beta on 2^%d elements; verifier on 2^%d x %d copies x %d layers" % (foldBits, nInBits, nCopies, nLayers)
+    print "%6s  %-7s  %12s  %12s" % ("bits", "backend", "fold+beta(s)", "verify (s)")
+
+    oldBackend = Defs.backend
+    fieldvec.set_backend("ref")
+    for (bits, prime) in PRIMES:
+        util.set_prime(prime)
+        for name in fieldvec.available():
+            fieldvec.set_backend(name)
+            tfold = time_fold(foldBits)
+            tver = time_verifier(nInBits, nCopies, nLayers)
+            fieldvec.set_backend("ref")
+            print "%6d  %-7s  %12.3f  %12.3f" % (bits, name, tfold, tver)
+
+    util.set_prime(2 ** 61 - 1)
+    fieldvec.set_backend(oldBackend)
+
+if __name__ == "__main__":
+    run_bench()
@@ -0,0 +1,103 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# benchmark memory use of the V and beta computations, with and without in-place folding,
+# and of the gate and layer objects built when constructing a prover
+
+# hack: this benchmark lives in a subdir
+import sys
+import os.path
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
+
+import multiprocessing
+import random
+import resource
+import time
+
+from giraffelib import fieldvec, randutil
+from giraffelib.circuitprover import CircuitProver
+from giraffelib.circuitverifier import CircuitVerifier
+from giraffelib.layercompute import LayerComputeV
+
+# backend ops that return a newly allocated vector
+ALLOC_OPS = [ "vector", "tolist", "alloc", "alloc_temps", "fold", "expand", "outer", "mul", "add", "sub", "scale", "dot_rows", "horner_rows" ]
+
+def count_allocs(counts):
+    def wrap(fn):
+        def wrapped(*args):
+            counts[0] += 1
+            return fn(*args)
+        return staticmethod(wrapped)
+
+    for fv in fieldvec.backends.values():
+        for name in ALLOC_OPS:
+            if name in vars(fv):
+                setattr(fv, name, wrap(getattr(fv, name)))
+
+def measure_child(nInBits, nCopies, backend, inPlace, queue):
+    random.seed(nInBits * nCopies)
+    (in0v, in1v, typv) = randutil.rand_ckt(nInBits, nInBits)
+    inputs = randutil.rand_inputs(nInBits, nCopies)
+
+    fieldvec.set_backend(backend)
+    LayerComputeV.fold_in_place = inPlace
+    counts = [0]
+    count_allocs(counts)
+
+    ver = CircuitVerifier(nCopies, 2**nInBits, [in0v], [in1v], [typv])
+    ver.build_prover()
+
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    ver.run(inputs)
+    elapsed = time.time() - start
+    rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((rss_end / 1024.0, (rss_end - rss_start) / 1024.0, counts[0], elapsed))
+
+def build_child(nBits, nLayers, queue):
+    random.seed(nBits * nLayers)
+    ckts = [ randutil.rand_ckt(nBits, nBits) for _ in range(0, nLayers) ]
+    (in0vv, in1vv, typvv) = [ [ ckt[i] for ckt in ckts ] for i in range(0, 3) ]
+
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    CircuitProver(2, 2**nBits, in0vv, in1vv, typvv)
+    elapsed = time.time() - start
+    rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    queue.put(((rss_end - rss_start) / 1024.0, elapsed))
+
+def measure(target, *args):
+    # fresh process for each measurement so that peak RSS isn't polluted by earlier runs
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=target, args=args + (queue,))
+    proc.start()
+    proc.join()
+    assert proc.exitcode == 0, "memory benchmark failed"
+    return queue.get()
+
+def run_bench(nInBits=10, nCopies=256, nBuildBits=16, nBuildLayers=4):
+    # the reference backend and every vectorized one. Tables shorter than a vectorized
+    # backend's min_size use the reference backend either way; see fieldvec.get
+    backends = ["ref"] + [ name for name in fieldvec.available() if fieldvec.backends[name].vectorized ]
+
+    print "memory: one layer, 2^%d gates x %d copies" % (nInBits, nCopies)
+    print "%-7s  %-9s  %14s  %16s  %14s  %9s" % ("backend", "folding", "peak RSS (MB)", "RSS growth (MB)", "vector allocs", "time (s)")
+
+    for backend in backends:
+        for inPlace in (False, True):
+            (peak, growth, nallocs, elapsed) = measure(measure_child, nInBits, nCopies, backend, inPlace)
+            print "%-7s  %-9s  %14.1f  %16.1f  %14d  %9.3f" % (backend, "in-place" if inPlace else "fresh", peak, growth, nallocs, elapsed)
+
+    # per-gate objects: _CGate and _GateProver (one each per gate), plus each layer's tables
+    nGates = nBuildLayers * 2 ** nBuildBits
+    (growth, elapsed) = measure(build_child, nBuildBits, nBuildLayers)
+    print "memory: building a prover for %d layers of 2^%d gates" % (nBuildLayers, nBuildBits)
+    print "%16s  %14s  %9s" % ("RSS growth (MB)", "bytes/gate", "time (s)")
+    print "%16.1f  %14.1f  %9.3f" % (growth, growth * 1024 * 1024 / nGates, elapsed)
+
+if __name__ == "__main__":
+    run_bench()
@@ -0,0 +1,50 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# benchmark the prover's rounds sharded by copy and by gate across worker processes
+
+# hack: this benchmark lives in a subdir
+import sys
+import os.path
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
+
+import multiprocessing
+import random
+import time
+
+from giraffelib import randutil
+from giraffelib.circuitverifier import CircuitVerifier
+from giraffelib.parallel import ShardPool
+
+def time_prover(pool, nInBits, nCopyBits, nLayers):
+    # same circuit for every pool size
+    state = random.getstate()
+    random.seed(nInBits * nCopyBits * nLayers)
+
+    (in0vv, in1vv, typvv) = randutil.rand_layers(nLayers, nInBits)
+    random.setstate(state)
+
+    inputs = randutil.rand_inputs(nInBits, 2 ** nCopyBits)
+    ver = CircuitVerifier(2 ** nCopyBits, 2**nInBits, in0vv, in1vv, typvv)
+    ver.build_prover().set_pool(pool)
+
+    start = time.time()
+    ver.run(inputs)
+    return time.time() - start
+
+def run_bench(nInBits=6, nCopyBits=10, nLayers=3):
+    nCPUs = multiprocessing.cpu_count()
+    print "sharded sumcheck rounds: 2^%d x 2^%d copies x %d layers, %d cpus" % (nInBits, nCopyBits, nLayers, nCPUs)
+    print "%8s  %10s" % ("workers", "prove (s)")
+
+    print "%8s  %10.3f" % ("none", time_prover(None, nInBits, nCopyBits, nLayers))
+    nWorkers = 2
+    while nWorkers <= max(2, nCPUs):
+        pool = ShardPool(nWorkers)
+        print "%8d  %10.3f" % (nWorkers, time_prover(pool, nInBits, nCopyBits, nLayers))
+        pool.close()
+        nWorkers *= 2
+
+if __name__ == "__main__":
+    run_bench()
@@ -8,6 +8,8 @@ from giraffelib.defs import Defs
 import giraffelib.util
 
 class _CGate(object):
+    __slots__ = ('in0', 'in1', 'out', 'layer', 'muxbit', 'value')
+
     def __init__(self, in0, in1, out, layer, muxb=None):
         self.in0 = int(in0)
         self.in1 = int(in1)
@@ -22,25 +24,69 @@ class _CGate(object):
 
 
 class CAddGate(_CGate):
+    __slots__ = ()
+
     def run(self):
         self.value = (self.layer.prevL.outputs[self.in0] + self.layer.prevL.outputs[self.in1]) % Defs.prime
 
 class CMulGate(_CGate):
+    __slots__ = ()
+
     def run(self):
         self.value = (self.layer.prevL.outputs[self.in0] * self.layer.prevL.outputs[self.in1]) % Defs.prime
 
 class CSubGate(_CGate):
+    __slots__ = ()
+
     def run(self):
         self.value = (self.layer.prevL.outputs[self.in0] - self.layer.prevL.outputs[self.in1]) % Defs.prime
 
 class CMuxGate(_CGate):
+    __slots__ = ()
+
     def run(self):
         if self.layer.circuit.muxbits[self.muxbit]:
             self.value = self.layer.prevL.outputs[self.in0]
         else:
             self.value = self.layer.prevL.outputs[self.in1]
 
+class CLinGate(_CGate):
+    __slots__ = ()
+
+    # in0 is a tuple of input wires, and in1 is the tuple of their coefficients
+    def __init__(self, in0, in1, out, layer, muxb=None):
+        # pylint: disable=super-init-not-called
+        assert len(in0) == len(in1)
+        self.in0 = tuple( int(inp) for inp in in0 )
+        self.in1 = tuple( int(coeff) for coeff in in1 )
+        self.out = int(out)
+        self.layer = layer
+        self.muxbit = muxb
+        self.value = None
+
+    def run(self):
+        outputs = self.layer.prevL.outputs
+        self.value = sum( coeff * outputs[inp] for (inp, coeff) in zip(self.in0, self.in1) ) % Defs.prime
+
+# constant-operand gates: in0 is a wire, and in1 is a constant
+class CConstMulGate(_CGate):
+    __slots__ = ()
+
+    def run(self):
+        self.value = (self.layer.prevL.outputs[self.in0] * self.in1) % Defs.prime
+
+class CConstAddGate(_CGate):
+    __slots__ = ()
+
+    def run(self):
+        self.value = (self.layer.prevL.outputs[self.in0] + self.in1) % Defs.prime
+
 class ArithCircuitLayer(object):
+    __slots__ = ('gates', 'gate_slots', 'nDupGates', 'outputs', 'outputs_unpadded', 'nOutBits', 'prevL', 'circuit')
+
+    # evaluate duplicate gates (same type, inputs, and mux bit) only once
+    dedup = True
+
     def __init__(self, ckt, prevL, in0v, in1v, typev, muxv=None):
         self.gates = []
         self.outputs = []
@@ -56,8 +102,18 @@ class ArithCircuitLayer(object):
         assert len(muxv) == len(in0v)
         assert len(typev) == len(in0v)
 
+        # one gate per distinct (type, in0, in1, muxbit); gate_slots[out] is the gate computing out
+        if self.dedup:
+            (outs, self.gate_slots) = giraffelib.util.dedup_gates(in0v, in1v, typev, muxv)
+            firsts = [ gouts[0] for gouts in outs ]
+        else:
+            self.gate_slots = range(0, len(in0v))
+            firsts = self.gate_slots
+        self.nDupGates = len(in0v) - len(firsts)
+
         max_muxbit = 0
-        for (out, (in0, in1, mx, tp)) in enumerate(zip(in0v, in1v, muxv, typev)):
+        for out in firsts:
+            (in0, in1, mx, tp) = (in0v[out], in1v[out], muxv[out], typev[out])
             assert issubclass(tp, _CGate)
             self.gates.append(tp(in0, in1, out, self, mx))
             if mx > max_muxbit:
@@ -69,11 +125,12 @@ class ArithCircuitLayer(object):
     def run(self):
         assert len(self.prevL.outputs) == 2**self.prevL.nOutBits
 
-        out = []
+        vals = []
         for g in self.gates:
             g.run()
-            out.append(g.value)
+            vals.append(g.value)
 
+        out = [ vals[slot] for slot in self.gate_slots ]
         self.outputs_unpadded = out
         self.outputs = out + [0] * (2**self.nOutBits - len(out))
         assert len(self.outputs) == 2**self.nOutBits
@@ -4,7 +4,7 @@
 #
 # Python representation of arithmetic circuit elements
 
-from giraffelib.arithcircuit import ArithCircuit, ArithCircuitInputLayer, ArithCircuitLayer, CAddGate, CMulGate, CSubGate
+from giraffelib.arithcircuit import ArithCircuit, ArithCircuitInputLayer, ArithCircuitLayer, CAddGate, CMulGate, CSubGate, CLinGate, CConstAddGate, CConstMulGate
 import giraffelib.parse_pws
 import giraffelib.util
 
@@ -20,9 +20,10 @@ class ArithCircuitBuilder(object):
 
         arith_circuit = ArithCircuit()
         arith_circuit.layers = [ArithCircuitInputLayer(arith_circuit, nInBits)]
-        for (lay, (in0v, in1v, muxv, typev)) in enumerate(zip(in0vv, in1vv, muxvv, typevv)):
-            typec = [ typ.cgate for typ in typev ]
-            arith_circuit.layers.append(ArithCircuitLayer(arith_circuit, arith_circuit.layers[lay], in0v, in1v, typec, muxv))
+        with giraffelib.util.gc_paused():
+            for (lay, (in0v, in1v, muxv, typev)) in enumerate(zip(in0vv, in1vv, muxvv, typevv)):
+                typec = [ typ.cgate for typ in typev ]
+                arith_circuit.layers.append(ArithCircuitLayer(arith_circuit, arith_circuit.layers[lay], in0v, in1v, typec, muxv))
 
         self.arith_circuit = arith_circuit
         self.nCopies = nCopies
@@ -31,7 +32,8 @@ class ArithCircuitBuilder(object):
         counts = []
         for lay in self.arith_circuit.layers[1:]:
             l_count = [0, 0, 0, 0]
-            for gate in lay.gates:
+            # count every output, including duplicates that the layer evaluates only once
+            for gate in ( lay.gates[slot] for slot in lay.gate_slots ):
                 if isinstance(gate, CAddGate):
                     l_count[0] += self.nCopies
                     l_count[2] += 1
@@ -41,6 +43,17 @@ class ArithCircuitBuilder(object):
                 elif isinstance(gate, CMulGate):
                     l_count[1] += self.nCopies
                     l_count[3] += 1
+                elif isinstance(gate, CConstAddGate):
+                    l_count[0] += self.nCopies
+                    l_count[2] += 1
+                elif isinstance(gate, CConstMulGate):
+                    l_count[1] += self.nCopies
+                    l_count[3] += 1
+                elif isinstance(gate, CLinGate):
+                    # one add per term after the first, and a mul for each coefficient other than +/-1
+                    l_count[0] += (len(gate.in0) - 1) * self.nCopies
+                    l_count[1] += len([ 1 for coeff in gate.in1 if coeff not in (1, -1) ]) * self.nCopies
+                    l_count[2] += 1
             counts.append(l_count)
         return counts
 
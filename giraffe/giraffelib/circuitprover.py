@@ -7,10 +7,18 @@
 import giraffelib.parse_pws
 import giraffelib.util as util
 from giraffelib.arithcircuitbuilder import ArithCircuitBuilder
-from giraffelib.layerprover import InputLayer, LayerProver
+from giraffelib.layerprover import InputLayer, LayerProver, LibraLayerProver
+
+# layer prover engines, by name. Both speak the same protocol, so the verifier doesn't care
+ENGINES = { "giraffe": LayerProver
+          , "libra": LibraLayerProver
+          }
 
 # this is just for use with libprv_layer_test
 class _DummyCircuitProver(object):
+    eval_form = False
+    pool = None
+
     def __init__(self, nCopies):
         self.nCopies = nCopies
         self.nCopyBits = util.clog2(nCopies)
@@ -19,7 +27,7 @@ class _DummyCircuitProver(object):
 class CircuitProver(object):
     __metaclass__ = giraffelib.parse_pws.FromPWS
 
-    def __init__(self, nCopies, nInputs, in0vv, in1vv, typevv, muxvv=None):
+    def __init__(self, nCopies, nInputs, in0vv, in1vv, typevv, muxvv=None, engine="giraffe"):
         self.nCopies = nCopies
         self.nCopyBits = util.clog2(nCopies)
         self.nInBits = util.clog2(nInputs)
@@ -28,6 +36,10 @@ class CircuitProver(object):
         self.muxbits = []
         self.layerNum = 0
         self.roundNum = 0
+        # send sumcheck messages as evaluations rather than coefficients
+        self.eval_form = False
+        # if not None, a parallel.ShardPool for the early rounds
+        self.pool = None
 
         assert len(in0vv) == len(in1vv)
         assert len(in0vv) == len(typevv)
@@ -36,13 +48,27 @@ class CircuitProver(object):
             muxvv = [None] * len(in0vv)
 
         # build circuit and provers layer-by-layer
-        self.layers = [InputLayer(self.nInBits)]
-        self.arith_circuit = ArithCircuitBuilder(nCopies, nInputs, in0vv, in1vv, typevv, muxvv)
-        self.arith_circuit.set_muxbits(self.muxbits)
+        layerProver = ENGINES[engine]
+        with util.gc_paused():
+            self.layers = [InputLayer(self.nInBits)]
+            self.arith_circuit = ArithCircuitBuilder(nCopies, nInputs, in0vv, in1vv, typevv, muxvv)
+            self.arith_circuit.set_muxbits(self.muxbits)
+
+            for (lay, (in0v, in1v, muxv, typev)) in enumerate(zip(in0vv, in1vv, muxvv, typevv)):
+                # layer prover
+                self.layers.append(layerProver(self.layers[lay], self, in0v, in1v, typev, muxv))
+
+    # number of duplicate gates in each layer (first layer first), each of
+    # which the prover and the arithmetic circuit evaluate only once
+    def get_dedup_counts(self):
+        return [ lay.nDupGates for lay in self.layers[1:] ]
+
+    def set_eval_form(self, evalForm):
+        self.eval_form = evalForm
 
-        for (lay, (in0v, in1v, muxv, typev)) in enumerate(zip(in0vv, in1vv, muxvv, typevv)):
-            # layer prover
-            self.layers.append(LayerProver(self.layers[lay], self, in0v, in1v, typev, muxv))
+    # call before set_inputs
+    def set_pool(self, pool):
+        self.pool = pool
 
     def set_muxbits(self, muxbits):
         assert len(muxbits) == len(self.muxbits)
@@ -58,6 +84,8 @@ class CircuitProver(object):
         (self.ckt_outputs, out)  = self.arith_circuit.run(inputs)
         for i in range(0, len(self.layers) - 1):
             self.layers[i+1].set_inputs(out[i])
+            # each layer's outputs are the next layer's inputs
+            self.layers[i+1].set_outputs(out[i+1] if i + 1 < len(out) else self.ckt_outputs)
 
     def current_layer(self):
         return self.layers[len(self.layers) - 1 - self.layerNum]
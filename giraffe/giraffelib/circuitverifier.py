@@ -4,21 +4,28 @@
 #
 # verifier
 
+import giraffelib.fieldvec as fieldvec
 import giraffelib.parse_pws
 import giraffelib.util as util
 from giraffelib.defs import Defs, FArith
 from giraffelib.circuitprover import CircuitProver
-from giraffelib.gateprover import GateFunctions
+from giraffelib.gateprover import GateFunctions, LinearGateProver, CMulGateProver, CAddGateProver, early_round_degree
 
 class CircuitVerifier(object):
     __metaclass__ = giraffelib.parse_pws.FromPWS
 
+    # ask the prover for sumcheck messages as evaluations rather than coefficients
+    eval_form = False
+    # layer prover engine for build_prover and build_provers (see circuitprover.ENGINES)
+    engine = "giraffe"
+
     def __init__(self, nCopies, nInputs, in0vv, in1vv, typvv, muxvv=None):
         self.nCopies = nCopies
         self.nCopyBits = util.clog2(nCopies)
         self.nInputs = nInputs
         self.nInBits = util.clog2(nInputs)
         self.prover = None
+        self.provers = None
         self.in0vv = in0vv
         self.in1vv = in1vv
         self.typvv = typvv
@@ -38,12 +45,26 @@ class CircuitVerifier(object):
         self.layOutBits = [ util.clog2(len(lay)) for lay in reversed(self.in0vv) ]
         self.layInBits = self.layOutBits[1:] + [self.nInBits]
 
+        # number of coefficients (or evaluations) in each layer's early-round messages
+        self.layEarlyLens = [ 1 + early_round_degree(typv) for typv in reversed(self.typvv) ]
+
+    # constant-operand gates cost the same as their two-wire counterparts
+    local_cost_types = {'cmul': 'mul', 'cadd': 'add'}
+
     def local_costs(self):
         gate_types = {}
 
-        for typv in self.typvv:
-            for typ in typv:
+        for (in1v, typv) in zip(self.in1vv, self.typvv):
+            for (in1, typ) in zip(in1v, typv):
+                if typ is LinearGateProver:
+                    # a sub for each -1 coefficient, an add for each other term after the first,
+                    # and a mul for each coefficient other than +/-1
+                    gate_types['add'] = gate_types.get('add', 0) + len([ 1 for coeff in in1[1:] if coeff != -1 ])
+                    gate_types['sub'] = gate_types.get('sub', 0) + len([ 1 for coeff in in1 if coeff == -1 ])
+                    gate_types['mul'] = gate_types.get('mul', 0) + len([ 1 for coeff in in1 if coeff not in (1, -1) ])
+                    continue
                 attrName = getattr(typ, 'gate_type', None)
+                attrName = self.local_cost_types.get(attrName, attrName)
                 gate_types[attrName] = 1 + gate_types.get(attrName, 0)
 
         for gtype in gate_types:
@@ -52,117 +73,191 @@ class CircuitVerifier(object):
         return gate_types
 
     def build_prover(self):
-        self.set_prover(CircuitProver(self.nCopies, self.nInputs, self.in0vv, self.in1vv, self.typvv, self.muxvv))
+        self.set_prover(CircuitProver(self.nCopies, self.nInputs, self.in0vv, self.in1vv, self.typvv, self.muxvv, self.engine))
         return self.prover
 
     def set_prover(self, prover):
         self.prover = prover
 
+    def build_provers(self, nProofs):
+        self.set_provers([ CircuitProver(self.nCopies, self.nInputs, self.in0vv, self.in1vv, self.typvv, self.muxvv, self.engine)
+                           for _ in range(0, nProofs) ])
+        return self.provers
+
+    def set_provers(self, provers):
+        self.provers = provers
+
     def run(self, inputs, muxbits=None):
+        assert self.prover is not None
+        self.verify([self.prover], [inputs], muxbits)
+
+    def run_batch(self, inputsList, muxbits=None):
+        assert self.provers is not None and len(self.provers) == len(inputsList)
+        self.verify(self.provers, inputsList, muxbits)
+
+    # verify one proof per entry of inputsList. Each proof gets its own challenges,
+    # but the per-round checks for all proofs are done together (see msg_sums and msg_evals)
+    def verify(self, provers, inputsList, muxbits=None):
         ############
         # 0. Setup #
         ############
-        assert self.prover is not None
+        nProofs = len(provers)
 
         # set inputs and outputs
-        self.prover.set_inputs(inputs)
-        self.inputs = []
-        for ins in inputs:
-            self.inputs.extend(ins + [0] * (2**self.nInBits - len(ins)))
-        self.outputs = util.flatten(self.prover.ckt_outputs)
+        allInputs = []
+        allOutputs = []
+        for (prover, inputs) in zip(provers, inputsList):
+            prover.set_eval_form(self.eval_form)
+            prover.set_inputs(inputs)
+            ins = []
+            for inp in inputs:
+                ins.extend(inp + [0] * (2**self.nInBits - len(inp)))
+            allInputs.append(ins)
+            allOutputs.append(util.flatten(prover.ckt_outputs))
+        (self.inputs, self.outputs) = (allInputs[0], allOutputs[0])
 
         # set muxbits
         self.muxbits = muxbits
         if muxbits is not None:
-            self.prover.set_muxbits(muxbits)
+            for prover in provers:
+                prover.set_muxbits(muxbits)
 
         ###############################################
         # 1. Compute multilinear extension of outputs #
         ###############################################
         nOutBits = util.clog2(len(self.in0vv[-1]))
-        assert util.clog2(len(self.outputs)) == nOutBits + self.nCopyBits
+        z1s = []
+        z2s = []
+        expectNext = []
+        for (prover, outputs) in zip(provers, allOutputs):
+            assert util.clog2(len(outputs)) == nOutBits + self.nCopyBits
 
-        # pad out to power-of-2 number of copies
-        self.outputs += [0] * (2 ** (nOutBits + self.nCopyBits) - len(self.outputs))
+            # pad out to power-of-2 number of copies
+            outputs += [0] * (2 ** (nOutBits + self.nCopyBits) - len(outputs))
 
-        # generate random point in (z1, z2) \in F^{nOutBits + nCopyBits}
-        z1 = [ Defs.gen_random() for _ in range(0, nOutBits) ]
-        z2 = [ Defs.gen_random() for _ in range(0, self.nCopyBits) ]
-        self.prover.set_z(z1, z2)
+            # generate random point in (z1, z2) \in F^{nOutBits + nCopyBits}
+            z1 = [ Defs.gen_challenge() for _ in range(0, nOutBits) ]
+            z2 = [ Defs.gen_challenge() for _ in range(0, self.nCopyBits) ]
+            prover.set_z(z1, z2)
+            z1s.append(z1)
+            z2s.append(z2)
 
-        # eval mlext of output at (z1,z2)
-        output_mlext = VerifierIOMLExt(z1 + z2, self.out_a)
-        expectNext = output_mlext.compute(self.outputs)
+            # eval mlext of output at (z1,z2)
+            expectNext.append(VerifierIOMLExt(z1 + z2, self.out_a).compute(outputs))
 
         ##########################################
         # 2. Interact with prover for each layer #
         ##########################################
         for lay in range(0, len(self.in0vv)):
             nInBits = self.layInBits[lay]
-            nOutBits = self.layOutBits[lay]
-
-            # random coins for this round
-            w3 = [ Defs.gen_random() for _ in range(0, self.nCopyBits) ]
-            w1 = [ Defs.gen_random() for _ in range(0, nInBits) ]
-            w2 = [ Defs.gen_random() for _ in range(0, nInBits) ]
 
-            # convenience
-            ws = w3 + w1 + w2
+            # random coins for this round, one set per proof
+            w3s = [ [ Defs.gen_challenge() for _ in range(0, self.nCopyBits) ] for _ in range(0, nProofs) ]
+            w1s = [ [ Defs.gen_challenge() for _ in range(0, nInBits) ] for _ in range(0, nProofs) ]
+            w2s = [ [ Defs.gen_challenge() for _ in range(0, nInBits) ] for _ in range(0, nProofs) ]
+            wss = [ w3 + w1 + w2 for (w3, w1, w2) in zip(w3s, w1s, w2s) ]
 
             ###################
             ### A. Sumcheck ###
             ###################
             for rd in range(0, 2 * nInBits + self.nCopyBits):
-                # get output from prv and check against expected value
-                outs = self.prover.get_outputs()
-                gotVal = (outs[0] + sum(outs)) % Defs.prime
-                self.sc_a.did_add(len(outs))
+                # get outputs from prvs and check against expected values
+                allOuts = [ prover.get_outputs() for prover in provers ]
+                for (idx, outs) in enumerate(allOuts):
+                    assert len(outs) == self.round_msg_len(lay, rd), "Wrong degree in round %d of layer %d for proof %d" % (rd, lay, idx)
 
-                assert expectNext == gotVal, "Verification failed in round %d of layer %d" % (rd, lay)
+                for (idx, (expect, got)) in enumerate(zip(expectNext, self.msg_sums(allOuts))):
+                    assert expect == got, "Verification failed in round %d of layer %d for proof %d" % (rd, lay, idx)
 
                 # go to next round
-                self.prover.next_round(ws[rd])
-                expectNext = util.horner_eval(outs, ws[rd], self.sc_a)
-
-            outs = self.prover.get_outputs()
-            v1 = outs[0] % Defs.prime
-            v2 = sum(outs) % Defs.prime
-            self.tV_a.did_add(len(outs)-1)
-
-            ############################################
-            ### B. Evaluate mlext of wiring predicates #
-            ############################################
-            tV_eval = self.eval_mlext(lay, z1, z2, w1, w2, w3, v1, v2)
-
-            # check that we got the correct value from the last round of the sumcheck
-            assert expectNext == tV_eval, "Verification failed computing tV for layer %d" % lay
-
-            ###############################
-            ### C. Extend to next layer ###
-            ###############################
-            tau = Defs.gen_random()
-            if lay < len(self.in0vv) - 1:
-                self.prover.next_layer(tau)
-            expectNext = util.horner_eval(outs, tau, self.nlay_a)
-
-            # next z values
-            # z1 = w1 + ( w2 - w1 ) * tau; z2 is just w3
-            z1 = [ (elm1 + (elm2 - elm1) * tau) % Defs.prime for (elm1, elm2) in zip(w1, w2) ]
-            self.nlay_a.did_sub(len(w1))
-            self.nlay_a.did_mul(len(w1))
-            self.nlay_a.did_add(len(w1))
-            z2 = w3
+                for (prover, ws) in zip(provers, wss):
+                    prover.next_round(ws[rd])
+                expectNext = self.msg_evals(allOuts, [ ws[rd] for ws in wss ], self.sc_a, util.SUMCHECK_EVAL_POINTS)
+
+            allOuts = [ prover.get_outputs() for prover in provers ]
+            taus = [ Defs.gen_challenge() for _ in range(0, nProofs) ]
+            for (idx, outs) in enumerate(allOuts):
+                if self.eval_form:
+                    # outs are H(0), H(1), ..., H(nInBits)
+                    v1 = outs[0] % Defs.prime
+                    v2 = outs[1] % Defs.prime
+                else:
+                    v1 = outs[0] % Defs.prime
+                    v2 = sum(outs) % Defs.prime
+                    self.tV_a.did_add(len(outs)-1)
+
+                ############################################
+                ### B. Evaluate mlext of wiring predicates #
+                ############################################
+                tV_eval = self.eval_mlext(lay, z1s[idx], z2s[idx], w1s[idx], w2s[idx], w3s[idx], v1, v2)
+
+                # check that we got the correct value from the last round of the sumcheck
+                assert expectNext[idx] == tV_eval, "Verification failed computing tV for layer %d for proof %d" % (lay, idx)
+
+                ###############################
+                ### C. Extend to next layer ###
+                ###############################
+                if lay < len(self.in0vv) - 1:
+                    provers[idx].next_layer(taus[idx])
+
+                # next z values
+                # z1 = w1 + ( w2 - w1 ) * tau; z2 is just w3
+                tau = taus[idx]
+                z1s[idx] = [ (elm1 + (elm2 - elm1) * tau) % Defs.prime for (elm1, elm2) in zip(w1s[idx], w2s[idx]) ]
+                self.nlay_a.did_sub(nInBits)
+                self.nlay_a.did_mul(nInBits)
+                self.nlay_a.did_add(nInBits)
+                z2s[idx] = w3s[idx]
+
+            expectNext = self.msg_evals(allOuts, taus, self.nlay_a)
 
         ##############################################
         # 3. Compute multilinear extension of inputs #
         ##############################################
         # Finally, evaluate mlext of input at z1, z2
-        assert util.clog2(len(self.inputs)) == self.nInBits + self.nCopyBits
-        self.inputs += [0] * (2 ** (self.nInBits + self.nCopyBits) - len(self.inputs))
-        input_mlext = VerifierIOMLExt(z1 + z2, self.in_a)
-        input_mlext_eval = input_mlext.compute(self.inputs)
-
-        assert input_mlext_eval == expectNext, "Verification failed checking input mlext"
+        for (idx, inputs) in enumerate(allInputs):
+            assert util.clog2(len(inputs)) == self.nInBits + self.nCopyBits
+            inputs += [0] * (2 ** (self.nInBits + self.nCopyBits) - len(inputs))
+            input_mlext_eval = VerifierIOMLExt(z1s[idx] + z2s[idx], self.in_a).compute(inputs)
+
+            assert input_mlext_eval == expectNext[idx], "Verification failed checking input mlext for proof %d" % idx
+
+    # each proof's claimed sum for this round, from its message: f(0) + f(1).
+    # The messages form a (nProofs x nCoeffs) matrix, so this is one dot_rows
+    def msg_sums(self, allOuts):
+        nCoeffs = len(allOuts[0])
+        fv = fieldvec.get(len(allOuts) * nCoeffs)
+        if self.eval_form:
+            # outs are f(0), f(1), ... at util.SUMCHECK_EVAL_POINTS
+            weights = [1, 1] + [0] * (nCoeffs - 2)
+            self.sc_a.did_add(len(allOuts))
+        else:
+            # c0 + (c0 + c1 + ... + cn)
+            weights = [2] + [1] * (nCoeffs - 1)
+            self.sc_a.did_add(len(allOuts) * nCoeffs)
+        return fv.tolist(fv.dot_rows(fv.vector(util.flatten(allOuts)), fv.vector(weights)))
+
+    # each proof's message evaluated at its challenge. In eval_form, messages are
+    # evaluations at nodes (by default 0, 1, ...); otherwise they're coefficients,
+    # and all of them are evaluated with one horner_rows
+    def msg_evals(self, allOuts, vals, rec, nodes=None):
+        nCoeffs = len(allOuts[0])
+        if self.eval_form:
+            if nodes is not None:
+                nodes = nodes[:nCoeffs]
+            return [ util.barycentric_eval(outs, val, rec, nodes) for (outs, val) in zip(allOuts, vals) ]
+
+        fv = fieldvec.get(len(allOuts) * nCoeffs)
+        rec.did_mul(len(allOuts) * (nCoeffs - 1))
+        rec.did_add(len(allOuts) * (nCoeffs - 1))
+        return fv.tolist(fv.horner_rows(fv.vector(util.flatten(allOuts)), fv.vector(vals)))
+
+    # a sumcheck message must have exactly the degree of its round polynomial:
+    # cubic or quadratic in w3 rounds depending on the layer's gates, quadratic in w1 and w2 rounds
+    def round_msg_len(self, lay, rd):
+        if rd < self.nCopyBits:
+            return self.layEarlyLens[lay]
+        return 3
 
     ######################################
     # Evaluate of g_{z1, z2}(w3, w1, w2) #
@@ -190,13 +285,34 @@ class CircuitVerifier(object):
         self.tV_a.did_mul(2*len(w3)-1)
 
         layN = -1 - lay # idx into in0vv, etc
-        mlext_evals = [0] * len(GateFunctions)
+        mlext_evals = util.LazyAccum(len(GateFunctions))
+        nTerms = 0
         for (out, (in0, in1, typ)) in enumerate(zip(self.in0vv[layN], self.in1vv[layN], self.typvv[layN])):
+            typeidx = typ.gate_type_idx
+            if typeidx == LinearGateProver.gate_type_idx:
+                # one term per input wire, with in0 = in1 = that wire, weighted by its coefficient
+                for (inp, coeff) in zip(in0, in1):
+                    mlext_evals.add_at(typeidx, coeff * mlx_z1[out] * mlx_w1[inp] * mlx_w2[inp])
+                nTerms += len(in0)
+                continue
+
+            if typeidx in (CMulGateProver.gate_type_idx, CAddGateProver.gate_type_idx):
+                # in0 = in1 = the input wire, and in1 in the description is the constant,
+                # which goes into the weight: c * V(w1) or V(w1) + c * 1
+                tval = mlx_z1[out] * mlx_w1[in0] * mlx_w2[in0]
+                nTerms += 1
+                if typeidx == CMulGateProver.gate_type_idx:
+                    mlext_evals.add_at(typeidx, in1 * tval)
+                else:
+                    mlext_evals.add_at(typeidx, tval)
+                    mlext_evals.add_at(CAddGateProver.const_idx, in1 * tval)
+                continue
+
             # evaluate this gate's wiring predicate's multilinear extension
-            tval = (mlx_z1[out] * mlx_w1[in0] * mlx_w2[in1]) % Defs.prime
+            tval = mlx_z1[out] * mlx_w1[in0] * mlx_w2[in1]
+            nTerms += 1
 
             # figure out the gate's type
-            typeidx = typ.gate_type_idx
             if typeidx == 3:
                 if self.muxvv is not None:
                     mux = self.muxvv[layN][out]
@@ -204,20 +320,26 @@ class CircuitVerifier(object):
                     typeidx += muxb
 
             # store
-            mlext_evals[typeidx] += tval
-            mlext_evals[typeidx] %= Defs.prime
-        self.tV_a.did_mul(2*len(self.in0vv[layN]))
-        self.tV_a.did_add(len(self.in0vv[layN]))
+            mlext_evals.add_at(typeidx, tval)
+        mlext_evals = mlext_evals.value()
+        self.tV_a.did_mul(2*nTerms)
+        self.tV_a.did_add(nTerms)
+
+        # the slots from linear gates on are only needed in layers that have those gates
+        used = set( typ.gate_type_idx for typ in self.typvv[layN] )
+        if CAddGateProver.gate_type_idx in used:
+            used.add(CAddGateProver.const_idx)
+        slots = [ idx for idx in range(0, len(mlext_evals)) if idx < LinearGateProver.gate_type_idx or idx in used ]
 
         # evaluate \tV
         tV_eval = 0
-        for (idx, elm) in enumerate(mlext_evals):
-            tV_eval += elm * GateFunctions[idx](v1, v2)
+        for idx in slots:
+            tV_eval += mlext_evals[idx] * GateFunctions[idx](v1, v2)
             tV_eval %= Defs.prime
         tV_eval *= mlx_z2
         tV_eval %= Defs.prime
-        self.tV_a.did_add(len(mlext_evals)-1)
-        self.tV_a.did_mul(len(mlext_evals)+1)
+        self.tV_a.did_add(len(slots)-1)
+        self.tV_a.did_mul(len(slots)+1)
 
         return tV_eval
 
@@ -247,8 +369,6 @@ class VerifierIOMLExt(object):
         inputs = inputs + [0] * ((2 ** len(self.z_vals)) - len(inputs))
 
         intermeds = [None] * len(self.z_vals)
-        total_adds = 0
-        total_muls = 0
         retval = None
         for (idx, val) in enumerate(inputs):
             for i in range(0, len(intermeds)):
@@ -258,22 +378,21 @@ class VerifierIOMLExt(object):
                     chi = self.mzp1_vals[i]
                 val *= chi
                 val %= Defs.prime
-                total_muls += 1
 
                 if intermeds[i] is None:
                     intermeds[i] = val
                     break
                 else:
                     val = (val + intermeds[i]) % Defs.prime
-                    total_adds += 1
                     intermeds[i] = None
 
                 if i == len(intermeds) - 1:
                     retval = val
 
         if self.rec is not None:
-            self.rec.did_add(total_adds)
-            self.rec.did_mul(total_muls)
+            # this is a binary tree: one mul per node except the root, one add per internal node
+            self.rec.did_add(len(inputs) - 1)
+            self.rec.did_mul(2 * len(inputs) - 2)
 
         return retval
 
@@ -358,19 +477,25 @@ class VerifierIOMLExt(object):
         if len(first_half) > 0:
             # compute first-half zvals
             fhz = VerifierIOMLExt.compute_beta(first_half, self.rec)
-            second_ins = []
-            for i in range(0, 2 ** len(second_half)):
-                accum = 0
-                addmul = 0
-                for (f, inp) in zip(fhz, inputs[i*len(fhz):(i+1)*len(fhz)]):
-                    if inp != 0:
-                        accum += f * inp
-                        accum %= Defs.prime
-                        addmul += 1
-                second_ins.append(accum)
-                if self.rec is not None:
-                    self.rec.did_mul(addmul)
-                    self.rec.did_add(addmul)
+
+            # one row of inputs per second-half index, dotted with fhz
+            fv = fieldvec.get(len(inputs))
+            if fv.vectorized:
+                second_ins = fv.tolist(fv.dot_rows(fv.vector(inputs), fv.vector(fhz)))
+            else:
+                second_ins = []
+                for i in range(0, 2 ** len(second_half)):
+                    accum = 0
+                    for (f, inp) in zip(fhz, inputs[i*len(fhz):(i+1)*len(fhz)]):
+                        if inp != 0:
+                            accum += f * inp
+                    second_ins.append(accum % Defs.prime)
+
+            if self.rec is not None and self.rec.counting:
+                # one mul and one add for each nonzero input
+                nnz = len(inputs) - inputs.count(0)
+                self.rec.did_mul(nnz)
+                self.rec.did_add(nnz)
         else:
             second_ins = inputs
 
@@ -378,37 +503,22 @@ class VerifierIOMLExt(object):
 
     @classmethod
     def compute_beta(cls, z, rec=None):
-        # once it's small enough, just compute directly
-        if len(z) == 2:
-            ret = []
-            omz0 = (1 - z[0]) % Defs.prime
-            omz1 = (1 - z[1]) % Defs.prime
+        if rec is not None:
+            cls.count_beta(len(z), rec)
 
-            if rec is not None:
-                rec.did_sub(2)
-                rec.did_mul(4)
+        fv = fieldvec.get(2 ** len(z))
+        table = fieldvec.chi_table(z, fv)
+        return fv.tolist(table) if fv.vectorized else table
 
-            return [(omz0 * omz1) % Defs.prime,
-                    (z[0] * omz1) % Defs.prime,
-                    (omz0 * z[1]) % Defs.prime,
-                    (z[0] * z[1]) % Defs.prime]
-
-        elif len(z) == 1:
-            if rec is not None:
-                rec.did_sub(1)
-
-            return [(1 - z[0]) % Defs.prime, z[0]]
-
-        elif len(z) == 0:
-            return []
-
-        # otherwise, use recursive sqrt trick
-        fh = cls.compute_beta(z[:len(z)//2], rec)
-        sh = cls.compute_beta(z[len(z)//2:], rec)
-
-        # cartesian product
-        retval = []
-        for s in sh:
-            retval.extend([ s * f % Defs.prime for f in fh ])
-
-        return retval
+    @classmethod
+    def count_beta(cls, nz, rec):
+        # V's cost model: tables of size at most 4 are computed directly, and larger
+        # tables are the (uncounted) cartesian product of the tables for each half of z
+        if nz == 2:
+            rec.did_sub(2)
+            rec.did_mul(4)
+        elif nz == 1:
+            rec.did_sub(1)
+        elif nz > 2:
+            cls.count_beta(nz // 2, rec)
+            cls.count_beta(nz - nz // 2, rec)
@@ -4,6 +4,7 @@
 #
 # Defs for circuits
 
+import os
 import random
 
 class Defs(object):
@@ -16,24 +17,136 @@ class Defs(object):
 
     savebits = False
 
+    # field arithmetic backend and scalar element type, see giraffelib.fieldvec
+    backend = "ref"
+    ftype = int
+
+    # how many additions a LazyAccum does before reducing mod prime; 1 reduces every time
+    reduce_interval = 256
+
+    # field op accounting. Set GIRAFFE_NO_FARITH in the environment to turn it off for
+    # the whole run; FArith categories are then no-ops and their counts are all zero.
+    track_fArith = not os.environ.get("GIRAFFE_NO_FARITH")
+
+    # extension field challenges: when ext_nr is not None, the verifier's random
+    # challenges come from F_p[i] / (i^2 - ext_nr), see util.set_extension
+    ext_nr = None
+
     @classmethod
     def gen_random(cls):
         if cls.rand is None:
             cls.rand = random.SystemRandom()
 
         # random nonzero value
-        return cls.rand.randint(1, cls.prime - 1)
+        return cls.ftype(cls.rand.randint(1, int(cls.prime) - 1))
+
+    @classmethod
+    def gen_challenge(cls):
+        if cls.ext_nr is None:
+            return cls.gen_random()
+
+        if cls.rand is None:
+            cls.rand = random.SystemRandom()
+
+        # random nonzero extension field element
+        (a, b) = (0, 0)
+        while a == 0 and b == 0:
+            a = cls.rand.randint(0, int(cls.prime) - 1)
+            b = cls.rand.randint(0, int(cls.prime) - 1)
+        return Fp2(cls.ftype(a), cls.ftype(b))
+
+# a + b * i in F_p[i] / (i^2 - Defs.ext_nr)
+#
+# Fp2 mixes freely with plain (base field) values, so the prover and verifier
+# code works unchanged when challenges come from the extension: base * base is
+# still an ordinary int multiply, base * ext costs two, and ext * ext costs three.
+# Like ints, results are left unreduced until they are taken % Defs.prime.
+class Fp2(object):
+    __slots__ = ('a', 'b')
+
+    def __init__(self, a, b=0):
+        self.a = a
+        self.b = b
+
+    def __add__(self, other):
+        if isinstance(other, Fp2):
+            return Fp2(self.a + other.a, self.b + other.b)
+        return Fp2(self.a + other, self.b)
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Fp2):
+            return Fp2(self.a - other.a, self.b - other.b)
+        return Fp2(self.a - other, self.b)
+
+    def __rsub__(self, other):
+        return Fp2(other - self.a, -self.b)
+
+    def __neg__(self):
+        return Fp2(-self.a, -self.b)
+
+    def __mul__(self, other):
+        if isinstance(other, Fp2):
+            # Karatsuba: three multiplies, plus one by the (small) non-residue
+            ac = self.a * other.a
+            bd = self.b * other.b
+            return Fp2(ac + Defs.ext_nr * bd, (self.a + self.b) * (other.a + other.b) - ac - bd)
+        return Fp2(self.a * other, self.b * other)
+    __rmul__ = __mul__
+
+    def __mod__(self, mod):
+        return Fp2(self.a % mod, self.b % mod)
+
+    def conj(self):
+        return Fp2(self.a, -self.b)
+
+    def norm(self):
+        # (a + bi)(a - bi), which is in the base field
+        return (self.a * self.a - Defs.ext_nr * self.b * self.b) % Defs.prime
+
+    # comparisons are mod Defs.prime
+    def __eq__(self, other):
+        if isinstance(other, Fp2):
+            return (self.a - other.a) % Defs.prime == 0 and (self.b - other.b) % Defs.prime == 0
+        return (self.a - other) % Defs.prime == 0 and self.b % Defs.prime == 0
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __nonzero__(self):
+        return self != 0
+
+    def __hash__(self):
+        if self.b % Defs.prime == 0:
+            return hash(self.a % Defs.prime)
+        return hash((self.a % Defs.prime, self.b % Defs.prime))
+
+    def __repr__(self):
+        return "Fp2(%d, %d)" % (self.a, self.b)
 
 class FArith(object):
+    _null = None
+
     def __init__(self):
         self.add_count = {}
         self.mul_count = {}
         self.sub_count = {}
 
     def new_cat(self, cat):
+        if not Defs.track_fArith:
+            return self._NullFArithCat(cat)
         return self._FArithCat(self, cat)
 
+    # for callers that need a category but don't care about its counts
+    @classmethod
+    def null_cat(cls):
+        return cls._null
+
+    # Counts are recorded in bulk: callers work out how many ops a loop does
+    # and call did_add(n) etc. once, rather than once per op.
     class _FArithCat(object):
+        counting = True
+
         def __init__(self, parent, cat):
             self.parent = parent
             self.cat = cat
@@ -81,3 +194,33 @@ class FArith(object):
             add = self.parent.add_count.get(self.cat, 0)
             sub = self.parent.sub_count.get(self.cat, 0)
             return (mul, add, sub)
+
+    # same interface as _FArithCat, but counts nothing
+    class _NullFArithCat(_FArithCat):
+        counting = False
+
+        def __init__(self, cat):
+            super(FArith._NullFArithCat, self).__init__(None, cat)
+
+        def did_add(self, n=1):
+            pass
+        @staticmethod
+        def add(x, y):
+            return (x + y) % Defs.prime
+
+        def did_mul(self, n=1):
+            pass
+        @staticmethod
+        def mul(x, y):
+            return (x * y) % Defs.prime
+
+        def did_sub(self, n=1):
+            pass
+        @staticmethod
+        def sub(x, y):
+            return (x - y) % Defs.prime
+
+        def get_counts(self):
+            return (0, 0, 0)
+
+FArith._null = FArith._NullFArithCat("null") # pylint: disable=protected-access
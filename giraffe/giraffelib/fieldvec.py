@@ -0,0 +1,1058 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# vectorized field arithmetic backends
+#
+# Each backend is a class of static methods operating on that backend's native
+# vector type. The reference backend works on lists of Python ints, so it needs
+# nothing outside the standard library. The other backends are optional and are
+# only usable when their dependencies are installed and they support Defs.prime.
+#
+# A backend also decides the type of scalar field elements (Defs.ftype). For
+# the mpz backend this is gmpy2.mpz; since Defs.prime is then an mpz, every
+# "% Defs.prime" in giraffelib produces mpz values.
+#
+# Backends only do arithmetic; callers account field ops in their own recs.
+
+from itertools import islice, izip
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+from giraffelib.defs import Defs, Fp2
+
+class RefFieldVec(object):
+    name = "ref"
+    vectorized = False
+    min_size = 0
+
+    @staticmethod
+    def supports(_):
+        return True
+
+    # scalar element type
+    elem = int
+
+    @staticmethod
+    def invert(val):
+        s  = t_ = 0
+        s_ = t  = 1
+        r  = val
+        r_ = Defs.prime
+
+        while r != 0:
+            q = r_ // r
+            (r_, r) = (r, r_ - q * r)
+            (s_, s) = (s, s_ - q * s)
+            (t_, t) = (t, t_ - q * t)
+
+        return t_ % Defs.prime
+
+    @staticmethod
+    def vector(vals):
+        return list(vals)
+
+    @staticmethod
+    def tolist(vec):
+        return list(vec)
+
+    @staticmethod
+    def item(vec, idx):
+        return vec[idx]
+
+    @staticmethod
+    def fold(vec, val):
+        # out[i] = vec[2i] * (1 - val) + vec[2i+1] * val
+        valInv = (1 - val) % Defs.prime
+        return [ (vec[2 * i] * valInv + vec[2 * i + 1] * val) % Defs.prime for i in range(0, len(vec) // 2) ]
+
+    @staticmethod
+    def alloc(n):
+        return [0] * n
+
+    @staticmethod
+    def alloc_temps(_):
+        return None
+
+    @staticmethod
+    def fold_into(vec, val, out, temps=None, n=None):
+        # like fold, but the result goes into out (which may be vec itself, since
+        # out[i] only depends on vec[2i] and vec[2i+1]). temps is scratch space from
+        # alloc_temps. Only the first n elements of vec are read (by default, all of
+        # them), and lists are never shortened: the result is out itself, of which
+        # only the first n // 2 elements are meaningful, so callers track the length.
+        valInv = (1 - val) % Defs.prime
+        if n is None:
+            n = len(vec)
+        half = n // 2
+        if len(out) < half:
+            out.extend([0] * (half - len(out)))
+        pairs = islice(vec, 0, 2 * half)
+        for (i, (even, odd)) in enumerate(izip(pairs, pairs)):
+            out[i] = (even * valInv + odd * val) % Defs.prime
+        return out
+
+    @staticmethod
+    def fold_points(vec, x):
+        # fold vec at each point in x, giving a row-major matrix with len(x) rows.
+        # vec is read once: out[k][i] = vec[2i] + (vec[2i+1] - vec[2i]) * x[k]
+        evens = vec[0::2]
+        diffs = [ odd - even for (even, odd) in izip(evens, vec[1::2]) ]
+        return [ (even + diff * val) % Defs.prime for val in x for (even, diff) in izip(evens, diffs) ]
+
+    @staticmethod
+    def fold_rows(vec, x):
+        # treat vec as a row-major matrix with len(x) rows; fold row k at x[k]
+        ncols = len(vec) // len(x)
+        out = []
+        for (k, val) in enumerate(x):
+            row = vec[k*ncols:(k+1)*ncols]
+            out.extend( (even + (odd - even) * val) % Defs.prime for (even, odd) in izip(row[0::2], row[1::2]) )
+        return out
+
+    @staticmethod
+    def expand(vec, ncopies):
+        out = []
+        for elm in vec:
+            out.extend([elm] * ncopies)
+        return out
+
+    @staticmethod
+    def outer(a, b):
+        # out[i * len(b) + j] = a[i] * b[j]
+        return [ (x * y) % Defs.prime for x in a for y in b ]
+
+    @staticmethod
+    def mul(a, b):
+        return [ (x * y) % Defs.prime for (x, y) in zip(a, b) ]
+
+    @staticmethod
+    def add(a, b):
+        return [ (x + y) % Defs.prime for (x, y) in zip(a, b) ]
+
+    @staticmethod
+    def sub(a, b):
+        return [ (x - y) % Defs.prime for (x, y) in zip(a, b) ]
+
+    @staticmethod
+    def scale(vec, val):
+        return [ (x * val) % Defs.prime for x in vec ]
+
+    @staticmethod
+    def vsum(vec):
+        return sum(vec) % Defs.prime
+
+    @staticmethod
+    def dot_rows(vec, x):
+        # treat vec as a row-major matrix with len(x) columns
+        ncols = len(x)
+        return [ sum( a * b for (a, b) in zip(vec[i:i+ncols], x) ) % Defs.prime for i in range(0, len(vec), ncols) ]
+
+    @staticmethod
+    def wsum_rows(vec, w):
+        # treat vec as a row-major matrix with len(w) rows; return sum_k w[k] * row k
+        ncols = len(vec) // len(w)
+        return [ sum( a * b for (a, b) in izip(w, vec[j::ncols]) ) % Defs.prime for j in range(0, ncols) ]
+
+    @staticmethod
+    def indices(vals):
+        return list(vals)
+
+    @staticmethod
+    def shift_indices(idx, shift):
+        return [ i >> shift for i in idx ]
+
+    @staticmethod
+    def index_bits(idx, bit):
+        return [ (i >> bit) & 1 for i in idx ]
+
+    @staticmethod
+    def gather_rows(vec, ncols, idx):
+        # rows idx of a row-major matrix with ncols columns, as a row-major matrix
+        if ncols == 1:
+            return [ vec[i] for i in idx ]
+        out = []
+        for i in idx:
+            out.extend(vec[i*ncols:(i+1)*ncols])
+        return out
+
+    @staticmethod
+    def scatter_add(n, idx, vals):
+        # a vector of length n with out[idx[i]] += vals[i], i.e., the inverse of gather_rows
+        out = [0] * n
+        for (i, val) in izip(idx, vals):
+            out[i] += val
+        return [ elm % Defs.prime for elm in out ]
+
+    @staticmethod
+    def horner_rows(vec, x):
+        # treat vec as a row-major matrix with len(x) rows, each row the coefficients
+        # (constant term first) of a polynomial; evaluate row i at x[i]
+        ncols = len(vec) // len(x)
+        out = []
+        for (i, pt) in enumerate(x):
+            row = vec[i*ncols:(i+1)*ncols]
+            acc = row[-1]
+            for coeff in reversed(row[:-1]):
+                acc = (acc * pt + coeff) % Defs.prime
+            out.append(acc % Defs.prime)
+        return out
+
+class MpzFieldVec(RefFieldVec):
+    # same algorithms as the reference backend, but elements are GMP integers
+    name = "mpz"
+
+    @staticmethod
+    def supports(_):
+        return gmpy2 is not None
+
+    elem = gmpy2.mpz if gmpy2 is not None else None
+
+    @staticmethod
+    def invert(val):
+        return gmpy2.invert(val, Defs.prime)
+
+    @staticmethod
+    def vector(vals):
+        return [ gmpy2.mpz(x) for x in vals ]
+
+###
+#  arithmetic mod 2^61 - 1 on uint64 arrays
+###
+if np is not None:
+    _M61 = np.uint64(2 ** 61 - 1)
+    _M32 = np.uint64(2 ** 32 - 1)
+    _M29 = np.uint64(2 ** 29 - 1)
+    _S3 = np.uint64(3)
+    _S29 = np.uint64(29)
+    _S32 = np.uint64(32)
+    _S61 = np.uint64(61)
+
+def _m61_reduce(x):
+    # any uint64 -> [0, p)
+    x = (x & _M61) + (x >> _S61)
+    return np.where(x >= _M61, x - _M61, x)
+
+def _m61_mul(a, b):
+    # split into 32-bit halves so that every partial product fits in 64 bits
+    #   a * b = hh * 2^64 + mid * 2^32 + ll, and 2^61 = 1 mod p
+    # so 2^64 = 8, and mid * 2^32 = (mid >> 29) + (mid & (2^29 - 1)) * 2^32
+    a_lo = a & _M32
+    a_hi = a >> _S32
+    b_lo = b & _M32
+    b_hi = b >> _S32
+
+    hh = a_hi * b_hi                    # < 2^58
+    mid = a_hi * b_lo + a_lo * b_hi     # < 2^62
+    ll = a_lo * b_lo                    # < 2^64
+
+    # each summand is < 2^61, so no overflow
+    x = (hh << _S3) + (mid >> _S29) + ((mid & _M29) << _S32) + (ll >> _S61) + (ll & _M61)
+    return _m61_reduce(x)
+
+def _m61_add(a, b):
+    x = a + b
+    return np.where(x >= _M61, x - _M61, x)
+
+def _m61_sub(a, b):
+    return _m61_add(a, _M61 - b)
+
+def _m61_sum(arr, axis=None):
+    # split into 32-bit halves so that sums of up to 2^32 elements don't overflow
+    lo = np.sum(arr & _M32, axis=axis, dtype=np.uint64)
+    hi = np.sum(arr >> _S32, axis=axis, dtype=np.uint64)
+    if axis is None:
+        return ((int(hi) << 32) + int(lo)) % Defs.prime
+    return _m61_add(_m61_mul(_m61_reduce(hi), np.uint64(2 ** 32)), _m61_reduce(lo))
+
+def _scatter_halves(n, idx, arr):
+    # for scatter_add: per-index sums of the low and high 32-bit halves of arr, which
+    # (as in _m61_sum) don't overflow. Sorting by index makes each index's elements
+    # a contiguous run that np.add.reduceat can sum.
+    lo = np.zeros(n, dtype=np.uint64)
+    hi = np.zeros(n, dtype=np.uint64)
+    if len(idx) > 0:
+        order = np.argsort(idx, kind='mergesort')
+        (idx, arr) = (idx[order], arr[order])
+        starts = np.flatnonzero(np.concatenate(([True], idx[1:] != idx[:-1])))
+        lo[idx[starts]] = np.add.reduceat(arr & _M32, starts)
+        hi[idx[starts]] = np.add.reduceat(arr >> _S32, starts)
+    return (lo, hi)
+
+# fold_into works on chunks of this many outputs at a time, so its scratch space
+# (see alloc_temps) is small and stays in cache
+_FOLD_CHUNK = 2 ** 14
+
+def _fold_temps(nrows, n):
+    return np.empty((nrows, max(1, min(n, _FOLD_CHUNK))), dtype=np.uint64)
+
+def _fold_into(fold_chunk, nrows, vec, out, temps, n):
+    # fold_chunk(even, odd, rows) leaves its result in rows[0]. Each chunk of the
+    # result is computed in temps and then copied to out, so no ufunc's output
+    # overlaps vec (numpy would copy its inputs to fresh temporaries if one did).
+    # Chunk k writes out[k*c:(k+1)*c], which later chunks (which read vec[2(k+1)*c:])
+    # don't need, so out may be vec itself.
+    if n is not None:
+        vec = vec[:n]
+    half = len(vec) // 2
+    if temps is None:
+        temps = _fold_temps(nrows, half)
+    chunk = temps.shape[1]
+    for start in range(0, half, chunk):
+        end = min(half, start + chunk)
+        rows = [ row[:end-start] for row in temps ]
+        fold_chunk(vec[2*start:2*end:2], vec[2*start+1:2*end:2], rows)
+        np.copyto(out[start:end], rows[0])
+    return out[:half]
+
+# The _into functions below are for fold_into. They write their results with
+# ufunc out= arguments, so they allocate nothing; their arguments (other than
+# scalars) are overwritten. Scalars must be Python ints.
+def _m61_reduce2_into(x, tmp):
+    # [0, 2p) -> [0, p): if x < p, x - p wraps around to something bigger than x
+    np.subtract(x, _M61, out=tmp)
+    np.minimum(x, tmp, out=x)
+
+def _m61_scale_into(a, b, t1, t2, t3):
+    # a = a * b, where b is in [0, p); same steps as _m61_mul
+    (b_lo, b_hi) = (np.uint64(b & (2 ** 32 - 1)), np.uint64(b >> 32))
+    np.bitwise_and(a, _M32, out=t1)         # a_lo
+    np.right_shift(a, _S32, out=a)          # a_hi
+    np.multiply(a, b_hi, out=t2)            # hh
+    np.multiply(a, b_lo, out=a)
+    np.multiply(t1, b_hi, out=t3)
+    np.add(a, t3, out=a)                    # mid
+    np.multiply(t1, b_lo, out=t1)           # ll
+
+    np.left_shift(t2, _S3, out=t2)
+    np.right_shift(a, _S29, out=t3)
+    np.add(t2, t3, out=t2)
+    np.bitwise_and(a, _M29, out=a)
+    np.left_shift(a, _S32, out=a)
+    np.add(t2, a, out=t2)
+    np.right_shift(t1, _S61, out=t3)
+    np.add(t2, t3, out=t2)
+    np.bitwise_and(t1, _M61, out=t1)
+    np.add(t2, t1, out=t2)
+
+    # reduce, as in _m61_reduce
+    np.right_shift(t2, _S61, out=t3)
+    np.bitwise_and(t2, _M61, out=a)
+    np.add(a, t3, out=a)
+    _m61_reduce2_into(a, t3)
+
+class M61FieldVec(object):
+    name = "m61"
+    vectorized = True
+    # below this many elements, per-call overhead beats the vectorization win
+    # (measured on a full pass of folds, which ends with tiny vectors)
+    min_size = 2048
+
+    @staticmethod
+    def supports(prime):
+        return np is not None and prime == 2 ** 61 - 1
+
+    elem = int
+    invert = staticmethod(RefFieldVec.invert)
+
+    @staticmethod
+    def vector(vals):
+        # fast path for already-reduced values; numpy silently wraps negatives
+        if len(vals) > 0 and (min(vals) < 0 or max(vals) >= Defs.prime):
+            vals = [ x % Defs.prime for x in vals ]
+        return np.array(vals, dtype=np.uint64)
+
+    @staticmethod
+    def tolist(vec):
+        return vec.tolist()
+
+    @staticmethod
+    def item(vec, idx):
+        return int(vec[idx])
+
+    @staticmethod
+    def fold(vec, val):
+        # vec[2i] + (vec[2i+1] - vec[2i]) * val
+        val = np.uint64(val % Defs.prime)
+        even = vec[0::2]
+        return _m61_add(even, _m61_mul(_m61_sub(vec[1::2], even), val))
+
+    @staticmethod
+    def alloc(n):
+        return np.zeros(n, dtype=np.uint64)
+
+    @staticmethod
+    def alloc_temps(n):
+        # scratch space for fold_into with up to n outputs
+        return _fold_temps(4, n)
+
+    @staticmethod
+    def fold_into(vec, val, out, temps=None, n=None):
+        # the result is a view on the front of out
+        val = int(val % Defs.prime)
+
+        def fold_chunk(even, odd, rows):
+            (d, t1, t2, t3) = rows
+            # even + (odd - even) * val
+            np.subtract(_M61, even, out=d)
+            np.add(d, odd, out=d)
+            _m61_reduce2_into(d, t1)
+            _m61_scale_into(d, val, t1, t2, t3)
+            np.add(d, even, out=d)
+            _m61_reduce2_into(d, t1)
+
+        return _fold_into(fold_chunk, 4, vec, out, temps, n)
+
+    @staticmethod
+    def fold_points(vec, x):
+        even = vec[0::2]
+        return _m61_add(even[None, :], _m61_mul(x[:, None], _m61_sub(vec[1::2], even)[None, :])).ravel()
+
+    @staticmethod
+    def fold_rows(vec, x):
+        mat = vec.reshape(len(x), -1)
+        even = mat[:, 0::2]
+        return _m61_add(even, _m61_mul(_m61_sub(mat[:, 1::2], even), x[:, None])).ravel()
+
+    @staticmethod
+    def expand(vec, ncopies):
+        return np.repeat(vec, ncopies)
+
+    @staticmethod
+    def outer(a, b):
+        return _m61_mul(a[:, None], b[None, :]).ravel()
+
+    @staticmethod
+    def mul(a, b):
+        return _m61_mul(a, b)
+
+    @staticmethod
+    def add(a, b):
+        return _m61_add(a, b)
+
+    @staticmethod
+    def sub(a, b):
+        return _m61_sub(a, b)
+
+    @staticmethod
+    def scale(vec, val):
+        return _m61_mul(vec, np.uint64(val % Defs.prime))
+
+    @staticmethod
+    def vsum(vec):
+        return _m61_sum(vec)
+
+    @staticmethod
+    def dot_rows(vec, x):
+        return _m61_sum(_m61_mul(vec.reshape(-1, len(x)), x), axis=1)
+
+    @staticmethod
+    def wsum_rows(vec, w):
+        return _m61_sum(_m61_mul(vec.reshape(len(w), -1), w[:, None]), axis=0)
+
+    @staticmethod
+    def indices(vals):
+        return np.array(vals, dtype=np.intp)
+
+    @staticmethod
+    def shift_indices(idx, shift):
+        return idx >> shift
+
+    @staticmethod
+    def index_bits(idx, bit):
+        return (idx >> bit) & 1
+
+    @staticmethod
+    def gather_rows(vec, ncols, idx):
+        return vec.reshape(-1, ncols)[idx].ravel()
+
+    @staticmethod
+    def scatter_add(n, idx, vals):
+        (lo, hi) = _scatter_halves(n, idx, vals)
+        return _m61_add(_m61_mul(_m61_reduce(hi), np.uint64(2 ** 32)), _m61_reduce(lo))
+
+    @staticmethod
+    def horner_rows(vec, x):
+        mat = vec.reshape(len(x), -1)
+        out = mat[:, -1]
+        for j in range(mat.shape[1] - 2, -1, -1):
+            out = _m61_add(_m61_mul(out, x), mat[:, j])
+        return out
+
+###
+#  Montgomery arithmetic mod any odd p < 2^64 on uint64 arrays
+###
+# Elements are kept as x * R mod p with R = 2^64, so a product is a 64x64->128
+# bit multiply (emulated with 32-bit halves) followed by a Montgomery reduction.
+# Sums and differences are the same as for ordinary residues.
+class _MontConsts(object):
+    def __init__(self, prime):
+        # p^-1 mod 2^64 by Newton iteration; each step doubles the number of correct bits
+        pinv = prime
+        for _ in range(0, 6):
+            pinv = (pinv * (2 - prime * pinv)) % 2 ** 64
+
+        self.prime = prime
+        self.p = np.uint64(prime)
+        self.pinv = np.uint64(pinv)
+        self.one = np.uint64(2 ** 64 % prime)
+        self.r2 = np.uint64(2 ** 128 % prime)
+        self.rinv = pow(2 ** 64 % prime, prime - 2, prime)
+        # multiplying by this multiplies by 2^32
+        self.two32 = np.uint64((2 ** 96) % prime)
+
+_mont_cache = {}
+
+def _mont_consts():
+    prime = int(Defs.prime)
+    ret = _mont_cache.get(prime)
+    if ret is None:
+        ret = _mont_cache[prime] = _MontConsts(prime)
+    return ret
+
+def _mul_hi(a, b):
+    # high 64 bits of the 128-bit product a * b
+    a_lo = a & _M32
+    a_hi = a >> _S32
+    b_lo = b & _M32
+    b_hi = b >> _S32
+
+    ll = a_lo * b_lo
+    lh = a_lo * b_hi
+    hl = a_hi * b_lo
+    mid = (ll >> _S32) + (lh & _M32) + (hl & _M32)   # < 3 * 2^32
+    return a_hi * b_hi + (lh >> _S32) + (hl >> _S32) + (mid >> _S32)
+
+def _mont_mul(c, a, b):
+    # a * b / R mod p: with m = lo * p^-1 mod R, (a * b - m * p) / R = hi - mulhi(m, p),
+    # which is in (-p, p) because both terms are less than p
+    hi = _mul_hi(a, b)
+    mp_hi = _mul_hi((a * b) * c.pinv, c.p)
+    return np.where(hi >= mp_hi, hi - mp_hi, (hi - mp_hi) + c.p)
+
+def _mont_add(c, a, b):
+    # for p > 2^63, a + b can wrap
+    x = a + b
+    return np.where((x < a) | (x >= c.p), x - c.p, x)
+
+def _mont_sub(c, a, b):
+    return np.where(a >= b, a - b, (a - b) + c.p)
+
+def _mont_scalar(c, val):
+    return np.uint64(((val % c.prime) << 64) % c.prime)
+
+def _mul_hi_into(a, b, out, t1, t2, t3):
+    # out = _mul_hi(a, b), where b is a scalar
+    (b_lo, b_hi) = (np.uint64(b & (2 ** 32 - 1)), np.uint64(b >> 32))
+    np.bitwise_and(a, _M32, out=t1)         # a_lo
+    np.right_shift(a, _S32, out=a)          # a_hi
+    np.multiply(a, b_hi, out=out)           # hh
+    np.multiply(a, b_lo, out=a)             # hl
+    np.multiply(t1, b_hi, out=t2)           # lh
+    np.multiply(t1, b_lo, out=t1)           # ll
+
+    # mid = (ll >> 32) + (lh & (2^32 - 1)) + (hl & (2^32 - 1))
+    np.right_shift(t1, _S32, out=t1)
+    np.right_shift(t2, _S32, out=t3)
+    np.add(out, t3, out=out)
+    np.bitwise_and(t2, _M32, out=t2)
+    np.add(t1, t2, out=t1)
+    np.right_shift(a, _S32, out=t3)
+    np.add(out, t3, out=out)
+    np.bitwise_and(a, _M32, out=a)
+    np.add(t1, a, out=t1)
+    np.right_shift(t1, _S32, out=t1)
+    np.add(out, t1, out=out)
+
+def _mont_fix_into(c, x, mask):
+    # add p wherever mask (from a comparison) is set; this undoes a wrapped subtraction
+    np.multiply(mask, c.p, out=mask)
+    np.add(x, mask, out=x)
+
+def _mont_sum(c, arr, axis=None):
+    # as in _m61_sum, sum the 32-bit halves separately to avoid overflow
+    lo = np.sum(arr & _M32, axis=axis, dtype=np.uint64)
+    hi = np.sum(arr >> _S32, axis=axis, dtype=np.uint64)
+    if axis is None:
+        return ((int(hi) << 32) + int(lo)) % c.prime
+    return _mont_add(c, _mont_mul(c, hi % c.p, c.two32), lo % c.p)
+
+class MontFieldVec(object):
+    name = "mont"
+    vectorized = True
+    min_size = 2048
+
+    @staticmethod
+    def supports(prime):
+        return np is not None and prime % 2 == 1 and prime < 2 ** 64
+
+    elem = int
+    invert = staticmethod(RefFieldVec.invert)
+
+    @staticmethod
+    def vector(vals):
+        c = _mont_consts()
+        if len(vals) > 0 and (min(vals) < 0 or max(vals) >= Defs.prime):
+            vals = [ x % Defs.prime for x in vals ]
+        return _mont_mul(c, np.array(vals, dtype=np.uint64), c.r2)
+
+    @staticmethod
+    def tolist(vec):
+        c = _mont_consts()
+        return _mont_mul(c, vec, np.uint64(1)).tolist()
+
+    @staticmethod
+    def item(vec, idx):
+        c = _mont_consts()
+        return (int(vec[idx]) * c.rinv) % c.prime
+
+    @staticmethod
+    def fold(vec, val):
+        c = _mont_consts()
+        even = vec[0::2]
+        return _mont_add(c, even, _mont_mul(c, _mont_sub(c, vec[1::2], even), _mont_scalar(c, val)))
+
+    @staticmethod
+    def alloc(n):
+        return np.zeros(n, dtype=np.uint64)
+
+    @staticmethod
+    def alloc_temps(n):
+        return _fold_temps(6, n)
+
+    @staticmethod
+    def fold_into(vec, val, out, temps=None, n=None):
+        # as in M61FieldVec.fold_into, with the steps of _mont_sub, _mont_mul, and _mont_add
+        c = _mont_consts()
+        val = int(_mont_scalar(c, val))
+
+        def fold_chunk(even, odd, rows):
+            (d, m, hi, t1, t2, t3) = rows
+
+            # d = odd - even
+            np.subtract(odd, even, out=d)
+            np.less(odd, even, out=t1)
+            _mont_fix_into(c, d, t1)
+
+            # d * val / R: with m = lo * p^-1, this is mulhi(d, val) - mulhi(m, p)
+            np.multiply(d, np.uint64(val), out=m)
+            np.multiply(m, c.pinv, out=m)
+            _mul_hi_into(d, val, hi, t1, t2, t3)
+            _mul_hi_into(m, c.prime, d, t1, t2, t3)
+            np.less(hi, d, out=t1)
+            np.subtract(hi, d, out=hi)
+            _mont_fix_into(c, hi, t1)
+
+            # even + hi, which can wrap around 2^64 when p > 2^63
+            np.add(even, hi, out=d)
+            np.less(d, hi, out=t1)
+            np.greater_equal(d, c.p, out=t2)
+            np.bitwise_or(t1, t2, out=t1)
+            np.multiply(t1, c.p, out=t1)
+            np.subtract(d, t1, out=d)
+
+        return _fold_into(fold_chunk, 6, vec, out, temps, n)
+
+    @staticmethod
+    def fold_points(vec, x):
+        c = _mont_consts()
+        even = vec[0::2]
+        return _mont_add(c, even[None, :], _mont_mul(c, x[:, None], _mont_sub(c, vec[1::2], even)[None, :])).ravel()
+
+    @staticmethod
+    def fold_rows(vec, x):
+        c = _mont_consts()
+        mat = vec.reshape(len(x), -1)
+        even = mat[:, 0::2]
+        return _mont_add(c, even, _mont_mul(c, _mont_sub(c, mat[:, 1::2], even), x[:, None])).ravel()
+
+    @staticmethod
+    def expand(vec, ncopies):
+        return np.repeat(vec, ncopies)
+
+    @staticmethod
+    def outer(a, b):
+        c = _mont_consts()
+        return _mont_mul(c, a[:, None], b[None, :]).ravel()
+
+    @staticmethod
+    def mul(a, b):
+        return _mont_mul(_mont_consts(), a, b)
+
+    @staticmethod
+    def add(a, b):
+        return _mont_add(_mont_consts(), a, b)
+
+    @staticmethod
+    def sub(a, b):
+        return _mont_sub(_mont_consts(), a, b)
+
+    @staticmethod
+    def scale(vec, val):
+        c = _mont_consts()
+        return _mont_mul(c, vec, _mont_scalar(c, val))
+
+    @staticmethod
+    def vsum(vec):
+        c = _mont_consts()
+        return (_mont_sum(c, vec) * c.rinv) % c.prime
+
+    @staticmethod
+    def dot_rows(vec, x):
+        c = _mont_consts()
+        return _mont_sum(c, _mont_mul(c, vec.reshape(-1, len(x)), x), axis=1)
+
+    @staticmethod
+    def wsum_rows(vec, w):
+        c = _mont_consts()
+        return _mont_sum(c, _mont_mul(c, vec.reshape(len(w), -1), w[:, None]), axis=0)
+
+    @staticmethod
+    def indices(vals):
+        return np.array(vals, dtype=np.intp)
+
+    @staticmethod
+    def shift_indices(idx, shift):
+        return idx >> shift
+
+    @staticmethod
+    def index_bits(idx, bit):
+        return (idx >> bit) & 1
+
+    @staticmethod
+    def gather_rows(vec, ncols, idx):
+        return vec.reshape(-1, ncols)[idx].ravel()
+
+    @staticmethod
+    def scatter_add(n, idx, vals):
+        # as in _mont_sum
+        c = _mont_consts()
+        (lo, hi) = _scatter_halves(n, idx, vals)
+        return _mont_add(c, _mont_mul(c, hi % c.p, c.two32), lo % c.p)
+
+    @staticmethod
+    def horner_rows(vec, x):
+        c = _mont_consts()
+        mat = vec.reshape(len(x), -1)
+        out = mat[:, -1]
+        for j in range(mat.shape[1] - 2, -1, -1):
+            out = _mont_add(c, _mont_mul(c, out, x), mat[:, j])
+        return out
+
+###
+#  vectors over F_p^2 (see Defs.ext_nr) on top of a vectorized backend
+###
+class _Fp2Vec(object):
+    # re + im * i, where re and im are base backend vectors. im is None for a vector
+    # of base field values, so that ops on those cost what they do on the base backend
+    def __init__(self, re, im=None):
+        self.re = re
+        self.im = im
+
+    def __len__(self):
+        return len(self.re)
+
+    def __getitem__(self, idx):
+        # only for slices; use Fp2FieldVec.item for single elements
+        return _Fp2Vec(self.re[idx], None if self.im is None else self.im[idx])
+
+class Fp2FieldVec(object):
+    # subclasses set base, the backend that holds the real and imaginary parts
+    base = None
+    vectorized = True
+    elem = int
+    invert = staticmethod(RefFieldVec.invert)
+
+    @classmethod
+    def supports(cls, prime):
+        return cls.base.supports(prime)
+
+    @classmethod
+    def vector(cls, vals):
+        vals = list(vals)
+        if not any( isinstance(x, Fp2) for x in vals ):
+            return _Fp2Vec(cls.base.vector(vals))
+        re = [ x.a if isinstance(x, Fp2) else x for x in vals ]
+        im = [ x.b if isinstance(x, Fp2) else 0 for x in vals ]
+        return _Fp2Vec(cls.base.vector(re), cls.base.vector(im))
+
+    @classmethod
+    def tolist(cls, vec):
+        re = cls.base.tolist(vec.re)
+        if vec.im is None:
+            return re
+        return [ Fp2(a, b) for (a, b) in izip(re, cls.base.tolist(vec.im)) ]
+
+    @classmethod
+    def item(cls, vec, idx):
+        if vec.im is None:
+            return cls.base.item(vec.re, idx)
+        return Fp2(cls.base.item(vec.re, idx), cls.base.item(vec.im, idx))
+
+    @classmethod
+    def _parts(cls, op, vec, *args):
+        # op applied to re and im separately, for ops that are linear in vec
+        return _Fp2Vec(op(vec.re, *args), None if vec.im is None else op(vec.im, *args))
+
+    @classmethod
+    def _bilinear(cls, op, a, b):
+        # op(a, b) for an op that is bilinear in a and b, e.g., mul or outer.
+        # As in Fp2.__mul__, an ext * ext product takes three ops (Karatsuba)
+        base = cls.base
+        if a.im is None and b.im is None:
+            return _Fp2Vec(op(a.re, b.re))
+        elif a.im is None:
+            return _Fp2Vec(op(a.re, b.re), op(a.re, b.im))
+        elif b.im is None:
+            return _Fp2Vec(op(a.re, b.re), op(a.im, b.re))
+        ac = op(a.re, b.re)
+        bd = op(a.im, b.im)
+        cross = op(base.add(a.re, a.im), base.add(b.re, b.im))
+        return _Fp2Vec(base.add(ac, base.scale(bd, Defs.ext_nr)), base.sub(base.sub(cross, ac), bd))
+
+    @classmethod
+    def fold(cls, vec, val):
+        if not isinstance(val, Fp2):
+            return cls._parts(cls.base.fold, vec, val)
+        even = vec[0::2]
+        return cls.add(even, cls.scale(cls.sub(vec[1::2], even), val))
+
+    @classmethod
+    def alloc(cls, n):
+        return _Fp2Vec(cls.base.alloc(n), cls.base.alloc(n))
+
+    @classmethod
+    def alloc_temps(cls, n):
+        return cls.base.alloc_temps(n)
+
+    @classmethod
+    def fold_into(cls, vec, val, out, temps=None, n=None):
+        if n is not None:
+            vec = vec[:n]
+        if not isinstance(val, Fp2):
+            re = cls.base.fold_into(vec.re, val, out.re, temps)
+            return _Fp2Vec(re, None if vec.im is None else cls.base.fold_into(vec.im, val, out.im, temps))
+
+        # an extension field val mixes re and im, so fold and then copy
+        res = cls.fold(vec, val)
+        half = len(res)
+        np.copyto(out.re[:half], res.re)
+        np.copyto(out.im[:half], res.im)
+        return _Fp2Vec(out.re[:half], out.im[:half])
+
+    @classmethod
+    def fold_points(cls, vec, x):
+        if x.im is None:
+            return cls._parts(cls.base.fold_points, vec, x.re)
+        # the rows of the result are even + (odd - even) * x[k]
+        even = vec[0::2]
+        ones = cls.vector([1] * len(x))
+        return cls.add(cls.outer(ones, even), cls.outer(x, cls.sub(vec[1::2], even)))
+
+    @classmethod
+    def fold_rows(cls, vec, x):
+        if x.im is None:
+            return cls._parts(cls.base.fold_rows, vec, x.re)
+        # rows have even length, so the evens of each row are the evens of vec
+        even = vec[0::2]
+        return cls.add(even, cls.mul(cls.sub(vec[1::2], even), cls.expand(x, len(vec) // (2 * len(x)))))
+
+    @classmethod
+    def expand(cls, vec, ncopies):
+        return cls._parts(cls.base.expand, vec, ncopies)
+
+    @classmethod
+    def outer(cls, a, b):
+        return cls._bilinear(cls.base.outer, a, b)
+
+    @classmethod
+    def mul(cls, a, b):
+        return cls._bilinear(cls.base.mul, a, b)
+
+    @classmethod
+    def add(cls, a, b):
+        if a.im is None or b.im is None:
+            return _Fp2Vec(cls.base.add(a.re, b.re), b.im if a.im is None else a.im)
+        return _Fp2Vec(cls.base.add(a.re, b.re), cls.base.add(a.im, b.im))
+
+    @classmethod
+    def sub(cls, a, b):
+        if b.im is None:
+            return _Fp2Vec(cls.base.sub(a.re, b.re), a.im)
+        im = cls.base.sub(cls.base.alloc(len(b)) if a.im is None else a.im, b.im)
+        return _Fp2Vec(cls.base.sub(a.re, b.re), im)
+
+    @classmethod
+    def scale(cls, vec, val):
+        if not isinstance(val, Fp2):
+            return cls._parts(cls.base.scale, vec, val)
+        base = cls.base
+        (re, im) = (base.scale(vec.re, val.a), base.scale(vec.re, val.b))
+        if vec.im is not None:
+            re = base.add(re, base.scale(vec.im, Defs.ext_nr * val.b))
+            im = base.add(im, base.scale(vec.im, val.a))
+        return _Fp2Vec(re, im)
+
+    @classmethod
+    def vsum(cls, vec):
+        if vec.im is None:
+            return cls.base.vsum(vec.re)
+        return Fp2(cls.base.vsum(vec.re), cls.base.vsum(vec.im))
+
+    @classmethod
+    def dot_rows(cls, vec, x):
+        return cls._bilinear(cls.base.dot_rows, vec, x)
+
+    @classmethod
+    def wsum_rows(cls, vec, w):
+        return cls._bilinear(cls.base.wsum_rows, vec, w)
+
+    @classmethod
+    def indices(cls, vals):
+        return cls.base.indices(vals)
+
+    @classmethod
+    def shift_indices(cls, idx, shift):
+        return cls.base.shift_indices(idx, shift)
+
+    @classmethod
+    def index_bits(cls, idx, bit):
+        return cls.base.index_bits(idx, bit)
+
+    @classmethod
+    def gather_rows(cls, vec, ncols, idx):
+        return cls._parts(cls.base.gather_rows, vec, ncols, idx)
+
+    @classmethod
+    def scatter_add(cls, n, idx, vals):
+        re = cls.base.scatter_add(n, idx, vals.re)
+        return _Fp2Vec(re, None if vals.im is None else cls.base.scatter_add(n, idx, vals.im))
+
+    @classmethod
+    def horner_rows(cls, vec, x):
+        if x.im is None:
+            return cls._parts(cls.base.horner_rows, vec, x.re)
+        ncols = len(vec) // len(x)
+        out = vec[ncols-1::ncols]
+        for j in range(ncols - 2, -1, -1):
+            out = cls.add(cls.mul(out, x), vec[j::ncols])
+        return out
+
+class M61Fp2FieldVec(Fp2FieldVec):
+    name = "m61-fp2"
+    base = M61FieldVec
+    min_size = M61FieldVec.min_size
+
+class MontFp2FieldVec(Fp2FieldVec):
+    name = "mont-fp2"
+    base = MontFieldVec
+    min_size = MontFieldVec.min_size
+
+# the extension field backend for each vectorized backend
+_ext_backends = { M61FieldVec: M61Fp2FieldVec
+                , MontFieldVec: MontFp2FieldVec
+                }
+
+backends = { RefFieldVec.name: RefFieldVec
+           , MpzFieldVec.name: MpzFieldVec
+           , M61FieldVec.name: M61FieldVec
+           , MontFieldVec.name: MontFieldVec
+           }
+
+# backends to try, in order of preference, when Defs.backend is "auto"
+_auto_order = [M61FieldVec, MontFieldVec, MpzFieldVec]
+
+def get(size=None):
+    # if size is given, vectorized backends hand short vectors to the reference backend
+    name = Defs.backend
+    if name == "auto":
+        fv = RefFieldVec
+        for cand in _auto_order:
+            if cand.supports(Defs.prime):
+                fv = cand
+                break
+    else:
+        fv = backends[name]
+        assert fv.supports(Defs.prime), "field backend %s does not support prime %d" % (name, Defs.prime)
+
+    if size is not None and size < fv.min_size:
+        return RefFieldVec
+    # the other backends only hold base field elements, but extension field
+    # challenges (see Defs.ext_nr) turn everything they touch into Fp2 values.
+    # Vectorized backends hold those as pairs of base field vectors; the mpz
+    # backend's vector() can't take Fp2 values, so it falls back to the reference one
+    if Defs.ext_nr is not None:
+        return _ext_backends.get(fv, RefFieldVec)
+    return fv
+
+###
+#  eq/chi tables
+###
+def chi_table(vals, fv=None, rec=None):
+    # out[j] = prod_i (vals[i] if bit i of j is set else 1 - vals[i]), in fv's native
+    # format (by default, the backend for the table's length). The table is the outer
+    # product of the tables for the high and low halves of vals, recursively, so there
+    # are log2(len(vals)) levels of outer products and the last one dominates.
+    if fv is None:
+        fv = get(2 ** len(vals))
+
+    if rec is not None:
+        # accounted as the usual dynamic-programming construction: one 1 - val per
+        # element of vals, and two muls per element of the table so far
+        rec.did_add(len(vals))
+        rec.did_mul(2 * (2 ** len(vals) - 1))
+
+    if len(vals) == 0:
+        return fv.vector([1])
+    return _chi_outer(vals, fv)
+
+def _chi_outer(vals, fv):
+    if len(vals) == 1:
+        return fv.vector([(1 - vals[0]) % Defs.prime, vals[0]])
+    half = len(vals) // 2
+    return fv.outer(_chi_outer(vals[half:], fv), _chi_outer(vals[:half], fv))
+
+def iter_chi_table(vals, chunkBits, fv=None, rec=None):
+    # chi_table(vals), yielded in order as chunks of 2^chunkBits entries. Each chunk is
+    # the table for the low chunkBits elements of vals scaled by one entry of the table
+    # for the rest, which is itself streamed, so memory use is O(2^chunkBits).
+    if fv is None:
+        fv = get(2 ** min(chunkBits, len(vals)))
+
+    if len(vals) <= chunkBits:
+        yield chi_table(vals, fv, rec)
+        return
+
+    low = chi_table(vals[:chunkBits], fv, rec)
+    for highChunk in iter_chi_table(vals[chunkBits:], chunkBits, fv, rec):
+        for high in fv.tolist(highChunk):
+            if rec is not None:
+                rec.did_mul(len(low))
+            yield fv.scale(low, high)
+
+def supports(name, prime):
+    if name == "auto":
+        return True
+    return backends[name].supports(prime)
+
+def set_backend(name):
+    assert name == "auto" or name in backends, "unknown field backend %s" % name
+    Defs.backend = name
+
+    # convert field constants to the chosen backend's scalar type
+    fv = get()
+    Defs.ftype = fv.elem
+    Defs.prime = fv.elem(Defs.prime)
+    Defs.half = fv.elem(Defs.half)
+    Defs.third = fv.elem(Defs.third)
+
+def available():
+    return [ name for (name, fv) in sorted(backends.items()) if fv.supports(Defs.prime) ]
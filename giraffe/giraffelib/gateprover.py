@@ -9,7 +9,16 @@ from giraffelib.defs import Defs
 import giraffelib.arithcircuit as ac
 
 class _GateProver(object):
+    # there are as many of these as there are gates, so no per-instance __dict__
+    __slots__ = ('accum_z1', 'accum_in0', 'accum_in1', 'roundNum', 'layer', 'isEarly',
+                 'in0', 'in1', 'out', 'outs', 'muxbit', 'output')
+
     gate_type_idx = None
+    gate_degree = None
+
+    # outputs before the first call to compute_outputs, shared by all gates
+    early_zeros = (0, 0, 0, 0)
+    late_zeros = (0, 0, 0)
 
     def __init__(self, isEarly, in0, in1, out, layer, muxbit=0):
         self.accum_z1 = self.accum_in0 = self.accum_in1 = None
@@ -19,21 +28,26 @@ class _GateProver(object):
         self.in0 = in0
         self.in1 = in1
         self.out = out
+        # if this gate prover stands in for duplicate gates or for a term of a linear
+        # gate, the (output, coefficient) pairs that it contributes to
+        self.outs = None
         self.muxbit = muxbit
-        self.output = []
+        self.output = self.early_zeros
 
     # reset gate prover to beginning of sumcheck
     def reset(self):
         self.accum_z1 = None
         self.roundNum = 0
         if self.isEarly:
-            self.output = [0, 0, 0, 0]
+            self.output = self.early_zeros
             self.accum_in0 = None
             self.accum_in1 = None
         else:
-            self.output = [0, 0, 0]
-            self.accum_in0 = self.layer.compute_v_final.outputs[self.in0]
-            self.accum_in1 = self.layer.compute_v_final.outputs[self.in1]
+            self.output = self.late_zeros
+            # compute_v_final's outputs are ExpandedViews; index through them directly
+            view = self.layer.compute_v_final.outputs
+            self.accum_in0 = view.vals[self.in0 >> view.shift]
+            self.accum_in1 = view.vals[self.in1 >> view.shift]
 
     # switch gate from "early" to "late" mode
     def set_early(self, isEarly):
@@ -42,9 +56,14 @@ class _GateProver(object):
     # set z value from Verifier
     def set_z(self):
         self.reset()
-        self.accum_z1 = self.layer.compute_z1chi.outputs[self.out]
+        z1chi = self.layer.compute_z1chi.outputs
+        if self.outs is None:
+            self.accum_z1 = z1chi[self.out]
+        else:
+            self.accum_z1 = sum( z1chi[out] * coeff for (out, coeff) in self.outs ) % Defs.prime
 
     # update output of this gate prover
+    # outputs are left unreduced; LayerProver reduces them when summing over gates
     def compute_outputs(self, *args):
         if self.isEarly:
             assert len(args) == 1
@@ -57,30 +76,26 @@ class _GateProver(object):
         assert self.roundNum < self.layer.circuit.nCopyBits
         assert (copy % 2) == 0
 
+        # compute_v is one (inputs x copies) matrix; find our inputs' rows
+        bank = self.layer.compute_v
+        ncols = bank.ncols
+        outputs = bank.outputs
+        (row0, row1) = (self.in0 * ncols, self.in1 * ncols)
+
         # evaluate gatefn for copy and copy+1 simultaneously
-        out = [0, 0, 0, 0]
-        out[0] = self.gatefn(self.layer.compute_v[self.in0].outputs[copy],
-                             self.layer.compute_v[self.in1].outputs[copy])
+        out = [0, 0]
+        out[0] = self.gatefn(outputs[row0 + copy], outputs[row1 + copy])
         out[0] *= self.accum_z1
-        out[0] %= Defs.prime
 
-        out[1] = self.gatefn(self.layer.compute_v[self.in0].outputs[copy+1],
-                             self.layer.compute_v[self.in1].outputs[copy+1])
+        out[1] = self.gatefn(outputs[row0 + copy + 1], outputs[row1 + copy + 1])
         out[1] *= self.accum_z1
-        out[1] %= Defs.prime
 
-        # evaluate gatefn at 3rd and 4th points
-        # note that we use [copy >> 1] because compute_v has expand_outputs = False
+        # evaluate gatefn at 3rd (and, for cubic messages, 4th) points
+        # note that we use (copy >> 1) because compute_v has expand_outputs = False
         # note that we don't multiply by p or (1-p) because we're summing x*p + x*(1-p), which is just x
-        out[2] = self.gatefn(self.layer.compute_v[self.in0].outputs_fact[0][copy >> 1],
-                             self.layer.compute_v[self.in1].outputs_fact[0][copy >> 1])
-        out[2] *= self.accum_z1
-        out[2] %= Defs.prime
-
-        out[3] = self.gatefn(self.layer.compute_v[self.in0].outputs_fact[1][copy >> 1],
-                             self.layer.compute_v[self.in1].outputs_fact[1][copy >> 1])
-        out[3] *= self.accum_z1
-        out[3] %= Defs.prime
+        (hrow0, hrow1) = ((row0 >> 1) + (copy >> 1), (row1 >> 1) + (copy >> 1))
+        for fact in bank.outputs_fact:
+            out.append(self.gatefn(fact[hrow0], fact[hrow1]) * self.accum_z1)
 
         self.output = out
 
@@ -90,21 +105,21 @@ class _GateProver(object):
         # evaluate gatefn at third point (-1)
         if self.roundNum < self.layer.prevL.nOutBits:
             isOneVal = util.bit_is_set(self.in0, self.roundNum)
-            leftVal = self.layer.compute_v_final.outputs_fact[0][self.in0]
+            view = self.layer.compute_v_final.outputs_fact[0]
+            leftVal = view.vals[self.in0 >> view.shift]
             valForTwo = self.gatefn(leftVal, self.accum_in1)
         else:
             isOneVal = util.bit_is_set(self.in1, self.roundNum - self.layer.prevL.nOutBits)
-            rightVal = self.layer.compute_v_final.outputs_fact[0][self.in1]
+            view = self.layer.compute_v_final.outputs_fact[0]
+            rightVal = view.vals[self.in1 >> view.shift]
             valForTwo = self.gatefn(self.accum_in0, rightVal)
 
         # evaluate addmul at third point
         valForTwo *= util.third_eval_point(self.accum_z1, isOneVal)
-        valForTwo %= Defs.prime
 
         # produce outputs for 0, 1, 2
         out = [0, 0, valForTwo]
         valForZeroOne = self.accum_z1 * self.gatefn(self.accum_in0, self.accum_in1)
-        valForZeroOne %= Defs.prime
         if isOneVal:
             out[1] = valForZeroOne
         else:
@@ -132,7 +147,8 @@ class _GateProver(object):
 
             # second, update appropriate V value
             if self.roundNum < self.layer.prevL.nOutBits - 1:
-                self.accum_in0 = self.layer.compute_v_final.outputs[self.in0]
+                view = self.layer.compute_v_final.outputs
+                self.accum_in0 = view.vals[self.in0 >> view.shift]
             else:
                 self.accum_in0 = self.layer.compute_v_final.prevPassValue
         else:
@@ -143,7 +159,8 @@ class _GateProver(object):
 
             # second, update appropriate V value
             if self.roundNum < 2 * self.layer.prevL.nOutBits - 1:
-                self.accum_in1 = self.layer.compute_v_final.outputs[self.in1]
+                view = self.layer.compute_v_final.outputs
+                self.accum_in1 = view.vals[self.in1 >> view.shift]
             else:
                 self.accum_in1 = self.layer.compute_v_final.prevPassValue
 
@@ -159,13 +176,23 @@ class _GateProver(object):
     def gatefn_(*_):
         assert False
 
+# gate_degree is the degree of gatefn in its inputs
 class _FirstOrderGateProver(_GateProver):
-    pass
+    __slots__ = ()
+    gate_degree = 1
 
 class _SecondOrderGateProver(_GateProver):
-    pass
+    __slots__ = ()
+    gate_degree = 2
+
+# degree of a layer's sumcheck messages in the early (w3) rounds: beta is linear in
+# each w3 variable, and so is V(in0) and V(in1), so it's 1 plus the highest gate degree.
+# Late-round messages are always quadratic.
+def early_round_degree(typev):
+    return 1 + max( tp.gate_degree for tp in typev )
 
 class MulGateProver(_SecondOrderGateProver):
+    __slots__ = ()
     gate_type = "mul"
     gate_type_idx = 0
     cgate = ac.CMulGate
@@ -176,6 +203,7 @@ class MulGateProver(_SecondOrderGateProver):
         return (x * y) % Defs.prime
 
 class AddGateProver(_FirstOrderGateProver):
+    __slots__ = ()
     gate_type = "add"
     gate_type_idx = 1
     cgate = ac.CAddGate
@@ -186,6 +214,7 @@ class AddGateProver(_FirstOrderGateProver):
         return (x + y) % Defs.prime
 
 class SubGateProver(_FirstOrderGateProver):
+    __slots__ = ()
     gate_type = "sub"
     gate_type_idx = 2
     cgate = ac.CSubGate
@@ -196,6 +225,7 @@ class SubGateProver(_FirstOrderGateProver):
         return (x - y) % Defs.prime
 
 class MuxGateProver(_FirstOrderGateProver):
+    __slots__ = ()
     gate_type = "mux"
     # NOTE 3 and 4 are muxL and muxR, respectively
     gate_type_idx = 3
@@ -213,6 +243,78 @@ class MuxGateProver(_FirstOrderGateProver):
         bit = self.layer.circuit.muxbits[self.muxbit]
         return self.gatefn_(bit, x, y)
 
+class LinearGateProver(_FirstOrderGateProver):
+    # a sum of any number of input wires, each times a coefficient. In a circuit
+    # description, in0 is a tuple of input wires and in1 the tuple of their coefficients.
+    # The layer prover splits each one into terms (see gate_terms), each of which is a
+    # LinearGateProver whose in0 and in1 are that term's wire and whose output is in0.
+    __slots__ = ()
+    gate_type = "lin"
+    gate_type_idx = 5
+    cgate = ac.CLinGate
+
+    @staticmethod
+    def gatefn_(x, _):
+        # pylint: disable=arguments-differ
+        return x
+
+class _ConstGateProver(_FirstOrderGateProver):
+    # a gate with one input wire and a constant operand. In a circuit description, in0
+    # is the wire and in1 the constant; the gate prover's in0 and in1 are both the wire.
+    # For GateFunctions, gatefn_ leaves out the constant, which the verifier folds into
+    # the gate's wiring predicate weight (see CircuitVerifier.eval_mlext)
+    __slots__ = ('const',)
+
+    def __init__(self, isEarly, in0, in1, out, layer, muxbit=0):
+        super(_ConstGateProver, self).__init__(isEarly, in0, in0, out, layer, muxbit)
+        self.const = in1 % Defs.prime
+
+    @staticmethod
+    def gatefn_(x, _):
+        # pylint: disable=arguments-differ
+        return x
+
+class CMulGateProver(_ConstGateProver):
+    __slots__ = ()
+    gate_type = "cmul"
+    gate_type_idx = 6
+    cgate = ac.CConstMulGate
+
+    def gatefn(self, x, y):
+        return (self.const * x) % Defs.prime
+
+class CAddGateProver(_ConstGateProver):
+    __slots__ = ()
+    gate_type = "cadd"
+    gate_type_idx = 7
+    # eval_mlext puts the constant part of these gates in this slot, whose gate function is 1
+    const_idx = 8
+    cgate = ac.CConstAddGate
+
+    def gatefn(self, x, y):
+        return (x + self.const) % Defs.prime
+
+# one term per gate, except one per input wire of each linear gate. Returns
+# (in0, in1, type, muxbit, out, coeff) lists, one entry per term
+def gate_terms(in0v, in1v, typev, muxv):
+    (tin0, tin1, ttyp, tmux, tout, tcoeff) = ([], [], [], [], [], [])
+    for (out, (in0, in1, tp, mx)) in enumerate(zip(in0v, in1v, typev, muxv)):
+        if tp is LinearGateProver:
+            assert len(in0) == len(in1) and len(in0) > 0
+            terms = [ (inp, inp, coeff) for (inp, coeff) in zip(in0, in1) ]
+        else:
+            terms = [(in0, in1, 1)]
+
+        for (tmp0, tmp1, coeff) in terms:
+            tin0.append(tmp0)
+            tin1.append(tmp1)
+            ttyp.append(tp)
+            tmux.append(mx)
+            tout.append(out)
+            tcoeff.append(coeff)
+
+    return (tin0, tin1, ttyp, tmux, tout, tcoeff)
+
 # magic so that GateFunction is statically indexable
 class GateFunctionsMeta(type):
     def __getitem__(cls, idx):
@@ -228,4 +330,8 @@ class GateFunctions(object):
                    , SubGateProver.gatefn_
                    , lambda x, y: MuxGateProver.gatefn_(x, y, False)
                    , lambda x, y: MuxGateProver.gatefn_(x, y, True)
+                   , LinearGateProver.gatefn_
+                   , CMulGateProver.gatefn_
+                   , CAddGateProver.gatefn_
+                   , lambda x, y: 1
                    ]
@@ -0,0 +1,235 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# struct-of-arrays gate table for a layer, and vectorized sumcheck engines on it
+
+import giraffelib.gateprover as gateprover
+from giraffelib.defs import Defs
+import giraffelib.util as util
+
+class GateTable(object):
+    # backend op that evaluates each gate type, by gate_type_idx
+    gate_ops = { gateprover.MulGateProver.gate_type_idx: "mul"
+               , gateprover.AddGateProver.gate_type_idx: "add"
+               , gateprover.SubGateProver.gate_type_idx: "sub"
+               , gateprover.LinearGateProver.gate_type_idx: "left"
+               , gateprover.CMulGateProver.gate_type_idx: "cmul"
+               , gateprover.CAddGateProver.gate_type_idx: "cadd"
+               }
+    # ops that only read in0, and ops that read the gate's constant
+    unary_ops = ("left", "cmul", "cadd")
+    const_ops = ("cmul", "cadd")
+
+    # bound on the number of elements in each (gates x copies) matrix we build
+    max_chunk = 2 ** 16
+
+    def __init__(self, in0v, in1v, typev, muxv=None, outv=None, constv=None):
+        if muxv is None:
+            muxv = [0] * len(in0v)
+        if outv is None:
+            outv = [ [(out, 1)] for out in range(0, len(in0v)) ]
+        if constv is None:
+            constv = [0] * len(in0v)
+
+        # one entry per gate (or term of a linear gate); outv[i] lists the (output, coefficient)
+        # pairs that gate i contributes to. Gate i's z1chi weight is z1chi[out[i]] unless
+        # it's in out_terms, i.e., it stands in for duplicates or has a coefficient
+        self.in0 = list(in0v)
+        self.in1 = list(in1v)
+        self.out = [ outs[0][0] for outs in outv ]
+        self.out_terms = dict( (gate, outs) for (gate, outs) in enumerate(outv) if len(outs) > 1 or outs[0][1] != 1 )
+        self.typ = [ tp.gate_type_idx for tp in typev ]
+        self.muxbit = list(muxv)
+        self.const = list(constv)
+
+        # gates grouped by type. The engines only handle types in gate_ops;
+        # otherwise, the layer prover has to fall back to per-gate evaluation
+        self.supported = all([ t in self.gate_ops for t in self.typ ])
+        self.buckets = {}
+        for (gate, t) in enumerate(self.typ):
+            self.buckets.setdefault(t, []).append(gate)
+
+        # per-backend copies of the index arrays and z1chi weights for each bucket
+        self.idx_cache = {}
+        self.const_cache = {}
+        self.z1chi = None
+        self.z1_cache = {}
+
+        # late-round state: per-bucket arrays of accum_z1, accum_in0, accum_in1
+        self.late = None
+        self.late_fv = None
+        self.late_round = 0
+        self.late_bits = None
+        # per-backend lookups on the bit a late round binds (see late_lookups)
+        self.lookup_cache = {}
+
+    # when a table is sent to a shard worker (see parallel.py), leave out the
+    # per-backend caches and late-round state; the worker rebuilds what it needs
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(idx_cache={}, const_cache={}, z1_cache={}, lookup_cache={}, late=None, late_fv=None, late_bits=None)
+        return state
+
+    def set_z1chi(self, z1chi):
+        self.z1chi = z1chi
+        self.z1_cache = {}
+
+    def bucket_indices(self, fv):
+        if fv not in self.idx_cache:
+            self.idx_cache[fv] = dict( (t, (fv.indices([ self.in0[g] for g in gates ]), fv.indices([ self.in1[g] for g in gates ])))
+                                       for (t, gates) in self.buckets.items() )
+        return self.idx_cache[fv]
+
+    def bucket_consts(self, fv):
+        if fv not in self.const_cache:
+            self.const_cache[fv] = dict( (t, fv.vector([ self.const[g] for g in gates ]))
+                                         for (t, gates) in self.buckets.items() if self.gate_ops[t] in self.const_ops )
+        return self.const_cache[fv]
+
+    def bucket_z1chi(self, fv):
+        if fv not in self.z1_cache:
+            z1chi = self.z1chi
+            weights = [ z1chi[out] for out in self.out ]
+            for (gate, outs) in self.out_terms.items():
+                weights[gate] = sum( z1chi[out] * coeff for (out, coeff) in outs ) % Defs.prime
+            self.z1_cache[fv] = dict( (t, fv.vector([ weights[g] for g in gates ]))
+                                      for (t, gates) in self.buckets.items() )
+        return self.z1_cache[fv]
+
+    # backend op evaluating gate type t. A linear gate's term is just its left input,
+    # and constant-operand gates use consts, which is shaped like their left inputs
+    def gatefn(self, fv, t, consts=None):
+        op = self.gate_ops[t]
+        if op == "left":
+            return lambda x, _: x
+        elif op == "cmul":
+            return lambda x, _: fv.mul(x, consts)
+        elif op == "cadd":
+            return lambda x, _: fv.add(x, consts)
+        return getattr(fv, op)
+
+    # sum over gates of z1chi(gate) * gatefn(V(in0), V(in1)), for every column of
+    # a row-major (inputs x ncols) V matrix
+    def sum_gates(self, fv, vmat, ncols):
+        indices = self.bucket_indices(fv)
+        weights = self.bucket_z1chi(fv)
+        consts = self.bucket_consts(fv)
+        chunk = max(1, self.max_chunk // ncols)
+
+        total = None
+        for t in sorted(self.buckets):
+            op = self.gate_ops[t]
+            (in0, in1) = indices[t]
+            for start in range(0, len(in0), chunk):
+                vals = fv.gather_rows(vmat, ncols, in0[start:start+chunk])
+                if op in self.const_ops:
+                    vals = self.gatefn(fv, t, fv.expand(consts[t][start:start+chunk], ncols))(vals, None)
+                elif op not in self.unary_ops:
+                    vals = self.gatefn(fv, t)(vals, fv.gather_rows(vmat, ncols, in1[start:start+chunk]))
+                part = fv.wsum_rows(vals, weights[t][start:start+chunk])
+                total = part if total is None else fv.add(total, part)
+
+        return total
+
+    # early rounds: the values that LayerProver interpolates (or sends directly).
+    # bank is the layer's LayerComputeVBank; beta and betaFacts come from its LayerComputeBeta
+    def compute_early(self, bank, beta, betaFacts):
+        assert self.supported
+        fv = bank.fv
+        ncols = bank.ncols
+
+        # at 0 and 1, even and odd copies weighted by beta
+        sums = fv.mul(self.sum_gates(fv, bank.scratch, ncols), fv.vector(beta))
+        out = [fv.vsum(sums[0::2]), fv.vsum(sums[1::2])]
+
+        # at the other points, one column per pair of copies
+        for (fact, betaFact) in zip(bank.fact_vecs, betaFacts):
+            out.append(fv.vsum(fv.mul(self.sum_gates(fv, fact, ncols // 2), fv.vector(betaFact))))
+
+        return out
+
+    # late rounds: the gate provers' accum_z1, accum_in0, and accum_in1, as one array per bucket.
+    # Call once compute_v_final has its inputs, i.e., right after the last early round
+    def start_late(self, vfinal):
+        assert self.supported
+        fv = self.late_fv = vfinal.fv
+        indices = self.bucket_indices(fv)
+        weights = self.bucket_z1chi(fv)
+
+        self.late = {}
+        for (t, (in0, in1)) in indices.items():
+            self.late[t] = [ weights[t]
+                           , fv.gather_rows(vfinal.scratch, 1, in0)
+                           , fv.gather_rows(vfinal.scratch, 1, in1)
+                           ]
+        self.late_round = 0
+        self.late_bits = None
+
+    # third_eval_point and the wiring predicate update, as lookups on the current bit
+    def late_lookups(self, fv):
+        key = (fv, Defs.prime)
+        if key not in self.lookup_cache:
+            self.lookup_cache[key] = (fv.vector([1 - util.THIRD_EVAL_POINT, util.THIRD_EVAL_POINT]), fv.vector([0, 1]))
+        return self.lookup_cache[key]
+
+    # index into this round's V table, and the bit of in0 or in1 that this round binds
+    def _late_round_indices(self, nInBits):
+        if self.late_bits is None:
+            fv = self.late_fv
+            (sel, bit) = (0, self.late_round)
+            if bit >= nInBits:
+                (sel, bit) = (1, bit - nInBits)
+            indices = self.bucket_indices(fv)
+            self.late_bits = dict( (t, (sel, fv.shift_indices(idx[sel], bit + 1), fv.index_bits(idx[sel], bit)))
+                                   for (t, idx) in indices.items() )
+        return self.late_bits
+
+    # the three values that LayerProver multiplies by beta and interpolates (or sends directly)
+    def compute_late(self, vfinal):
+        fv = self.late_fv
+        assert self.late_round < 2 * vfinal.nOutBits
+        fact = vfinal.fact_vecs[0]
+
+        consts = self.bucket_consts(fv)
+        (tepVec, bitVec) = self.late_lookups(fv)
+
+        out = [0, 0, 0]
+        for (t, (sel, fidx, bits)) in sorted(self._late_round_indices(vfinal.nOutBits).items()):
+            gatefn = self.gatefn(fv, t, consts.get(t))
+            (z1, in0, in1) = self.late[t]
+
+            # at the third point, the input being bound this round comes from V's table at -1
+            if sel == 0:
+                vals = gatefn(fv.gather_rows(fact, 1, fidx), in1)
+            else:
+                vals = gatefn(in0, fv.gather_rows(fact, 1, fidx))
+            out[2] += fv.vsum(fv.mul(vals, fv.mul(z1, fv.gather_rows(tepVec, 1, bits))))
+
+            # at 0 and 1, each gate contributes to the point given by its bit
+            vals = fv.mul(z1, gatefn(in0, in1))
+            one = fv.vsum(fv.mul(vals, fv.gather_rows(bitVec, 1, bits)))
+            out[0] += fv.vsum(vals) - one
+            out[1] += one
+
+        return [ elm % Defs.prime for elm in out ]
+
+    # call after compute_v_final.next_round(val)
+    def next_round_late(self, val, vfinal):
+        fv = self.late_fv
+        nInBits = vfinal.nOutBits
+        assert self.late_round < 2 * nInBits
+        last = self.late_round in (nInBits - 1, 2 * nInBits - 1)
+        pair = fv.vector([1 - val, val])
+
+        for (t, (sel, fidx, bits)) in self._late_round_indices(nInBits).items():
+            state = self.late[t]
+            if last:
+                # compute_v_final has started its next pass, so its table is reset
+                state[1 + sel] = fv.vector([vfinal.prevPassValue] * len(fidx))
+            else:
+                state[1 + sel] = fv.gather_rows(vfinal.scratch, 1, fidx)
+            state[0] = fv.mul(state[0], fv.gather_rows(pair, 1, bits))
+
+        self.late_round += 1
+        self.late_bits = None
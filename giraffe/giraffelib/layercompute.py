@@ -4,29 +4,78 @@
 #
 # per-layer subckts used by layer provers
 
+from itertools import islice
+
 from giraffelib.defs import Defs
+import giraffelib.fieldvec as fieldvec
 import giraffelib.util as util
 
+class ExpandedView(object):
+    # read-only view of the first n elements of vals (by default, all of them) with
+    # each element repeated 2^shift times, i.e., view[idx] == vals[idx >> shift]
+    __slots__ = ('vals', 'shift', 'n')
+
+    def __init__(self, vals, shift, n=None):
+        self.vals = vals
+        self.shift = shift
+        self.n = len(vals) if n is None else n
+
+    def __getitem__(self, idx):
+        return self.vals[idx >> self.shift]
+
+    def __len__(self):
+        return self.n << self.shift
+
+    def __iter__(self):
+        for val in islice(self.vals, 0, self.n):
+            for _ in range(0, 1 << self.shift):
+                yield val
+
 class LayerComputeV(object):
+    __slots__ = ('nOutBits', 'nRows', 'outlen', 'roundNum', 'prevPassValue', 'inputs', 'inputs_vec',
+                 '_scratch', 'scratch_len', 'v1v2', 'other_factors', 'vrec', 'fv', 'buf', 'fact_bufs', 'temps', 'buf_key',
+                 '_outputs', '_outputs_vec', '_outputs_fact', '_outputs_fact_vec', 'fact_vecs')
+
     expand_outputs = True
     multiple_passes = True
+    # fold into preallocated buffers. If False, allocate fresh vectors every round
+    # instead (this is only useful for comparison; see giraffebench/memory.py)
+    fold_in_place = True
 
     def __init__(self, nOutBits, rec=None):
+        # number of independent tables folded side by side (see LayerComputeVBank)
+        self.nRows = 1
         self.nOutBits = 0
         self.outlen = 0
         self.roundNum = 0
         self.prevPassValue = None
         self.nOutBits = nOutBits
         self.inputs = []
-        self.outputs = []
+        self.inputs_vec = []
         self.scratch = []
         self.v1v2 = []
-        self.outputs_fact = []
         self.other_factors = [util.THIRD_EVAL_POINT, util.FOURTH_EVAL_POINT]
         self.vrec = rec
+        self.fv = fieldvec.RefFieldVec
+
+        # preallocated buffers, folded in place each round, and the backend's scratch
+        # space for doing so. These are reused for every pass and only reallocated
+        # when the length or the backend changes.
+        self.buf = None
+        self.fact_bufs = []
+        self.temps = None
+        self.buf_key = None
+
+        # outputs and outputs_fact are converted to lists only when someone reads them
+        self._outputs = []
+        self._outputs_vec = None
+        self._outputs_fact = []
+        self._outputs_fact_vec = None
+        self.fact_vecs = []
 
     def set_other_factors(self, factors):
         self.other_factors = factors
+        self.alloc_buffers()
 
     # set new inputs and reset counter
     def set_inputs(self, inputs):
@@ -34,76 +83,126 @@ class LayerComputeV(object):
         self.inputs = inputs + [0] * (2**self.nOutBits - len(inputs))
         self.outlen = 2 ** self.nOutBits
         assert len(self.inputs) == self.outlen, "Wrong number of inputs after padding"
+        self.fv = fieldvec.get(self.outlen)
+        self.inputs_vec = self.fv.vector(self.inputs)
+        self.alloc_buffers()
         self.reset()
 
+    def alloc_buffers(self):
+        key = (self.fv, self.outlen, len(self.other_factors))
+        if key != self.buf_key:
+            self.buf = self.fv.alloc(self.outlen // 2)
+            self.fact_bufs = [ self.fv.alloc(self.outlen // 2) for _ in self.other_factors ]
+            self.temps = self.fv.alloc_temps(self.outlen // 2)
+            self.buf_key = key
+
+    # scratch is the current table. Folding in place into a list leaves a stale tail
+    # after the first scratch_len elements (see RefFieldVec.fold_into), so reading
+    # scratch trims it; the folds themselves use _scratch and scratch_len.
+    @property
+    def scratch(self):
+        if len(self._scratch) != self.scratch_len:
+            return self._scratch[:self.scratch_len]
+        return self._scratch
+
+    @scratch.setter
+    def scratch(self, value):
+        self._scratch = value
+        self.scratch_len = len(value)
+
     def reset(self):
-        self.outputs = list(self.inputs)
-        self.scratch = list(self.inputs)
+        # scratch is in the backend's native format. The first fold of each pass
+        # reads inputs_vec and writes into buf, so inputs_vec is never modified
+        # and neither it nor inputs needs to be copied.
+        outputs = self.inputs if self.fold_in_place else list(self.inputs)
+        self.outputs = ExpandedView(outputs, 0) if self.expand_outputs else outputs
+        self.scratch = self.inputs_vec
         self.update_other_factors()
         self.roundNum = 0
 
     def next_pass(self):
-        self.v1v2.append(self.scratch[0])
-        self.prevPassValue = self.scratch[0]
+        self.prevPassValue = self.fv.item(self._scratch, 0)
+        self.v1v2.append(self.prevPassValue)
         if self.multiple_passes:
             self.reset()
         else:
             self.outputs_fact = [[self.prevPassValue]] * len(self.other_factors)
 
-    def update_other_factors(self):
-        ofact = []
-        for fact in self.other_factors:
-            (tout, _) = self.update_outputs(fact)
-            ofact.append(tout)
-
-        self.outputs_fact = ofact
-
-    def update_outputs(self, val):
-        valInv = (1 - val) % Defs.prime
-        if self.vrec is not None:
-            self.vrec.did_add()
-
-        newlen = len(self.scratch) / 2
-        ncopies = self.outlen / newlen
-
-        scratch_out = [0] * newlen
+    # NOTE outputs and outputs_fact may share storage with the fold buffers,
+    #      so they are only valid until the next call to next_round
+    def _to_outputs(self, vec, n):
+        # vec's first n elements (see scratch)
+        if not (self.fold_in_place and not self.fv.vectorized):
+            vec = self.fv.tolist(vec[:n])
         if self.expand_outputs:
-            output = [0] * self.outlen
+            # index-mapped rather than materialized; see ExpandedView
+            return ExpandedView(vec, util.clog2(self.outlen // n), n)
+        if len(vec) != n:
+            return vec[:n]
+        return vec
+
+    @property
+    def outputs(self):
+        if self._outputs_vec is not None:
+            self._outputs = self._to_outputs(self._outputs_vec, self.scratch_len)
+            self._outputs_vec = None
+        return self._outputs
+
+    @outputs.setter
+    def outputs(self, value):
+        self._outputs = value
+        self._outputs_vec = None
+
+    @property
+    def outputs_fact(self):
+        if self._outputs_fact_vec is not None:
+            self._outputs_fact = [ self._to_outputs(vec, self.scratch_len // 2) for vec in self._outputs_fact_vec ]
+            self._outputs_fact_vec = None
+        return self._outputs_fact
+
+    @outputs_fact.setter
+    def outputs_fact(self, value):
+        self._outputs_fact = value
+        self._outputs_fact_vec = None
 
-        for i in range(0, newlen):
-            in0 = self.scratch[2 * i]
-            in1 = self.scratch[2 * i + 1]
-            result = (in0 * valInv + in1 * val) % Defs.prime
-
-            if self.vrec is not None:
-                self.vrec.did_add()
-                self.vrec.did_mul(2)
+    def update_other_factors(self):
+        # fact_vecs keeps the native vectors after outputs_fact has converted them. Like
+        # _scratch, lists folded in place only have scratch_len // 2 meaningful elements
+        self.fact_vecs = [ self.update_outputs(fact, fbuf) for (fact, fbuf) in zip(self.other_factors, self.fact_bufs) ]
+        self._outputs_fact_vec = self.fact_vecs
 
-            scratch_out[i] = result
-            if self.expand_outputs:
-                output[i * ncopies : (i + 1) * ncopies] = [result] * ncopies
+    def update_outputs(self, val, out):
+        newlen = self.scratch_len // 2
 
-        if not self.expand_outputs:
-            output = list(scratch_out)
+        if self.vrec is not None:
+            # 1 - val, then one add and two muls per output
+            self.vrec.did_add(1 + newlen)
+            self.vrec.did_mul(2 * newlen)
 
-        return (output, scratch_out)
+        if not self.fold_in_place:
+            return self.fv.fold(self.scratch, val)
+        return self.fv.fold_into(self._scratch, val, out, self.temps, self.scratch_len)
 
     def next_round(self, val):
         # this assert can only fail when self.multiple_passes is false
         assert self.roundNum < self.nOutBits, "This object does not support multiple computation passes"
 
-        (self.outputs, self.scratch) = self.update_outputs(val)
+        newlen = self.scratch_len // 2
+        self._scratch = self._outputs_vec = self.update_outputs(val, self.buf)
+        self.scratch_len = newlen
         self.roundNum += 1
 
         if self.roundNum == self.nOutBits:
-            assert len(self.scratch) == 1
+            assert self.scratch_len == self.nRows
             self.next_pass()
         else:
             # prepare the evals at -1 for the next round
-            assert len(self.scratch) > 1
+            assert self.scratch_len > self.nRows
             self.update_other_factors()
 
 class LayerComputeBeta(LayerComputeV):
+    __slots__ = ('rec',)
+
     expand_outputs = False
     multiple_passes = False
 
@@ -117,34 +216,64 @@ class LayerComputeBeta(LayerComputeV):
         assert len(inputs) == self.nOutBits, "Got wrong number of inputs for LayerComputeBeta"
 
         ### now compute "dynamic programming style" the "inputs" array
-        ### go backward so we have them in the right order at the end
-        # first, allocate array
-        self.inputs = [1] * (2 ** self.nOutBits)
-        for (i, val) in enumerate(reversed(inputs)):
-            valInv = (1 - val) % Defs.prime
-            nskip = 2 ** i
-
-            if self.rec is not None:
-                self.rec.did_add()
+        self.fv = fieldvec.get(2 ** self.nOutBits)
+        self.inputs_vec = fieldvec.chi_table(inputs, self.fv, self.rec)
+        if self.fold_in_place and not self.fv.vectorized:
+            self.inputs = self.inputs_vec
+        else:
+            self.inputs = self.fv.tolist(self.inputs_vec)
 
-            # write new elements from the back so we don't overwrite important stuff
-            for j in reversed(range(0, nskip)):
-                ival = self.inputs[j]
+        self.outlen = 2 ** self.nOutBits
+        assert len(self.inputs) == self.outlen, "Wrong number of inputs after computing"
 
-                val0 = (ival * valInv) % Defs.prime
-                val1 = (ival * val) % Defs.prime
+        self.alloc_buffers()
+        self.reset()
 
-                if self.rec is not None:
-                    self.rec.did_mul(2)
+class LayerComputeVBank(LayerComputeV):
+    # the early-round V tables for every input of a layer in one object: an
+    # (nRows x copies) matrix, stored row-major, where row r holds input r of each copy.
+    # Rows have even length until the last round, so folding the flattened matrix
+    # folds every row at once.
+    __slots__ = ('ncols', 'prevPassValues')
 
-                self.inputs[2*j + 1] = val1
-                self.inputs[2*j] = val0
+    expand_outputs = False
+    multiple_passes = False
 
-        self.outlen = 2 ** self.nOutBits
-        assert len(self.inputs) == self.outlen, "Wrong number of inputs after computing"
+    def __init__(self, nCopyBits, nRows):
+        super(self.__class__, self).__init__(nCopyBits)
+        self.nRows = nRows
+        self.ncols = 2 ** nCopyBits
+        self.prevPassValues = None
 
+    def set_inputs(self, inputs):
+        # inputs is a list of copies, each of which has (at least) nRows inputs
+        assert len(inputs) <= 2 ** self.nOutBits, "Got too many copies for LayerComputeVBank"
+        pad = [0] * (2 ** self.nOutBits - len(inputs))
+        self.inputs = []
+        for row in zip(*inputs)[:self.nRows]:
+            self.inputs.extend(row)
+            self.inputs.extend(pad)
+        self.outlen = self.nRows * 2 ** self.nOutBits
+        assert len(self.inputs) == self.outlen, "Wrong number of inputs after transposing"
+        self.fv = fieldvec.get(self.outlen)
+        self.inputs_vec = self.fv.vector(self.inputs)
+        self.alloc_buffers()
         self.reset()
 
+    def reset(self):
+        super(self.__class__, self).reset()
+        self.ncols = 2 ** self.nOutBits
+
+    def next_round(self, val):
+        # outputs[row * ncols + copy] and outputs_fact[k][row * (ncols // 2) + (copy >> 1)]
+        self.ncols //= 2
+        super(self.__class__, self).next_round(val)
+
+    def next_pass(self):
+        # one value per row
+        self.prevPassValues = self.fv.tolist(self.scratch)
+        self.outputs_fact = [self.prevPassValues] * len(self.other_factors)
+
 class LayerComputeH(object):
     def __init__(self, layer):
         self.roundNum = 0
@@ -156,12 +285,13 @@ class LayerComputeH(object):
         self.w3 = []
         self.output = []
 
-        # make subckt for each h_i
-        self.h_elems = []
-        for _ in range(0, self.layer.prevL.nOutBits - 1):
-            lcv = LayerComputeV(self.layer.prevL.nOutBits)
-            lcv.expand_outputs = False
-            self.h_elems.append(lcv)
+        # H(t) for t = 2, ..., nOutBits is V evaluated at w1 + t * (w2 - w1). Rather than
+        # one LayerComputeV per point, we fold V's table at all the points at once: the
+        # first w2 round reads the shared table, and later rounds fold a (points x table) matrix
+        self.nPoints = max(0, self.layer.prevL.nOutBits - 1)
+        self.h_fv = fieldvec.RefFieldVec
+        self.h_table = None
+        self.h_shared = True
 
     def next_layer(self, val):
         assert self.roundNum == 2 * self.layer.prevL.nOutBits + self.layer.circuit.nCopyBits
@@ -180,19 +310,28 @@ class LayerComputeH(object):
         else:
             w2_m_w1 = (val - self.w1[self.roundNum - self.layer.prevL.nOutBits - self.layer.circuit.nCopyBits]) % Defs.prime
             self.w2_m_w1.append(w2_m_w1)
+            points = []
             tmp = val
-            for i in range(0, self.layer.prevL.nOutBits - 1):
+            for _ in range(0, self.nPoints):
                 tmp += w2_m_w1
                 tmp %= Defs.prime
+                points.append(tmp)
 
-                self.h_elems[i].next_round(tmp)
+            if self.nPoints > 0:
+                if self.h_shared:
+                    self.h_table = self.h_fv.fold_points(self.h_table, self.h_fv.vector(points))
+                    self.h_shared = False
+                else:
+                    self.h_table = self.h_fv.fold_rows(self.h_table, self.h_fv.vector(points))
 
         self.roundNum += 1
 
         # if we're done with w3s, we can build the condensed input structure
         if self.roundNum == self.layer.circuit.nCopyBits:
-            for i in range(0, self.layer.prevL.nOutBits - 1):
-                self.h_elems[i].set_inputs(self.layer.compute_v_final.inputs)
+            inputs = self.layer.compute_v_final.inputs
+            self.h_fv = fieldvec.get(self.nPoints * len(inputs))
+            self.h_table = self.h_fv.vector(inputs)
+            self.h_shared = True
 
         # until we've got all the values, this is all we can do
         if self.roundNum < self.layer.circuit.nCopyBits + 2 * self.layer.prevL.nOutBits:
@@ -200,8 +339,62 @@ class LayerComputeH(object):
 
         # we've got all the w1 and w2 values
         h_vals = list(self.layer.compute_v_final.v1v2)
-        for val in range(2, self.layer.prevL.nOutBits + 1):
-            h_vals.append(self.h_elems[val-2].prevPassValue)
+        if self.nPoints > 0:
+            h_vals.extend(self.h_fv.tolist(self.h_table))
+
+        # finally, interpolate the result (unless we're sending evaluations at 0, 1, ..., nOutBits)
+        if self.layer.circuit.eval_form:
+            self.output = h_vals
+        else:
+            self.output = util.interpolate(h_vals)
+
+class LayerComputeHLine(LayerComputeH):
+    # H(t)'s coefficients directly, by folding V's table along the line w1 + t * (w2 - w1)
+    # one variable per w2 round, with each entry kept as a polynomial in t (one vector per
+    # coefficient). Before the round that binds bit k, the table has 2^(nOutBits - k) entries
+    # of degree k, so all of the rounds together take work linear in the table's size,
+    # rather than nOutBits - 1 points' worth of folds.
+    def __init__(self, layer):
+        super(LayerComputeHLine, self).__init__(layer)
+        self.nPoints = 0
+        self.h_coeffs = []
 
-        # finally, interpolate the result
-        self.output = util.interpolate(h_vals)
+    def next_round(self, val):
+        nCopyBits = self.layer.circuit.nCopyBits
+        nInBits = self.layer.prevL.nOutBits
+        assert self.roundNum < 2 * nInBits + nCopyBits
+
+        if self.roundNum < nCopyBits:
+            self.w3.append(val)
+
+        elif self.roundNum < nCopyBits + nInBits:
+            self.w1.append(val)
+
+        else:
+            w1 = self.w1[self.roundNum - nInBits - nCopyBits]
+            w2_m_w1 = (val - w1) % Defs.prime
+            self.w2_m_w1.append(w2_m_w1)
+
+            # even + (w1 + t * (w2 - w1)) * (odd - even), coefficient by coefficient
+            fv = self.h_fv
+            slopes = [ fv.scale(fv.sub(vec[1::2], vec[0::2]), w2_m_w1) for vec in self.h_coeffs ]
+            coeffs = [ fv.fold(vec, w1) for vec in self.h_coeffs ] + [slopes[-1]]
+            for (idx, slope) in enumerate(slopes[:-1]):
+                coeffs[idx + 1] = fv.add(coeffs[idx + 1], slope)
+            self.h_coeffs = coeffs
+
+        self.roundNum += 1
+
+        if self.roundNum == nCopyBits:
+            inputs = self.layer.compute_v_final.inputs
+            self.h_fv = fieldvec.get(len(inputs))
+            self.h_coeffs = [self.h_fv.vector(inputs)]
+
+        if self.roundNum < nCopyBits + 2 * nInBits:
+            return
+
+        coeffs = [ self.h_fv.item(vec, 0) for vec in self.h_coeffs ]
+        if self.layer.circuit.eval_form:
+            self.output = [ util.horner_eval(coeffs, t) for t in range(0, nInBits + 1) ]
+        else:
+            self.output = coeffs
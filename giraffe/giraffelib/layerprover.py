@@ -4,16 +4,38 @@
 #
 # layer provers (aka sub-provers)
 
+from itertools import izip
+import operator
+
 from giraffelib.defs import Defs
+import giraffelib.fieldvec as fieldvec
 import giraffelib.util as util
 import giraffelib.gateprover as gateprover
-from giraffelib.layercompute import LayerComputeV, LayerComputeBeta, LayerComputeH
+from giraffelib.gatetable import GateTable
+from giraffelib.layercompute import LayerComputeV, LayerComputeVBank, LayerComputeBeta, LayerComputeH, LayerComputeHLine
 
 class InputLayer(object):
     def __init__(self, nOutBits):
         self.nOutBits = nOutBits
 
 class LayerProver(object):
+    # evaluate early and late rounds with the layer's GateTable when it supports every gate
+    use_gate_table = True
+    # share one gate prover among duplicate gates (same type, inputs, and mux bit)
+    dedup = True
+    # computes the final message, H(t) = V(w1 + t * (w2 - w1))
+    compute_h_type = LayerComputeH
+
+    # unreduced gate functions for the first-round fast path, by gate_type_idx.
+    # None means use the gate's own gatefn, e.g., because it has a constant operand
+    first_round_fns = { gateprover.MulGateProver.gate_type_idx: operator.mul
+                      , gateprover.AddGateProver.gate_type_idx: operator.add
+                      , gateprover.SubGateProver.gate_type_idx: operator.sub
+                      , gateprover.LinearGateProver.gate_type_idx: gateprover.LinearGateProver.gatefn_
+                      , gateprover.CMulGateProver.gate_type_idx: None
+                      , gateprover.CAddGateProver.gate_type_idx: None
+                      }
+
     def __init__(self, prevL, circuit, in0v, in1v, typev, muxv=None):
         # pylint: disable=protected-access
         self.prevL = prevL
@@ -21,8 +43,12 @@ class LayerProver(object):
         self.nOutBits = util.clog2(len(in0v))
         self.roundNum = 0
 
-        self.compute_v = []
+        self.compute_v = None
+        self.nShardBits = 0
+        # pool key for the late rounds if they're sharded, else None
+        self.late_key = None
         self.inputs = []
+        self.outputs = None
         self.output = []
         self.z2_save = []
 
@@ -31,23 +57,28 @@ class LayerProver(object):
             muxv = [0] * len(in0v)
         assert len(in0v) == len(in1v) and len(in0v) == len(muxv) and len(in0v) == len(typev)
 
+        # early rounds send cubics if there's a mul gate in this layer, otherwise quadratics
+        self.early_degree = gateprover.early_round_degree(typev)
+        self.early_factors = early_factors = [util.THIRD_EVAL_POINT, util.FOURTH_EVAL_POINT][:self.early_degree - 1]
+
         # h computation subckt
-        self.compute_h = LayerComputeH(self)
+        self.compute_h = self.compute_h_type(self)
 
         # beta computation subckt
         self.compute_beta = LayerComputeBeta(self.circuit.nCopyBits)
+        self.compute_beta.set_other_factors(early_factors)
 
         # z1chi computation subckt
         # this just takes advantage of the code in LayerComputeBeta
         # that does the dynamic-programming computation
         self.compute_z1chi = LayerComputeBeta(self.nOutBits)
 
-        # v circuits are per-input---we collapse inputs in first nCopyBits rounds
-        for _ in range(0, 2 ** self.prevL.nOutBits):
-            lcv_tmp = LayerComputeV(self.circuit.nCopyBits)
-            # outputs are collapsed
-            lcv_tmp.expand_outputs = lcv_tmp.multiple_passes = False
-            self.compute_v.append(lcv_tmp)
+        # v circuits are per-input---we collapse inputs in first nCopyBits rounds.
+        # All inputs share one bank, which folds all of them at once. When the early
+        # rounds are sharded (see parallel.py), compute_v is instead a bank with one
+        # column per shard, which takes over after the shards' local rounds
+        self.compute_v_all = self.compute_v = LayerComputeVBank(self.circuit.nCopyBits, 2 ** self.prevL.nOutBits)
+        self.compute_v.set_other_factors(early_factors)
 
         # after finishing the first nCopyBits rounds, we only need one ComputeV circuit,
         # and everything is now 2nd order, so we only need three eval points, not four
@@ -55,29 +86,97 @@ class LayerProver(object):
         self.compute_v_final.set_other_factors([util.THIRD_EVAL_POINT])
 
         # pergate computation subckts for "early" rounds
+        # each linear gate is split into one term per input wire, and duplicate
+        # terms share one gate prover, whose z1chi weight is the sum of theirs
+        (tin0, tin1, ttyp, tmux, tout, tcoeff) = gateprover.gate_terms(in0v, in1v, typev, muxv)
+        if self.dedup:
+            (groups, _) = util.dedup_gates(tin0, tin1, ttyp, tmux)
+            # like ArithCircuitLayer, count whole duplicate gates; linear gates that
+            # merely share an input also share a term, but they aren't duplicates
+            self.nDupGates = len(in0v) - len(util.dedup_gates(in0v, in1v, typev, muxv)[0])
+        else:
+            groups = [ [term] for term in range(0, len(tin0)) ]
+            self.nDupGates = 0
+
         self.gates = []
         max_muxbit = 0
-        for (out, (in0, in1, mx, tp)) in enumerate(zip(in0v, in1v, muxv, typev)):
+        for group in groups:
+            term = group[0]
+            (in0, in1, mx, tp) = (tin0[term], tin1[term], tmux[term], ttyp[term])
             assert issubclass(tp, gateprover._GateProver)
-            self.gates.append(tp(True, in0, in1, out, self, mx))
+            self.gates.append(tp(True, in0, in1, tout[term], self, mx))
+            if len(group) > 1 or tcoeff[term] != 1:
+                self.gates[-1].outs = [ (tout[t], tcoeff[t]) for t in group ]
             if mx > max_muxbit:
                 max_muxbit = mx
         muxlen = max_muxbit + 1
         self.circuit.muxbits += [0] * (muxlen - len(self.circuit.muxbits))
 
+        # struct-of-arrays view of the gates for the vectorized engines
+        self.gate_table = self.make_gate_table(self.gates)
+        # for sharded late rounds, one table per part of self.gates (built when first needed)
+        self.gate_parts = None
+
+        # first round can use the fast path if we know how to evaluate every gate.
+        # first_round_gates[i] is the function for self.gates[i]
+        self.first_round_gates = None
+        if all([ g.gate_type_idx in self.first_round_fns for g in self.gates ]):
+            self.first_round_gates = [ self.first_round_fns[g.gate_type_idx] or g.gatefn for g in self.gates ]
+
+    @staticmethod
+    def make_gate_table(gates):
+        return GateTable([ g.in0 for g in gates ], [ g.in1 for g in gates ], [ type(g) for g in gates ],
+                         [ g.muxbit for g in gates ], [ g.outs or [(g.out, 1)] for g in gates ],
+                         [ getattr(g, 'const', 0) for g in gates ])
+
+    # gate tables for the late rounds' shards, each for a contiguous part of self.gates,
+    # or None if they run here
+    def late_gate_parts(self):
+        pool = self.circuit.pool
+        if pool is None or not (self.use_gate_table and self.gate_table.supported):
+            return None
+        nParts = pool.late_shards(len(self.gates))
+        if nParts == 0:
+            return None
+
+        if self.gate_parts is None or len(self.gate_parts) != nParts:
+            bounds = [ (part * len(self.gates)) // nParts for part in range(0, nParts + 1) ]
+            self.gate_parts = [ self.make_gate_table(self.gates[lo:hi]) for (lo, hi) in zip(bounds, bounds[1:]) ]
+        return self.gate_parts
+
+    # log2 of the number of shards for the early rounds, or 0 if they run here
+    def shard_bits(self):
+        pool = self.circuit.pool
+        if pool is None or not (self.use_gate_table and self.gate_table.supported):
+            return 0
+        return pool.shard_bits(self.circuit.nCopyBits)
+
+    # sharded early rounds bind the low bits of the copy index, i.e., the ones within each shard
+    def in_shard_rounds(self):
+        return self.nShardBits > 0 and self.roundNum < self.circuit.nCopyBits - self.nShardBits
+
     # set new inputs
     def set_inputs(self, inputs):
         assert len(inputs) == self.circuit.nCopies, "Got inputs for the wrong #copies"
         self.inputs = inputs
-        for inX in range(0, 2 ** self.prevL.nOutBits):
-            # transpose input matrix
-            inXVals = [ inCopy[inX] for inCopy in inputs ]
-            self.compute_v[inX].set_inputs(inXVals)
+        self.outputs = None
+        # sharded layers hand their inputs to the pool in set_z instead
+        if self.shard_bits() == 0:
+            self.compute_v = self.compute_v_all
+            self.compute_v.set_inputs(inputs)
+
+    # optionally, record this layer's (padded) outputs, i.e., the values the
+    # circuit computed from inputs. This enables the first-round fast path.
+    def set_outputs(self, outputs):
+        assert len(outputs) == self.circuit.nCopies, "Got outputs for the wrong #copies"
+        self.outputs = outputs
 
     # set a new z vector
     def set_z(self, z1, z2):
         self.roundNum = 0
+        self.late_key = None
         self.compute_z1chi.set_inputs(z1)
+        self.gate_table.set_z1chi(self.compute_z1chi.outputs)
         self.compute_beta.set_inputs(z2)
         self.z2_save = list(z2)
 
@@ -85,7 +184,13 @@ class LayerProver(object):
         for g in self.gates:
             g.set_z()
 
+        self.nShardBits = self.shard_bits()
+        if self.nShardBits > 0:
+            self.circuit.pool.start(id(self), self.nShardBits, self.gate_table, 2 ** self.prevL.nOutBits,
+                                    self.inputs, self.compute_beta.outputs, self.early_factors)
+
     # compute fj[0], fj[1], fj[-1], and maybe fj[2]
+    # in eval_form, these are the output; otherwise, we send the coefficients of fj
     def compute_outputs(self):
         # if we're at the last round, just return h coefficients
         if self.roundNum == self.circuit.nCopyBits + 2 * self.prevL.nOutBits:
@@ -95,57 +200,101 @@ class LayerProver(object):
         inEarlyRounds = True
         if self.roundNum >= self.circuit.nCopyBits:
             inEarlyRounds = False
+        useTable = inEarlyRounds and self.use_gate_table and self.gate_table.supported
+
+        if self.in_shard_rounds():
+            self.output = self.early_output(self.circuit.pool.compute(id(self)))
+
+        # the first-round fast path is scalar, so on a vectorized backend the gate table is faster
+        elif self.roundNum == 0 and inEarlyRounds and self.outputs is not None and self.first_round_gates is not None \
+                and not (useTable and self.compute_v.fv.vectorized):
+            self.output = self.early_output(self.compute_outputs_first())
 
-        if inEarlyRounds:
+        elif useTable:
+            beta = self.compute_beta.outputs
+            out = self.gate_table.compute_early(self.compute_v, beta, self.compute_beta.outputs_fact)
+            self.output = self.early_output(out)
+
+        elif inEarlyRounds:
             # go through each copy of the circuit
-            out = [0, 0, 0, 0]
-            for copy in range(0, len(self.compute_beta.outputs), 2):
-                vals = [0, 0, 0, 0]
+            # index outputs_fact with [copy >> 1] because expand_outputs is false in compute_beta
+            beta = self.compute_beta.outputs
+            betaFacts = self.compute_beta.outputs_fact
+            out = util.LazyAccum(self.early_degree + 1)
+            for copy in range(0, len(beta), 2):
                 # go through each gate, summing contribution from this copy
+                vals = util.LazyAccum(self.early_degree + 1)
                 for g in self.gates:
                     g.compute_outputs(copy)
-                    for j in range(0, 4):
-                        vals[j] += g.output[j]
-                        vals[j] %= Defs.prime
-
-                vals[0] *= self.compute_beta.outputs[copy]
-                vals[0] %= Defs.prime
-                out[0] += vals[0]
-                out[0] %= Defs.prime
+                    vals.add(g.output)
+                vals = vals.value()
 
-                vals[1] *= self.compute_beta.outputs[copy+1]
-                vals[1] %= Defs.prime
-                out[1] += vals[1]
-                out[1] %= Defs.prime
+                out.add([ vals[0] * beta[copy], vals[1] * beta[copy+1] ] +
+                        [ val * fact[copy >> 1] for (val, fact) in zip(vals[2:], betaFacts) ])
 
-                # index with [copy >> 1] because expand_outputs is false in compute_beta
-                vals[2] *= self.compute_beta.outputs_fact[0][copy >> 1]
-                vals[2] %= Defs.prime
-                out[2] += vals[2]
-                out[2] %= Defs.prime
-
-                vals[3] *= self.compute_beta.outputs_fact[1][copy >> 1]
-                vals[3] %= Defs.prime
-                out[3] += vals[3]
-                out[3] %= Defs.prime
-
-            self.output = util.interpolate_cubic(out)
+            self.output = self.early_output(out.value())
 
         else:
             # late rounds: only one set of gates over which to sum;
             # in these rounds we are updating w1 and then w2
-            out = [0, 0, 0]
-            for g in self.gates:
-                g.compute_outputs()
-                # sum contributions from this gate
-                for j in range(0, 3):
-                    out[j] += g.output[j]
-                    out[j] %= Defs.prime
-
-            for j in range(0, 3):
-                out[j] *= self.compute_beta.prevPassValue
-
-            self.output = util.interpolate_quadratic(out)
+            out = [ elm * self.compute_beta.prevPassValue for elm in self.compute_late() ]
+
+            if self.circuit.eval_form:
+                self.output = [ elm % Defs.prime for elm in out ]
+            else:
+                self.output = util.interpolate_quadratic(out)
+
+    # early-round message from the evaluations at 0, 1, -1, and (if cubic) 2
+    def early_output(self, vals):
+        assert len(vals) == self.early_degree + 1
+        if self.circuit.eval_form:
+            return vals
+        elif self.early_degree == 3:
+            return util.interpolate_cubic(vals)
+        else:
+            return util.interpolate_quadratic(vals)
+
+    # first round, specialized: nothing has been folded yet, so
+    #   - at 0 and 1, each gate's value in each copy is just this layer's
+    #     output, which the circuit already computed, and
+    #   - at -1 and 2, each input is 2 * V(copy) - V(copy+1) or
+    #     2 * V(copy+1) - V(copy), which is small when the inputs are
+    def compute_outputs_first(self):
+        nCopies = 2 ** self.circuit.nCopyBits
+        nOuts = 2 ** self.nOutBits
+        nIns = 2 ** self.prevL.nOutBits
+        beta = self.compute_beta.outputs
+        betaFacts = self.compute_beta.outputs_fact
+        z1chi = self.compute_z1chi.outputs
+        assert len(beta) == nCopies
+
+        # f(0) and f(1): one dot product of each copy's outputs with z1chi
+        outflat = []
+        for outCopy in self.outputs:
+            assert len(outCopy) == nOuts
+            outflat.extend(outCopy)
+        outflat += [0] * (nOuts * nCopies - len(outflat))
+        fv = fieldvec.get(len(outflat))
+        dots = fv.tolist(fv.dot_rows(fv.vector(outflat), fv.vector(z1chi)))
+
+        out = util.LazyAccum(self.early_degree + 1)
+        zeros = [0] * nIns
+        for copy in range(0, nCopies, 2):
+            inLo = self.inputs[copy] if copy < len(self.inputs) else zeros
+            inHi = self.inputs[copy+1] if copy + 1 < len(self.inputs) else zeros
+            points = [[ 2 * lo - hi for (lo, hi) in zip(inLo, inHi) ]]
+            if self.early_degree == 3:
+                points.append([ 2 * hi - lo for (lo, hi) in zip(inLo, inHi) ])
+
+            vals = util.LazyAccum(len(points))
+            for (fn, g) in izip(self.first_round_gates, self.gates):
+                vals.add([ g.accum_z1 * fn(vp[g.in0], vp[g.in1]) for vp in points ])
+            vals = vals.value()
+
+            out.add([ dots[copy] * beta[copy], dots[copy+1] * beta[copy+1] ] +
+                    [ val * fact[copy >> 1] for (val, fact) in zip(vals, betaFacts) ])
+
+        return out.value()
 
     # do updates upon receiving new random value
     def next_round(self, val):
@@ -153,32 +302,197 @@ class LayerProver(object):
 
         inLateRounds = True
         # do beta and V updates
-        if self.roundNum < self.circuit.nCopyBits:
+        if self.in_shard_rounds():
             inLateRounds = False
             self.compute_beta.next_round(val)
-            for cv in self.compute_v:
-                cv.next_round(val)
+            shardVals = self.circuit.pool.next_round(id(self), val)
+            if shardVals is not None:
+                # the shards are done; finish the early rounds on one column per shard
+                self.compute_v = LayerComputeVBank(self.nShardBits, 2 ** self.prevL.nOutBits)
+                self.compute_v.set_other_factors(self.early_factors)
+                self.compute_v.set_inputs(shardVals)
+
+        elif self.roundNum < self.circuit.nCopyBits:
+            inLateRounds = False
+            self.compute_beta.next_round(val)
+            self.compute_v.next_round(val)
             # no gate updates in early rounds: gate circuits don't update state
 
         # gotta do some juggling now that we're done with the w3 updates
         if self.roundNum == self.circuit.nCopyBits - 1:
-            # set up compute_v_final with prevPassValues from the per-input compute_v instances
-            inputs = [ cv.prevPassValue for cv in self.compute_v ]
-            assert all([ elm is not None for elm in inputs ])
+            # set up compute_v_final with the per-input prevPassValues from compute_v
+            inputs = self.compute_v.prevPassValues
+            assert inputs is not None and len(inputs) == 2 ** self.prevL.nOutBits
             self.compute_v_final.set_inputs(inputs)
-
-            # prepare gates for final rounds
-            for g in self.gates:
-                g.set_early(False)
-                g.set_z()
+            self.start_late()
 
         # updating w1 or w2, which requires updating compute_v_final and the gates
         if inLateRounds:
             self.compute_v_final.next_round(val)
-            for g in self.gates:
-                g.next_round(val)
+            self.next_round_late(val)
 
         # finally, update the h_vals (needs to be done after compute_v and compute_beta are updated)
         self.compute_h.next_round(val)
 
         self.roundNum += 1
+
+    # prepare gates for final rounds. Call once compute_v_final has its inputs
+    def start_late(self):
+        parts = self.late_gate_parts()
+        if parts is not None:
+            # each worker folds its own copy of compute_v_final (see parallel.py)
+            for part in parts:
+                part.set_z1chi(self.compute_z1chi.outputs)
+            self.late_key = ('late', id(self))
+            self.circuit.pool.start_late(self.late_key, parts, self.prevL.nOutBits, self.compute_v_final.inputs)
+        elif self.use_gate_table and self.gate_table.supported:
+            self.gate_table.start_late(self.compute_v_final)
+        else:
+            for g in self.gates:
+                g.set_early(False)
+                g.set_z()
+
+    # late rounds: the values at 0, 1, and -1, before multiplying by beta
+    def compute_late(self):
+        if self.late_key is not None:
+            return self.circuit.pool.compute(self.late_key)
+        elif self.use_gate_table and self.gate_table.supported:
+            return self.gate_table.compute_late(self.compute_v_final)
+
+        out = util.LazyAccum(3)
+        for g in self.gates:
+            g.compute_outputs()
+            # sum contributions from this gate
+            out.add(g.output)
+        return out.value()
+
+    # call after compute_v_final.next_round(val)
+    def next_round_late(self, val):
+        if self.late_key is not None:
+            self.circuit.pool.next_round(self.late_key, val)
+        elif self.use_gate_table and self.gate_table.supported:
+            self.gate_table.next_round_late(val, self.compute_v_final)
+        else:
+            for g in self.gates:
+                g.next_round(val)
+
+class LibraLayerProver(LayerProver):
+    # linear-time late rounds in the style of Libra (Xie et al., CRYPTO 2019), speaking the
+    # same protocol as LayerProver. The early rounds are unchanged. Every supported gate's
+    # function is f(x, y) = a*x*y + b*x + c*y + d, so once the copy variables are bound,
+    #   sum_{x,y} sum_g z1chi(g) chi(x, in0) chi(y, in1) f(V(x), V(y))
+    #     = sum_x V(x) A(x) + B(x),
+    # where A and B are tables with A[in0] += z1chi(g) * (a*V(in1) + b), and so on. Each w1 round
+    # folds V, A, and B, i.e., work proportional to their remaining length rather than to the
+    # number of gates. After the w1 rounds, V(w1) is fixed, and the w2 rounds do the same
+    # with tables indexed by in1 and weighted by chi(w1, in0). Each pair of tables is built
+    # with vector ops on the gate table's buckets, scatter-adding each gate's terms.
+    compute_h_type = LayerComputeHLine
+
+    def __init__(self, prevL, circuit, in0v, in1v, typev, muxv=None):
+        super(LibraLayerProver, self).__init__(prevL, circuit, in0v, in1v, typev, muxv)
+        # per-bucket (a, b, c, d) vectors for each backend and prime, and the two tables being folded
+        self.libra_coeffs = {}
+        self.libra_tables = None
+        self.libra_round = 0
+        self.libra_w1 = []
+
+    # (a, b, c, d) for each bucket of the gate table, as vectors with one element per
+    # gate. A gate's function must be multilinear in its inputs, so these come from
+    # evaluating it at (0, 0), (1, 0), (0, 1), and (1, 1)
+    def gate_coeffs(self, fv):
+        table = self.gate_table
+        consts = table.bucket_consts(fv)
+        coeffs = {}
+        for (t, gates) in table.buckets.items():
+            gatefn = table.gatefn(fv, t, consts.get(t))
+            (zero, one) = (fv.vector([0] * len(gates)), fv.vector([1] * len(gates)))
+            d = gatefn(zero, zero)
+            b = fv.sub(gatefn(one, zero), d)
+            c = fv.sub(gatefn(zero, one), d)
+            a = fv.sub(fv.sub(fv.sub(gatefn(one, one), b), c), d)
+            coeffs[t] = (a, b, c, d)
+        return coeffs
+
+    # the layer's GateTable handles exactly the gate types whose functions are multilinear
+    def use_libra(self):
+        return self.gate_table.supported
+
+    # build tables A and B. For one bucket's (in0, in1) indices, z1chi weights, and (a, b, c, d),
+    # terms gives its gates' contributions to A and B, which go to their in0 (sel == 0) or in1
+    def libra_build(self, sel, terms):
+        fv = self.compute_v_final.fv
+        n = 2 ** self.prevL.nOutBits
+        indices = self.gate_table.bucket_indices(fv)
+        weights = self.gate_table.bucket_z1chi(fv)
+        coeffs = self.libra_coeffs[(fv, Defs.prime)]
+
+        self.libra_tables = None
+        for t in sorted(indices):
+            parts = [ fv.scatter_add(n, indices[t][sel], vals) for vals in terms(indices[t], weights[t], coeffs[t]) ]
+            if self.libra_tables is None:
+                self.libra_tables = parts
+            else:
+                self.libra_tables = [ fv.add(table, part) for (table, part) in zip(self.libra_tables, parts) ]
+
+    def start_late(self):
+        if not self.use_libra():
+            super(LibraLayerProver, self).start_late()
+            return
+
+        vfinal = self.compute_v_final
+        fv = vfinal.fv
+        self.libra_round = 0
+        self.libra_w1 = []
+        key = (fv, Defs.prime)
+        if key not in self.libra_coeffs:
+            self.libra_coeffs[key] = self.gate_coeffs(fv)
+
+        # w1 rounds: tables indexed by in0, having summed over in1
+        def terms(idx, z1, coeffs):
+            (a, b, c, d) = coeffs
+            vin1 = fv.gather_rows(vfinal.inputs_vec, 1, idx[1])
+            return (fv.mul(z1, fv.add(fv.mul(a, vin1), b)), fv.mul(z1, fv.add(fv.mul(c, vin1), d)))
+        self.libra_build(0, terms)
+
+    def start_w2(self):
+        # w2 rounds: tables indexed by in1, with V(w1) and chi(w1, in0) fixed
+        v1 = self.compute_v_final.prevPassValue
+        fv = self.compute_v_final.fv
+        w1chi = fieldvec.chi_table(self.libra_w1, fv)
+
+        def terms(idx, z1, coeffs):
+            (a, b, c, d) = coeffs
+            weight = fv.mul(z1, fv.gather_rows(w1chi, 1, idx[0]))
+            return (fv.mul(weight, fv.add(fv.scale(a, v1), c)), fv.mul(weight, fv.add(fv.scale(b, v1), d)))
+        self.libra_build(1, terms)
+
+    def compute_late(self):
+        if not self.use_libra():
+            return super(LibraLayerProver, self).compute_late()
+
+        vfinal = self.compute_v_final
+        fv = vfinal.fv
+        (tabA, tabB) = self.libra_tables
+        vtab = vfinal.scratch
+        points = [ (vtab[0::2], tabA[0::2], tabB[0::2])
+                 , (vtab[1::2], tabA[1::2], tabB[1::2])
+                 , (vfinal.fact_vecs[0], fv.fold(tabA, util.THIRD_EVAL_POINT), fv.fold(tabB, util.THIRD_EVAL_POINT))
+                 ]
+        return [ (fv.vsum(fv.mul(vvals, avals)) + fv.vsum(bvals)) % Defs.prime for (vvals, avals, bvals) in points ]
+
+    def next_round_late(self, val):
+        if not self.use_libra():
+            super(LibraLayerProver, self).next_round_late(val)
+            return
+
+        nInBits = self.prevL.nOutBits
+        self.libra_round += 1
+        if self.libra_round <= nInBits:
+            self.libra_w1.append(val)
+
+        if self.libra_round == nInBits:
+            self.start_w2()
+        elif self.libra_round < 2 * nInBits:
+            fv = self.compute_v_final.fv
+            self.libra_tables = [ fv.fold(table, val) for table in self.libra_tables ]
@@ -0,0 +1,206 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# worker processes for the sumcheck rounds: early (w3) rounds sharded by copy,
+# and late (w1 and w2) rounds sharded by gate
+
+import multiprocessing
+import traceback
+
+from giraffelib.defs import Defs
+from giraffelib.layercompute import LayerComputeV, LayerComputeVBank
+import giraffelib.util as util
+
+# Each shard is a contiguous, power-of-two-sized range of copies. In the first rounds,
+# which bind the low bits of the copy index, a shard's sums only involve its own copies,
+# so each worker folds its slice of compute_v and compute_beta locally. When only the
+# shard-index bits are left, the workers hand back one value per input and the layer
+# prover finishes the early rounds itself.
+#
+# In the late rounds, every gate's contribution only depends on compute_v_final's table, so
+# each worker runs the gate table's late-round engine on its part of the layer's gates.
+# Rather than receiving the folded table every round, each worker folds its own copy
+# of compute_v_final with the same challenges, so the prover only broadcasts challenges.
+# Workers return their three partial sums, which the prover adds mod p.
+#
+# A worker keeps one state per key, so several provers (e.g., CircuitVerifier.run_batch)
+# can share a pool.
+
+def _sync_defs(defs):
+    # workers are forked once, so pick up any change to the field since then
+    if (Defs.prime, Defs.backend, Defs.ext_nr) != defs:
+        (prime, backend, ext_nr) = defs
+        Defs.backend = backend
+        util.set_prime(prime)
+        Defs.ext_nr = ext_nr
+
+# each state has compute(), next_round(val), and done, which is True after the last round
+class _ShardState(object):
+    def __init__(self, table, nRows, inputs, beta, factors):
+        nBits = util.clog2(len(beta))
+        self.table = table
+        self.done = False
+
+        self.compute_v = LayerComputeVBank(nBits, nRows)
+        self.compute_v.set_other_factors(factors)
+        self.compute_v.set_inputs(inputs)
+
+        # this shard's slice of compute_beta's table, folded the same way
+        self.compute_beta = LayerComputeVBank(nBits, 1)
+        self.compute_beta.set_other_factors(factors)
+        self.compute_beta.set_inputs([ [b] for b in beta ])
+
+    def compute(self):
+        return self.table.compute_early(self.compute_v, self.compute_beta.outputs, self.compute_beta.outputs_fact)
+
+    def next_round(self, val):
+        self.compute_v.next_round(val)
+        self.compute_beta.next_round(val)
+        if self.compute_v.roundNum == self.compute_v.nOutBits:
+            self.done = True
+            return self.compute_v.prevPassValues
+        return None
+
+class _LateShardState(object):
+    def __init__(self, table, nInBits, inputs):
+        self.table = table
+        self.done = False
+
+        # same as LayerProver's compute_v_final
+        self.compute_v_final = LayerComputeV(nInBits)
+        self.compute_v_final.set_other_factors([util.THIRD_EVAL_POINT])
+        self.compute_v_final.set_inputs(inputs)
+        self.table.start_late(self.compute_v_final)
+
+    def compute(self):
+        return self.table.compute_late(self.compute_v_final)
+
+    def next_round(self, val):
+        self.compute_v_final.next_round(val)
+        self.table.next_round_late(val, self.compute_v_final)
+        self.done = self.table.late_round == 2 * self.compute_v_final.nOutBits
+        return None
+
+def _worker(conn):
+    states = {}
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+
+        (cmd, key, args) = msg
+        try:
+            if cmd == "start":
+                _sync_defs(args[0])
+                states[key] = args[1](*args[2:])
+                ret = None
+            elif cmd == "compute":
+                ret = states[key].compute()
+            elif cmd == "next":
+                ret = (states[key].next_round(args[0]), states[key].done)
+                if states[key].done:
+                    del states[key]
+            else:
+                assert False, "unknown command %s" % cmd
+        except Exception:
+            states.pop(key, None)
+            conn.send(("error", traceback.format_exc()))
+        else:
+            conn.send(("ok", ret))
+
+    conn.close()
+
+class ShardPool(object):
+    # fewest gates worth a late-round shard: smaller layers' rounds are cheaper
+    # than a round trip to the workers, so they run in the prover's process
+    min_late_gates = 256
+
+    def __init__(self, nWorkers):
+        # the number of shards is a power of 2, so extra workers would sit idle
+        assert nWorkers > 0
+        self.nWorkers = 2 ** (util.clog2(nWorkers + 1) - 1)
+        self.conns = []
+        self.procs = []
+        for _ in range(0, self.nWorkers):
+            (conn, child) = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_worker, args=(child,))
+            proc.daemon = True
+            proc.start()
+            child.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+        # number of shards each key is using
+        self.active = {}
+
+    # log2 of the number of shards for nCopyBits copy bits. Each shard gets at least two
+    # copies, i.e., one local round; 0 means don't shard
+    def shard_bits(self, nCopyBits):
+        return max(0, min(util.clog2(self.nWorkers + 1) - 1, nCopyBits - 1))
+
+    def _send(self, key, cmd, argss):
+        conns = self.conns[:self.active[key]]
+        for (conn, args) in zip(conns, argss):
+            conn.send((cmd, key, args))
+
+        rets = []
+        errors = []
+        for conn in conns:
+            (status, ret) = conn.recv()
+            if status == "error":
+                errors.append(ret)
+            rets.append(ret)
+        assert not errors, "shard worker failed:\n%s" % errors[0]
+        return rets
+
+    # number of parts to split a layer with nGates gates into for the late rounds; 0 means don't
+    def late_shards(self, nGates):
+        nParts = min(self.nWorkers, nGates // self.min_late_gates)
+        return nParts if nParts > 1 else 0
+
+    def _start(self, key, nShards, argss):
+        self.active[key] = nShards
+        defs = (int(Defs.prime), Defs.backend, Defs.ext_nr)
+        self._send(key, "start", [ (defs,) + args for args in argss ])
+
+    # early rounds: hand each shard its copies' inputs and its slice of beta's table
+    def start(self, key, nShardBits, table, nRows, inputs, beta, factors):
+        assert 0 < nShardBits <= self.shard_bits(util.clog2(len(beta)))
+        nShards = 2 ** nShardBits
+        width = len(beta) // nShards
+
+        argss = []
+        for shard in range(0, nShards):
+            # shards past the end of inputs hold only padding copies
+            sInputs = inputs[shard*width:(shard+1)*width] or [[0] * nRows]
+            argss.append((_ShardState, table, nRows, sInputs, beta[shard*width:(shard+1)*width], factors))
+        self._start(key, nShards, argss)
+
+    # late rounds: hand each shard its part of the gate table and compute_v_final's inputs
+    def start_late(self, key, tables, nInBits, inputs):
+        assert 0 < len(tables) <= self.nWorkers
+        self._start(key, len(tables), [ (_LateShardState, table, nInBits, inputs) for table in tables ])
+
+    # the sum of every shard's values for this round
+    def compute(self, key):
+        rets = self._send(key, "compute", [()] * self.active[key])
+        return [ sum(vals) % Defs.prime for vals in zip(*rets) ]
+
+    # after a shard's last round, returns each shard's result (in the early rounds,
+    # its per-input values); otherwise None
+    def next_round(self, key, val):
+        rets = self._send(key, "next", [(val,)] * self.active[key])
+        if not rets[0][1]:
+            return None
+        del self.active[key]
+        return [ ret for (ret, _) in rets ]
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+        self.conns = []
+        self.procs = []
@@ -4,9 +4,152 @@
 #
 # take output from pylibpws and turn it into something we can use in giraffelib
 
-from giraffelib.gateprover import MulGateProver, AddGateProver, SubGateProver, MuxGateProver
+from giraffelib.defs import Defs
+from giraffelib.gateprover import MulGateProver, AddGateProver, SubGateProver, MuxGateProver, LinearGateProver, \
+                                  CMulGateProver, CAddGateProver
 
-def parse_pws(input_pws):
+# gates whose outputs are linear forms in their layer's inputs
+LINEAR_TYPES = (AddGateProver, SubGateProver, LinearGateProver, CMulGateProver)
+
+# gates whose in1 is a constant rather than a wire
+CONST_TYPES = (CMulGateProver, CAddGateProver)
+
+# the input wires that a gate reads
+def gate_wires(in0, in1, typ):
+    if typ is LinearGateProver:
+        return in0
+    elif typ in CONST_TYPES:
+        return (in0,)
+    return (in0, in1)
+
+def const_gates(input_layer, in0vv, in1vv, typvv, muxvv):
+    # turn add, sub, and mul gates that have one constant input into constant-operand
+    # gates, then drop the gates that only passed those constants up from the input layer.
+    # Constants are the input layer's fixed values, padding, and gates whose inputs are all constants
+    (in0vv, in1vv, typvv, muxvv) = ([ list(v) for v in in0vv ], [ list(v) for v in in1vv ],
+                                    [ list(v) for v in typvv ], [ list(v) for v in muxvv ])
+
+    consts = dict( (wire, val) for (wire, val) in enumerate(input_layer) if val is not None )
+    nPrev = len(input_layer)
+    for (in0v, in1v, typv) in zip(in0vv, in1vv, typvv):
+        # wires past the end of the previous layer are padding, which is always 0
+        const_of = lambda wire: consts.get(wire) if wire < nPrev else 0
+
+        newConsts = {}
+        for out in range(0, len(typv)):
+            (in0, in1, typ) = (in0v[out], in1v[out], typv[out])
+            if typ in CONST_TYPES:
+                c0 = const_of(in0)
+                if c0 is not None:
+                    newConsts[out] = (c0 * in1 if typ is CMulGateProver else c0 + in1) % Defs.prime
+                continue
+            if typ not in (AddGateProver, SubGateProver, MulGateProver):
+                continue
+
+            (c0, c1) = (const_of(in0), const_of(in1))
+            if c0 is not None and c1 is not None:
+                newConsts[out] = typ.gatefn_(c0, c1)
+            elif typ is MulGateProver and (c0 is not None or c1 is not None):
+                (in0v[out], in1v[out], typv[out]) = (in1, c0, CMulGateProver) if c1 is None else (in0, c1, CMulGateProver)
+            elif typ is AddGateProver and (c0 is not None or c1 is not None):
+                (in0v[out], in1v[out], typv[out]) = (in1, c0, CAddGateProver) if c1 is None else (in0, c1, CAddGateProver)
+            elif typ is SubGateProver and c1 is not None:
+                (in0v[out], in1v[out], typv[out]) = (in0, -c1, CAddGateProver)
+
+        consts = newConsts
+        nPrev = len(typv)
+
+    # now drop gates that nothing reads, from the output layer down. The output layer
+    # is left alone, and so is any layer that would end up with fewer than two gates
+    # or whose padding is read (renumbering would change which wires are padding)
+    for lay in range(len(typvv) - 2, -1, -1):
+        nxt = lay + 1
+        live = set()
+        for (in0, in1, typ) in zip(in0vv[nxt], in1vv[nxt], typvv[nxt]):
+            live.update(gate_wires(in0, in1, typ))
+        keep = sorted(live)
+        if len(keep) < 2 or keep[-1] >= len(typvv[lay]) or len(keep) == len(typvv[lay]):
+            continue
+
+        renum = dict( (old, new) for (new, old) in enumerate(keep) )
+        for vv in (in0vv, in1vv, typvv, muxvv):
+            vv[lay] = [ vv[lay][old] for old in keep ]
+        for out in range(0, len(typvv[nxt])):
+            (in0, in1, typ) = (in0vv[nxt][out], in1vv[nxt][out], typvv[nxt][out])
+            if typ is LinearGateProver:
+                in0vv[nxt][out] = tuple( renum[inp] for inp in in0 )
+            elif typ in CONST_TYPES:
+                in0vv[nxt][out] = renum[in0]
+            else:
+                (in0vv[nxt][out], in1vv[nxt][out]) = (renum[in0], renum[in1])
+
+    return (in0vv, in1vv, typvv, muxvv)
+
+# when collapsing linear layers, no gate gets more than this many terms
+MAX_LINEAR_TERMS = 16
+
+def linear_form(in0, in1, typ):
+    # {input wire: coefficient} for an add, sub, constant mul, or linear gate
+    if typ is AddGateProver:
+        terms = [(in0, 1), (in1, 1)]
+    elif typ is SubGateProver:
+        terms = [(in0, 1), (in1, -1)]
+    elif typ is CMulGateProver:
+        terms = [(in0, in1)]
+    else:
+        terms = zip(in0, in1)
+
+    form = {}
+    for (inp, coeff) in terms:
+        form[inp] = form.get(inp, 0) + coeff
+    return form
+
+def compose_linear(form, prevForms):
+    # form is over the outputs of a layer whose gates are prevForms;
+    # return the equivalent form over that layer's inputs
+    out = {}
+    for (mid, coeff) in form.items():
+        # padding outputs are always 0
+        if mid >= len(prevForms):
+            continue
+        for (inp, pcoeff) in prevForms[mid].items():
+            out[inp] = out.get(inp, 0) + coeff * pcoeff
+    return dict( (inp, coeff) for (inp, coeff) in out.items() if coeff != 0 )
+
+def collapse_linear(in0vv, in1vv, typvv, muxvv, maxTerms=MAX_LINEAR_TERMS):
+    # merge consecutive layers of add, sub, constant mul, and linear gates into one layer of linear
+    # gates, e.g., an adder tree into one layer, as long as no gate gets more than maxTerms terms
+    (in0vv, in1vv, typvv, muxvv) = (list(in0vv), list(in1vv), list(typvv), list(muxvv))
+
+    lay = 1
+    while lay < len(typvv):
+        if not all( typ in LINEAR_TYPES for typ in typvv[lay-1] + typvv[lay] ):
+            lay += 1
+            continue
+
+        prevForms = [ linear_form(*gate) for gate in zip(in0vv[lay-1], in1vv[lay-1], typvv[lay-1]) ]
+        forms = [ compose_linear(linear_form(*gate), prevForms) for gate in zip(in0vv[lay], in1vv[lay], typvv[lay]) ]
+        if max( len(form) for form in forms ) > maxTerms:
+            lay += 1
+            continue
+
+        in0v = []
+        in1v = []
+        for form in forms:
+            # a gate whose terms all cancel is a linear gate with one zero term
+            terms = sorted(form.items()) or [(0, 0)]
+            in0v.append(tuple( inp for (inp, _) in terms ))
+            in1v.append(tuple( coeff for (_, coeff) in terms ))
+
+        # the merged layer replaces both; see if it merges with the next one, too
+        in0vv[lay-1:lay+1] = [in0v]
+        in1vv[lay-1:lay+1] = [in1v]
+        typvv[lay-1:lay+1] = [[LinearGateProver] * len(forms)]
+        muxvv[lay-1:lay+1] = [[0] * len(forms)]
+
+    return (in0vv, in1vv, typvv, muxvv)
+
+def parse_pws(input_pws, collapse=False, consts=False):
     input_layer = input_pws[0]
     input_pws = input_pws[1:]
 
@@ -41,10 +184,16 @@ def parse_pws(input_pws):
         typvv.append(typv)
         muxvv.append(muxv)
 
+    if consts:
+        (in0vv, in1vv, typvv, muxvv) = const_gates(input_layer, in0vv, in1vv, typvv, muxvv)
+
+    if collapse:
+        (in0vv, in1vv, typvv, muxvv) = collapse_linear(in0vv, in1vv, typvv, muxvv)
+
     return (input_layer, in0vv, in1vv, typvv, muxvv)
 
 # circuitverifier and circuitprover use this as their metaclass
 class FromPWS(type):
-    def from_pws(cls, input_pws, nCopies):
-        (input_layer, in0vv, in1vv, typvv, muxvv) = parse_pws(input_pws)
+    def from_pws(cls, input_pws, nCopies, collapse=False, consts=False):
+        (input_layer, in0vv, in1vv, typvv, muxvv) = parse_pws(input_pws, collapse, consts)
         return (input_layer, cls(nCopies, len(input_layer), in0vv, in1vv, typvv, muxvv))
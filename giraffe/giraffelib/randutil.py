@@ -10,21 +10,52 @@ from giraffelib.defs import Defs
 import giraffelib.gateprover as gp
 import giraffelib.util as util
 
-def rand_ckt(nOutBits, nInBits):
+def rand_ckt(nOutBits, nInBits, linear=False, fanin=0, consts=False):
     in0v = []
     in1v = []
     typv = []
 
     for _ in range(0, 2**nOutBits):
+        # if fanin > 0, about a quarter of the gates are linear gates with up to fanin terms
+        if fanin > 0 and random.randint(0, 3) == 0:
+            nTerms = random.randint(1, fanin)
+            in0v.append(tuple( random.randint(0, 2**nInBits - 1) for _ in range(0, nTerms) ))
+            in1v.append(tuple( random.choice((1, -1, random.randint(2, 16))) for _ in range(0, nTerms) ))
+            typv.append(gp.LinearGateProver)
+            continue
+
+        # if consts, about a quarter of the gates have a constant operand
+        if consts and random.randint(0, 3) == 0:
+            in0v.append(random.randint(0, 2**nInBits - 1))
+            in1v.append(random.choice((random.randint(-16, 16), Defs.gen_random())))
+            typv.append(random.choice((gp.CMulGateProver, gp.CAddGateProver)))
+            continue
+
         in0v.append(random.randint(0, 2**nInBits - 1))
         in1v.append(random.randint(0, 2**nInBits - 1))
 
         # XXX test muxes!!!
-        typN = random.randint(0, 2)
+        # linear layers have no mul gates
+        typN = random.randint(1 if linear else 0, 2)
         typv.append((gp.MulGateProver, gp.AddGateProver, gp.SubGateProver)[typN])
 
     return (in0v, in1v, typv)
 
+# a random nLayers-layer circuit, nInBits wide at every layer. Each of linear, fanin, and consts
+# is passed to rand_ckt, or if it's a tuple, chosen from it at random for each layer
+def rand_layers(nLayers, nInBits, linear=False, fanin=0, consts=False):
+    pick = lambda arg: random.choice(arg) if isinstance(arg, tuple) else arg
+    in0vv = []
+    in1vv = []
+    typvv = []
+    for _ in range(0, nLayers):
+        (in0v, in1v, typv) = rand_ckt(nInBits, nInBits, pick(linear), pick(fanin), pick(consts))
+        in0vv.append(in0v)
+        in1vv.append(in1v)
+        typvv.append(typv)
+
+    return (in0vv, in1vv, typvv)
+
 def rand_inputs(nInBits, nCopies, inLay=None):
     out = []
 
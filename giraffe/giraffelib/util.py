@@ -4,15 +4,39 @@
 #
 # Utilities
 
+from contextlib import contextmanager
+import gc
 import math
 
-from giraffelib.defs import Defs, FArith
+from giraffelib.defs import Defs, FArith, Fp2
+import giraffelib.fieldvec as fieldvec
 
 def set_prime(p):
+    assert fieldvec.supports(Defs.backend, p), "field backend %s does not support prime %d" % (Defs.backend, p)
     Defs.prime = p
+    Defs.nbits = clog2(p)
+    # re-resolve the backend for the new prime; this also fixes up the element type
+    fieldvec.set_backend(Defs.backend)
     Defs.half = invert_modp(2)
     Defs.third = invert_modp(3)
-    Defs.nbits = clog2(p)
+    # interpolation tables for the old prime are useless now
+    _interp_cache.clear()
+    if Defs.ext_nr is not None:
+        set_extension()
+
+# draw verifier challenges from F_p^2 = F_p[i] / (i^2 - nr) rather than from F_p
+def set_extension(enable=True):
+    if not enable:
+        Defs.ext_nr = None
+        return
+
+    # find a small quadratic non-residue by Euler's criterion; -1 works when p = 3 mod 4
+    p = Defs.prime
+    for cand in [-1] + range(2, 1024):
+        if pow(cand % p, (p - 1) // 2, p) == p - 1:
+            Defs.ext_nr = cand
+            return
+    assert False, "could not find a quadratic non-residue mod %d" % p
 
 def flatten(inlists):
     outlist = []
@@ -27,6 +51,37 @@ def flatten(inlists):
 
     return outlist
 
+# building a large circuit allocates millions of long-lived objects, which makes the
+# cyclic garbage collector run over and over for nothing. Pause it in the meantime.
+@contextmanager
+def gc_paused():
+    wasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if wasEnabled:
+            gc.enable()
+
+# gates with the same type, inputs, and mux bit compute the same value. Returns
+# (outs, slots): outs[k] lists the outputs of the k'th distinct gate, in order of
+# first appearance, and slots[out] is the index of the distinct gate computing out
+def dedup_gates(in0v, in1v, typev, muxv=None):
+    if muxv is None:
+        muxv = [0] * len(in0v)
+
+    outs = []
+    slots = []
+    seen = {}
+    for (out, key) in enumerate(zip(typev, in0v, in1v, muxv)):
+        slot = seen.setdefault(key, len(outs))
+        if slot == len(outs):
+            outs.append([])
+        outs[slot].append(out)
+        slots.append(slot)
+
+    return (outs, slots)
+
 # lsb-to-msb order
 def numToBin(val, bits):
     out = []
@@ -60,6 +115,42 @@ def chi(vec, vals):
 
     return out
 
+# sums of field elements with deferred reduction
+#
+# Python ints can't overflow, but they get slower as they grow, so rather than
+# reducing after every addition we reduce once every Defs.reduce_interval adds
+# and once more when the caller asks for the result.
+class LazyAccum(object):
+    def __init__(self, width=1, interval=None):
+        if interval is None:
+            interval = Defs.reduce_interval
+        self.interval = max(1, interval)
+        self.vals = [0] * width
+        self.count = 0
+
+    def reduce(self):
+        self.vals = [ x % Defs.prime for x in self.vals ]
+        self.count = 0
+
+    def added(self):
+        self.count += 1
+        if self.count >= self.interval:
+            self.reduce()
+
+    # elementwise add of a vector the same width as the accumulator
+    def add(self, vec):
+        self.vals = [ x + y for (x, y) in zip(self.vals, vec) ]
+        self.added()
+
+    # add to a single element
+    def add_at(self, idx, val):
+        self.vals[idx] += val
+        self.added()
+
+    def value(self):
+        self.reduce()
+        return self.vals
+
 def bit_is_set(val, bit):
     return val & (1 << bit) != 0
 
@@ -107,6 +198,9 @@ def interpolate_cubic((f0, f1, fm1, f2)):
 THIRD_EVAL_POINT = -1
 FOURTH_EVAL_POINT = 2
 
+# in evaluation form, sumcheck messages are the evaluations at these points, in this order
+SUMCHECK_EVAL_POINTS = (0, 1, THIRD_EVAL_POINT, FOURTH_EVAL_POINT)
+
 def third_eval_point(val, bit):
     # eval at -1
     if bit:
@@ -131,7 +225,7 @@ def eval_beta_factors(bit):
 # given two vectors, a function, and an identity element, combine them
 def proc_vecs(f, ident, a, b, rec=None):
     if rec is None:
-        rec = FArith().new_cat("q")
+        rec = FArith.null_cat()
     la = len(a)
     lb = len(b)
     lc = max(la, lb)
@@ -161,18 +255,61 @@ def generate_newton_coeffs(deg):
     return out
 
 def invert_modp(val):
-    s  = t_ = 0
-    s_ = t  = 1
-    r  = val
-    r_ = Defs.prime
+    if isinstance(val, Fp2):
+        # (a + bi)^-1 = (a - bi) / (a^2 - nr b^2)
+        return (val.conj() * fieldvec.get().invert(val.norm())) % Defs.prime
+    return fieldvec.get().invert(val)
+
+# invert all of vals with one inversion and 3 * (len(vals) - 1) muls
+def batch_invert(vals, rec=None):
+    if len(vals) == 0:
+        return []
+
+    prods = [1]
+    for val in vals:
+        prods.append((prods[-1] * val) % Defs.prime)
+
+    inv = invert_modp(prods[-1])
+    out = [0] * len(vals)
+    for i in reversed(range(0, len(vals))):
+        out[i] = (inv * prods[i]) % Defs.prime
+        inv = (inv * vals[i]) % Defs.prime
+
+    if rec is not None:
+        rec.did_mul(3 * (len(vals) - 1))
+
+    return out
+
+###
+#  memoized interpolation tables
+###
+# Everything here depends only on the degree and the prime, so we compute each
+# table once. Entries are keyed on (kind, deg, prime, element type) and the
+# whole cache is dropped by set_prime. Callers must not modify what they get.
+_interp_cache = {}
 
-    while r != 0:
-        q = r_ // r
-        (r_, r) = (r, r_ - q * r)
-        (s_, s) = (s, s_ - q * s)
-        (t_, t) = (t, t_ - q * t)
+def _interp_table(kind, deg, gen):
+    key = (kind, deg, Defs.prime, Defs.ftype)
+    ret = _interp_cache.get(key)
+    if ret is None:
+        ret = _interp_cache[key] = gen(deg)
+    return ret
 
-    return t_ % Defs.prime
+def newton_coeffs(deg):
+    return _interp_table("newton", deg, generate_newton_coeffs)
+
+def lagrange_coeffs(deg):
+    return _interp_table("lagrange", deg, generate_lagrange_coeffs)
+
+def barycentric_weights(deg):
+    return _interp_table("bary", deg, generate_barycentric_weights)
+
+def node_weights(nodes):
+    return _interp_table("nodes", tuple(nodes), generate_node_weights)
+
+def small_inverses(n):
+    # 1/1, 1/2, ..., 1/n
+    return _interp_table("inv", n, lambda n_: batch_invert(range(1, n_ + 1)))
 
 def divided_diffs(yvals, rec=None):
     # ASSUMPTION: y0 = f(0), y1 = f(1), y2 = f(2), ...
@@ -180,12 +317,13 @@ def divided_diffs(yvals, rec=None):
     diffs = yvals
 
     if rec is None:
-        rec = FArith().new_cat("q")
+        rec = FArith.null_cat()
 
+    invs = small_inverses(len(diffs) - 1)
     out = [diffs[0]]
     for i in range(0, len(diffs) - 1):
         # this inversion can be stored statically, so we don't have to account its cost
-        div = invert_modp(i + 1)
+        div = invs[i]
         assert len(diffs) > 1
 
         diffs = [ rec.mul(x, div) for x in sub_vecs(diffs[1:], diffs[:-1], rec) ]
@@ -195,20 +333,20 @@ def divided_diffs(yvals, rec=None):
 
 def matrix_times_vector(mat, vec, rec=None):
     if rec is None:
-        rec = FArith().new_cat("q")
+        rec = FArith.null_cat()
     return reduce(lambda x, y: add0_vecs(x, y, rec), [ [ rec.mul0(x, z) for z in y ] for (x, y) in zip(vec, mat) ])
 
 def newton_interpolate(yvals, rec=None):
     assert len(yvals) > 1
     if rec is None:
-        rec = FArith().new_cat("q")
+        rec = FArith.null_cat()
 
     ## step 1, generate divided differences
     diffs = divided_diffs(yvals, rec)
 
     ## step 2, generate coefficients
     # these can be stored statically, so no need to account their cost
-    coeffs = generate_newton_coeffs(len(yvals) - 1)
+    coeffs = newton_coeffs(len(yvals) - 1)
 
     ## step 3, combine
     return matrix_times_vector(coeffs, diffs, rec)
@@ -227,31 +365,87 @@ def horner_eval(coeffs, val, rec=None):
 
     return out
 
+def generate_barycentric_weights(deg):
+    # ASSUMPTION: nodes are 0, 1, ..., deg
+    # w_j = 1 / prod_{m != j} (j - m) = (-1)^(deg - j) / (j! (deg - j)!)
+    fact = [1]
+    for i in range(1, deg + 1):
+        fact.append((fact[-1] * i) % Defs.prime)
+
+    weights = batch_invert([ (fact[j] * fact[deg - j]) % Defs.prime for j in range(0, deg + 1) ])
+    return [ w if (deg - j) % 2 == 0 else (-w) % Defs.prime for (j, w) in enumerate(weights) ]
+
+def generate_node_weights(nodes):
+    # w_j = 1 / prod_{m != j} (x_j - x_m) for arbitrary distinct nodes
+    prods = []
+    for xj in nodes:
+        prod = 1
+        for xm in nodes:
+            if xm != xj:
+                prod = (prod * (xj - xm)) % Defs.prime
+        prods.append(prod)
+
+    return batch_invert(prods)
+
 def generate_lagrange_coeffs(deg):
     # ASSUMPTION: y0 = f(0), y1 = f(1), y2 = f(2), ...
+    # L_j(x) = w_j * prod_{m != j} (x - m), so build the full product once
+    # and divide out each (x - j) synthetically
+    full = [1]
+    for m in range(0, deg+1):
+        full = [ (x - m * y) % Defs.prime for (x, y) in zip([0] + full, full + [0]) ]
+
     outs = []
-    for j in range(0, deg+1):
-        divisor = 1
-        out = [1]
-        for m in range(0, deg+1):
-            if m == j:
-                continue
-            divisor *= (j - m)
-            divisor %= Defs.prime
-            out = mul_coeffs([-1 * m, 1], out)
-        div_inv = invert_modp(divisor)
-        outs.append([ (x * div_inv) % Defs.prime for x in out ])
+    for (j, w) in enumerate(barycentric_weights(deg)):
+        out = [0] * (deg + 1)
+        carry = 0
+        for k in range(deg, -1, -1):
+            carry = (full[k+1] + j * carry) % Defs.prime
+            out[k] = carry
+        outs.append([ (x * w) % Defs.prime for x in out ])
 
     return outs
 
+def barycentric_eval(yvals, val, rec=None, nodes=None):
+    # evaluate the polynomial through (nodes[j], yvals[j]) at val without computing its coefficients
+    # nodes default to 0, 1, ..., len(yvals) - 1
+    if nodes is None:
+        nodes = range(0, len(yvals))
+        weights = barycentric_weights(len(yvals) - 1)
+    else:
+        weights = node_weights(nodes)
+    assert len(nodes) == len(yvals)
+
+    # f(val) = sum_j y_j w_j prod_{m != j} (val - x_m); prefix and suffix
+    # products of (val - x_m) give each term without inverting anything
+    diffs = [ (val - x) % Defs.prime for x in nodes ]
+    npts = len(diffs)
+    pre = [1] * npts
+    for j in range(1, npts):
+        pre[j] = (pre[j-1] * diffs[j-1]) % Defs.prime
+
+    accum = 0
+    suf = 1
+    for j in reversed(range(0, npts)):
+        accum += ((weights[j] * yvals[j]) % Defs.prime) * ((pre[j] * suf) % Defs.prime)
+        if j > 0:
+            suf = (suf * diffs[j]) % Defs.prime
+
+    if rec is not None:
+        rec.did_sub(npts)
+        rec.did_add(npts - 1)
+        rec.did_mul(5 * npts - 4)
+
+    return accum % Defs.prime
+
 def lagrange_interpolate(yvals, rec=None):
     assert len(yvals) > 1
     if rec is None:
-        rec = FArith().new_cat("q")
+        rec = FArith.null_cat()
 
     ## step 1: generate coefficients
     # these can be stored statically, so no need to account their cost
-    coeffs = generate_lagrange_coeffs(len(yvals) - 1)
+    coeffs = lagrange_coeffs(len(yvals) - 1)
 
     ## step 2: dot products
     return matrix_times_vector(coeffs, yvals, rec)
@@ -9,8 +9,10 @@ import os.path
 sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
 
 import giraffetests.compute_v as compute_v
+import giraffetests.fieldvec as fieldvec
 import giraffetests.compute_beta as compute_beta
 import giraffetests.iomlext as iomlext
+import giraffetests.interp as interp
 import giraffetests.layer as layer
 import giraffetests.circuit as circuit
 import giraffetests.verifier as verifier
@@ -28,6 +30,8 @@ else:
 compute_v.run_tests(num_tests)
 compute_beta.run_tests(num_tests)
 iomlext.run_tests(num_tests)
+interp.run_tests(num_tests)
 layer.run_tests(num_tests)
 circuit.run_tests(num_tests)
 verifier.run_tests(num_tests)
+fieldvec.run_tests(num_tests)
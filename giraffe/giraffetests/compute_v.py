@@ -49,20 +49,23 @@ def run_test(nOutBits, nValues):
 
     for i in range(0, nOutBits):
         assert lcv.inputs == inputs
-        assert lcv.outputs == outputs
+        assert list(lcv.outputs) == outputs
+        assert [ lcv.outputs[j] for j in range(0, len(lcv.outputs)) ] == outputs
         assert lcv.scratch == scratch
 
         compute_next_value(taus[i])
         lcv.next_round(taus[i])
 
         if i < nOutBits - 1:
-            assert outputs == lcv.outputs
+            assert outputs == list(lcv.outputs)
             assert scratch == lcv.scratch
 
     assert lcv.prevPassValue == scratch[0]
 
 def run_tests(num_tests):
     for i in range(0, 16 * num_tests):
+        # in-place and fresh-allocation folding must agree
+        LayerComputeV.fold_in_place = (i % 2 == 0)
         run_test(nOutBits, 2**nOutBits - 5)
         run_test(nOutBits, 2**nOutBits - 4)
         run_test(nOutBits, 2**nOutBits - 1)
@@ -70,6 +73,7 @@ def run_tests(num_tests):
         if i % 16 == 0:
             sys.stdout.write('.')
             sys.stdout.flush()
+    LayerComputeV.fold_in_place = True
 
     print " (compute_v test passed)"
 
@@ -0,0 +1,232 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# test field arithmetic backends against the reference backend
+
+# hack: this test lives in a subdir
+import sys
+import os.path
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
+
+import random
+
+from giraffelib import fieldvec, randutil, util
+from giraffelib.circuitverifier import CircuitVerifier, VerifierIOMLExt
+from giraffelib.defs import Defs, FArith
+from giraffelib.layercompute import LayerComputeBeta, LayerComputeV
+
+def run_one_backend_test(fv, nbits):
+    ref = fieldvec.RefFieldVec
+
+    # include some values near the top of the field
+    avals = [ Defs.gen_random() for _ in range(0, 2 ** nbits - 2) ] + [Defs.prime - 1, 0]
+    bvals = [ Defs.gen_random() for _ in range(0, 2 ** nbits - 2) ] + [Defs.prime - 1, Defs.prime - 1]
+    zvals = [ Defs.gen_random() for _ in range(0, nbits) ]
+    sval = Defs.gen_random()
+
+    (a, b) = (fv.vector(avals), fv.vector(bvals))
+    assert fv.tolist(a) == avals
+    assert fv.item(a, 1) == avals[1]
+
+    assert fv.tolist(fv.mul(a, b)) == ref.mul(avals, bvals)
+    assert fv.tolist(fv.add(a, b)) == ref.add(avals, bvals)
+    assert fv.tolist(fv.sub(a, b)) == ref.sub(avals, bvals)
+    assert fv.tolist(fv.sub(b, a)) == ref.sub(bvals, avals)
+    assert fv.tolist(fv.scale(a, sval)) == ref.scale(avals, sval)
+    assert fv.vsum(a) == ref.vsum(avals)
+    assert fv.tolist(fv.fold(a, sval)) == ref.fold(avals, sval)
+
+    # fold in place down to a single element, reading only the first n elements of
+    # the buffer (lists aren't shortened), and into a separate (too long) buffer
+    buf = fv.vector(avals)
+    temps = fv.alloc_temps(len(avals) // 2)
+    folded = avals
+    while len(folded) > 1:
+        buf = fv.fold_into(buf, sval, buf, temps, len(folded))
+        folded = ref.fold(folded, sval)
+        assert fv.tolist(buf)[:len(folded)] == folded
+    assert fv.tolist(fv.fold_into(a, sval, fv.alloc(len(avals))))[:len(avals) // 2] == ref.fold(avals, sval)
+    assert fv.tolist(a) == avals
+    assert fv.tolist(fv.expand(a, 4)) == ref.expand(avals, 4)
+    assert fv.tolist(fv.outer(a, b)) == ref.outer(avals, bvals)
+    assert fv.tolist(fieldvec.chi_table(zvals, fv)) == fieldvec.chi_table(zvals, ref)
+    assert fieldvec.chi_table(zvals, ref) == [ util.chi(util.numToBin(j, nbits), zvals) for j in range(0, 2 ** nbits) ]
+    # every entry is reduced, including in the one-element tables at the bottom of the recursion
+    for table in (fieldvec.chi_table(zvals, ref), fieldvec.chi_table(zvals[:1], ref), fv.tolist(fieldvec.chi_table(zvals[:1], fv))):
+        assert all( 0 <= elm < Defs.prime for elm in table )
+
+    # streamed table, with the same accounting as the sum of its parts
+    chunkBits = random.randint(1, nbits)
+    stream_a = FArith().new_cat("stream")
+    chunks = [ fv.tolist(chunk) for chunk in fieldvec.iter_chi_table(zvals, chunkBits, fv, stream_a) ]
+    assert all( len(chunk) == 2 ** min(chunkBits, nbits) for chunk in chunks )
+    assert util.flatten(chunks) == fieldvec.chi_table(zvals, ref)
+    assert stream_a.get_counts()[1] == nbits or not Defs.track_fArith
+
+    ncols = 2 ** (nbits // 2)
+    assert fv.tolist(fv.dot_rows(a, fv.vector(bvals[:ncols]))) == ref.dot_rows(avals, bvals[:ncols])
+    nrows = len(avals) // ncols
+    xvals = bvals[:nrows]
+    assert fv.tolist(fv.wsum_rows(a, fv.vector(xvals))) == [ sum( x * v for (x, v) in zip(xvals, avals[j::ncols]) ) % Defs.prime for j in range(0, ncols) ]
+    idx = [ random.randrange(0, nrows) for _ in range(0, 5) ]
+    assert fv.tolist(fv.gather_rows(a, ncols, fv.indices(idx))) == util.flatten([ avals[i*ncols:(i+1)*ncols] for i in idx ])
+    # repeated indices, so that sums run past 2^64 without reduction
+    sidx = [ random.choice((0, random.randrange(0, nrows))) for _ in avals ]
+    assert fv.tolist(fv.scatter_add(nrows, fv.indices(sidx), a)) == [ sum( v for (i, v) in zip(sidx, avals) if i == j ) % Defs.prime for j in range(0, nrows) ]
+    assert fv.tolist(fv.scatter_add(nrows, fv.indices([]), fv.vector([]))) == [0] * nrows
+    assert list(fv.shift_indices(fv.indices(idx), 1)) == [ i >> 1 for i in idx ]
+    assert list(fv.index_bits(fv.indices(idx), 0)) == [ i & 1 for i in idx ]
+    assert fv.tolist(fv.fold_points(a, fv.vector(xvals))) == util.flatten([ ref.fold(avals, x) for x in xvals ])
+    assert fv.tolist(fv.fold_rows(a, fv.vector(xvals))) == util.flatten([ ref.fold(avals[k*ncols:(k+1)*ncols], x) for (k, x) in enumerate(xvals) ])
+    assert fv.tolist(fv.horner_rows(a, fv.vector(bvals[:nrows]))) == ref.horner_rows(avals, bvals[:nrows])
+    assert ref.horner_rows(avals, bvals[:nrows]) == [ util.horner_eval(avals[i*ncols:(i+1)*ncols], bvals[i]) for i in range(0, nrows) ]
+
+    # vectorized backends reduce negative and unreduced inputs on the way in
+    if fv.vectorized:
+        assert fv.tolist(fv.vector([-1, Defs.prime + 3])) == [Defs.prime - 1, 3]
+
+def run_one_ext_test(fv, nbits):
+    # fv is an extension field backend. Vectors are all base field values, all extension
+    # field values, or mixed, since the backend treats these differently
+    ref = fieldvec.RefFieldVec
+    def rand_vals(n, ext):
+        return [ Defs.gen_challenge() if ext and random.random() < 0.75 else Defs.gen_random() for _ in range(0, n) ]
+
+    ncols = 2 ** (nbits // 2)
+    nrows = 2 ** nbits // ncols
+    for (aext, bext) in ((False, False), (False, True), (True, False), (True, True)):
+        (avals, bvals) = (rand_vals(2 ** nbits, aext), rand_vals(2 ** nbits, bext))
+        (a, b) = (fv.vector(avals), fv.vector(bvals))
+        sval = Defs.gen_challenge() if bext else Defs.gen_random()
+        assert fv.tolist(a) == avals
+        assert fv.item(a, 1) == avals[1]
+
+        assert fv.tolist(fv.mul(a, b)) == ref.mul(avals, bvals)
+        assert fv.tolist(fv.add(a, b)) == ref.add(avals, bvals)
+        assert fv.tolist(fv.sub(a, b)) == ref.sub(avals, bvals)
+        assert fv.tolist(fv.outer(a, b)) == ref.outer(avals, bvals)
+        assert fv.tolist(fv.scale(a, sval)) == ref.scale(avals, sval)
+        assert fv.vsum(a) == ref.vsum(avals)
+        assert fv.tolist(fv.fold(a, sval)) == ref.fold(avals, sval)
+        assert fv.tolist(fv.fold_into(a, sval, fv.alloc(len(avals)), fv.alloc_temps(len(avals)))) == ref.fold(avals, sval)
+        assert fv.tolist(fv.expand(a, 2)) == ref.expand(avals, 2)
+
+        (xcols, xrows) = (fv.vector(bvals[:ncols]), fv.vector(bvals[:nrows]))
+        assert fv.tolist(fv.dot_rows(a, xcols)) == ref.dot_rows(avals, bvals[:ncols])
+        assert fv.tolist(fv.wsum_rows(a, xrows)) == ref.wsum_rows(avals, bvals[:nrows])
+        assert fv.tolist(fv.fold_points(a, xrows)) == ref.fold_points(avals, bvals[:nrows])
+        assert fv.tolist(fv.fold_rows(a, xrows)) == ref.fold_rows(avals, bvals[:nrows])
+        assert fv.tolist(fv.horner_rows(a, xrows)) == ref.horner_rows(avals, bvals[:nrows])
+        idx = [ random.randrange(0, nrows) for _ in range(0, 5) ]
+        assert fv.tolist(fv.gather_rows(a, ncols, fv.indices(idx))) == ref.gather_rows(avals, ncols, idx)
+        sidx = [ random.randrange(0, nrows) for _ in avals ]
+        assert fv.tolist(fv.scatter_add(nrows, fv.indices(sidx), a)) == ref.scatter_add(nrows, sidx, avals)
+
+    zvals = rand_vals(nbits, True)
+    assert fv.tolist(fieldvec.chi_table(zvals, fv)) == fieldvec.chi_table(zvals, ref)
+
+def run_ext_tests(prime):
+    # extension field challenges on each vectorized backend that supports prime
+    util.set_prime(prime)
+    util.set_extension()
+    for name in fieldvec.available():
+        if not fieldvec.backends[name].vectorized:
+            continue
+        fieldvec.set_backend(name)
+        fv = fieldvec.get()
+        assert issubclass(fv, fieldvec.Fp2FieldVec)
+        run_one_ext_test(fv, random.randint(2, 6))
+        fieldvec.set_backend("ref")
+        run_one_verifier_test(name, random.randint(2, 3), 2**random.randint(1, 3), random.randint(2, 3))
+    util.set_extension(False)
+    util.set_prime(2 ** 61 - 1)
+
+def force_vectorized(name, force=True):
+    # test sizes are below min_size, so make sure we're actually using the backend
+    fv = fieldvec.backends[name]
+    if force:
+        fv.saved_min_size = fv.min_size
+        fv.min_size = 0
+    else:
+        fv.min_size = fv.saved_min_size
+
+def run_one_layer_test(name, nbits):
+    inputs = [ Defs.gen_random() for _ in range(0, 2 ** nbits - 3) ]
+    zvals = [ Defs.gen_random() for _ in range(0, nbits) ]
+
+    results = []
+    for bname in ("ref", name):
+        fieldvec.set_backend(bname)
+        lcv = LayerComputeV(nbits)
+        lcv.set_inputs(list(inputs))
+        trace = []
+        for z in zvals:
+            trace.append((list(lcv.outputs), [ list(fact) for fact in lcv.outputs_fact ]))
+            lcv.next_round(z)
+
+        beta = LayerComputeBeta(nbits, zvals)
+        mlext = VerifierIOMLExt(zvals).compute(list(inputs))
+
+        results.append((trace, lcv.prevPassValue, beta.outputs, mlext))
+
+    fieldvec.set_backend("ref")
+    assert results[0] == results[1], "backend %s disagrees with reference" % name
+
+def run_one_verifier_test(name, nInBits, nCopies, nLayers):
+    # include linear and constant-operand gates, which the gate table evaluates specially
+    (in0vv, in1vv, typvv) = randutil.rand_layers(nLayers, nInBits, False, (0, 4), (True, False))
+
+    fieldvec.set_backend(name)
+    ver = CircuitVerifier(nCopies, 2**nInBits, in0vv, in1vv, typvv)
+    ver.build_prover()
+    ver.run(randutil.rand_inputs(nInBits, nCopies))
+    fieldvec.set_backend("ref")
+
+def run_prime_tests(prime):
+    util.set_prime(prime)
+    for name in fieldvec.available():
+        fieldvec.set_backend(name)
+        assert (Defs.half * 2) % Defs.prime == 1 and (Defs.third * 3) % Defs.prime == 1
+        if Defs.ftype is int:
+            assert isinstance(Defs.gen_random(), (int, long))
+        else:
+            assert type(Defs.gen_random()) is Defs.ftype
+        fieldvec.set_backend("ref")
+
+        run_one_backend_test(fieldvec.backends[name], random.randint(2, 6))
+        run_one_layer_test(name, random.randint(3, 6))
+        run_one_verifier_test(name, random.randint(2, 3), 2**random.randint(1, 3), random.randint(2, 3))
+    util.set_prime(2 ** 61 - 1)
+
+def run_tests(num_tests):
+    names = fieldvec.available()
+    for name in names:
+        force_vectorized(name)
+
+    for i in range(0, num_tests):
+        for name in names:
+            run_one_backend_test(fieldvec.backends[name], random.randint(2, 8))
+            run_one_layer_test(name, random.randint(3, 8))
+            run_one_verifier_test(name, random.randint(2, 4), 2**random.randint(1, 5), random.randint(2, 4))
+
+        # other primes
+        if i % 4 == 0:
+            run_prime_tests(2 ** 63 + 2 ** 19 + 1)
+            run_prime_tests(2 ** 127 - 1)
+            run_prime_tests(2 ** 255 - 19)
+
+        # extension field challenges
+        if i % 4 == 1:
+            run_ext_tests(random.choice((2 ** 61 - 1, 2 ** 31 - 1)))
+
+        sys.stdout.write('.')
+        sys.stdout.flush()
+
+    for name in names:
+        force_vectorized(name, False)
+
+    print " (fieldvec test passed: %s)" % ", ".join(names)
+
+if __name__ == "__main__":
+    run_tests(128)
@@ -0,0 +1,78 @@
+#!/usr/bin/python2.7
+#
+# (C) 2016 Riad S. Wahby <rsw@cs.nyu.edu>
+#
+# test interpolation and the memoized interpolation tables
+
+# hack: this test lives in a subdir
+import sys
+import os.path
+sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
+
+import random
+
+from giraffelib import util
+from giraffelib.defs import Defs
+
+def slow_lagrange_coeffs(deg):
+    # straightforward construction, one basis polynomial at a time
+    outs = []
+    for j in range(0, deg+1):
+        divisor = 1
+        out = [1]
+        for m in range(0, deg+1):
+            if m == j:
+                continue
+            divisor *= (j - m)
+            divisor %= Defs.prime
+            out = util.mul_coeffs([-1 * m, 1], out)
+        div_inv = util.invert_modp(divisor)
+        outs.append([ (x * div_inv) % Defs.prime for x in out ])
+
+    return outs
+
+def run_one_test(deg):
+    assert util.lagrange_coeffs(deg) == slow_lagrange_coeffs(deg)
+    assert util.lagrange_coeffs(deg) is util.lagrange_coeffs(deg)
+
+    yvals = [ Defs.gen_random() for _ in range(0, deg + 1) ]
+    coeffs = util.interpolate(yvals)
+    assert coeffs == util.newton_interpolate(yvals)
+    assert all([ util.horner_eval(coeffs, x) == y for (x, y) in enumerate(yvals) ])
+
+    val = Defs.gen_random()
+    assert util.barycentric_eval(yvals, val) == util.horner_eval(coeffs, val)
+    assert util.barycentric_eval(yvals, deg) == yvals[deg]
+
+    vals = [ Defs.gen_random() for _ in range(0, deg) ]
+    assert all([ (x * y) % Defs.prime == 1 for (x, y) in zip(vals, util.batch_invert(vals)) ])
+
+    # extension field points and values
+    util.set_extension()
+    val = Defs.gen_challenge()
+    assert (val * util.invert_modp(val)) % Defs.prime == 1
+    assert util.barycentric_eval(yvals, val) == util.horner_eval(coeffs, val)
+    eyvals = [ Defs.gen_challenge() for _ in range(0, deg + 1) ]
+    assert util.barycentric_eval(eyvals, val) == util.horner_eval(util.interpolate(eyvals), val)
+    util.set_extension(False)
+
+def run_prime_test(prime, deg):
+    # set_prime must not leave stale tables behind
+    util.set_prime(prime)
+    run_one_test(deg)
+    util.set_prime(2 ** 61 - 1)
+    run_one_test(deg)
+
+def run_tests(num_tests):
+    for i in range(0, num_tests):
+        run_one_test(random.randint(1, 12))
+        if i % 4 == 0:
+            run_prime_test(random.choice((2 ** 127 - 1, 2 ** 255 - 19)), random.randint(1, 8))
+
+        sys.stdout.write('.')
+        sys.stdout.flush()
+
+    print " (interp test passed)"
+
+if __name__ == "__main__":
+    run_tests(128)
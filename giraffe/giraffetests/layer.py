@@ -13,18 +13,21 @@ import random
 
 from giraffelib import util, randutil
 from giraffelib.arithcircuit import ArithCircuit, ArithCircuitLayer, ArithCircuitInputLayer
+from giraffelib.arithcircuitbuilder import ArithCircuitBuilder
 from giraffelib.circuitprover import _DummyCircuitProver
 from giraffelib.defs import Defs
+from giraffelib.gateprover import MulGateProver
 from giraffelib.layercompute import LayerComputeBeta
-from giraffelib.layerprover import InputLayer, LayerProver
+from giraffelib.layerprover import InputLayer, LayerProver, LibraLayerProver
+from giraffelib.parallel import ShardPool
 
-def run_one_test(nInBits, nCopies):
+def run_one_test(nInBits, nCopies, firstFast=False, linear=False, consts=False):
     nOutBits = nInBits
 
     circuit = _DummyCircuitProver(nCopies)
     inLayer = InputLayer(nOutBits)
 
-    (in0v, in1v, typv) = randutil.rand_ckt(nOutBits, nInBits)
+    (in0v, in1v, typv) = randutil.rand_ckt(nOutBits, nInBits, linear, 0, consts)
     typc = [ tc.cgate for tc in typv ]
     inputs = randutil.rand_inputs(nInBits, nCopies)
 
@@ -43,6 +46,8 @@ def run_one_test(nInBits, nCopies):
 
     outLayer = LayerProver(inLayer, circuit, in0v, in1v, typv)
     outLayer.set_inputs(inputs)
+    if firstFast:
+        outLayer.set_outputs(outputs)
     outLayer.set_z(z1, z2)
 
     # mlExt of outputs
@@ -58,6 +63,8 @@ def run_one_test(nInBits, nCopies):
 
     outLayer.compute_outputs()
     initOutputs = outLayer.output
+    assert len(initOutputs) == outLayer.early_degree + 1
+    assert outLayer.early_degree == (3 if MulGateProver in typv else 2)
 
     assert inLayerExt == (initOutputs[0] + sum(initOutputs)) % Defs.prime
 
@@ -92,12 +99,191 @@ def run_one_test(nInBits, nCopies):
     assert v1 == finalOutputs[0]
     assert v2 == sum(finalOutputs) % Defs.prime
 
+def compare_provers(make_a, make_b, inputs, check=None):
+    # drive two layer provers for the same layer through every round with the same
+    # challenges; they must send identical messages, including the final H.
+    # check(rd, layers), if given, runs after each round's messages
+    layers = [make_a(), make_b()]
+    (layer, circuit) = (layers[0], layers[0].circuit)
+    z1 = [ Defs.gen_random() for _ in range(0, layer.nOutBits) ]
+    z2 = [ Defs.gen_random() for _ in range(0, circuit.nCopyBits) ]
+    vals = [ Defs.gen_random() for _ in range(0, circuit.nCopyBits + 2 * layer.prevL.nOutBits) ]
+
+    for layer in layers:
+        layer.set_inputs(inputs)
+        layer.set_z(z1, z2)
+
+    for (rd, val) in enumerate(vals):
+        for layer in layers:
+            layer.compute_outputs()
+        assert layers[0].output == layers[1].output
+        if check is not None:
+            check(rd, layers)
+        for layer in layers:
+            layer.next_round(val)
+
+    for layer in layers:
+        layer.compute_outputs()
+    assert layers[0].output == layers[1].output
+    return layers
+
+def run_engine_test(nInBits, nCopies, linear=False, fanin=0, consts=False):
+    # the gate table and the per-gate provers must send identical messages every round
+    circuit = _DummyCircuitProver(nCopies)
+    inLayer = InputLayer(nInBits)
+    (in0v, in1v, typv) = randutil.rand_ckt(nInBits, nInBits, linear, fanin, consts)
+
+    def make(useTable):
+        layer = LayerProver(inLayer, circuit, in0v, in1v, typv)
+        layer.use_gate_table = useTable
+        return layer
+
+    compare_provers(lambda: make(True), lambda: make(False), randutil.rand_inputs(nInBits, nCopies))
+
+def run_libra_test(nInBits, nCopies, linear=False, fanin=0, consts=False):
+    # the Libra-style engine must send the same messages as LayerProver
+    circuit = _DummyCircuitProver(nCopies)
+    circuit.eval_form = random.choice((True, False))
+    inLayer = InputLayer(nInBits)
+    (in0v, in1v, typv) = randutil.rand_ckt(nInBits, nInBits, linear, fanin, consts)
+
+    layers = compare_provers(lambda: LayerProver(inLayer, circuit, in0v, in1v, typv),
+                             lambda: LibraLayerProver(inLayer, circuit, in0v, in1v, typv),
+                             randutil.rand_inputs(nInBits, nCopies))
+    assert len(layers[1].output) == nInBits + 1
+
+def run_pool_test(pool, nInBits, nCopies, linear=False):
+    # sharding the early rounds by copy and the late rounds by gate across
+    # worker processes must not change any message
+    inLayer = InputLayer(nInBits)
+    (in0v, in1v, typv) = randutil.rand_ckt(nInBits, nInBits, linear, random.choice((0, 4)), random.choice((True, False)))
+
+    # test layers are small, so usually shard the late rounds anyway
+    pool.min_late_gates = random.choice((1, ShardPool.min_late_gates))
+
+    def make(usePool):
+        circuit = _DummyCircuitProver(nCopies)
+        circuit.pool = pool if usePool else None
+        return LayerProver(inLayer, circuit, in0v, in1v, typv)
+
+    def check(rd, layers):
+        nCopyBits = layers[0].circuit.nCopyBits
+        assert layers[0].nShardBits == pool.shard_bits(nCopyBits)
+        assert (layers[0].late_key is not None) == (rd >= nCopyBits and pool.late_shards(len(layers[0].gates)) > 0)
+
+    compare_provers(lambda: make(True), lambda: make(False), randutil.rand_inputs(nInBits, nCopies), check)
+
+def run_dedup_test(nInBits, nCopies, useTable, fanin=0):
+    # copy some gates over others; deduplicated layers must compute and prove the same thing
+    circuit = _DummyCircuitProver(nCopies)
+    inLayer = InputLayer(nInBits)
+    (in0v, in1v, typv) = randutil.rand_ckt(nInBits, nInBits, False, fanin)
+    nDups = random.randint(1, len(in0v) - 1)
+    for dst in random.sample(range(0, len(in0v)), nDups):
+        src = random.randrange(0, len(in0v))
+        (in0v[dst], in1v[dst], typv[dst]) = (in0v[src], in1v[src], typv[src])
+    nDistinct = len(set(zip(in0v, in1v, typv)))
+    inputs = randutil.rand_inputs(nInBits, nCopies)
+
+    outputs = []
+    counts = []
+    for dedup in (True, False):
+        ArithCircuitLayer.dedup = dedup
+        counts.append(ArithCircuitBuilder(nCopies, 2**nInBits, [in0v], [in1v], [typv]).get_counts())
+        ArithCircuitLayer.dedup = True
+
+        ckt = ArithCircuit()
+        inCktLayer = ArithCircuitInputLayer(ckt, nInBits)
+        ArithCircuitLayer.dedup = dedup
+        outCktLayer = ArithCircuitLayer(ckt, inCktLayer, in0v, in1v, [ tc.cgate for tc in typv ])
+        ArithCircuitLayer.dedup = True
+        assert outCktLayer.nDupGates == (len(in0v) - nDistinct if dedup else 0)
+        ckt.layers = [inCktLayer, outCktLayer]
+        outs = []
+        for inp in inputs:
+            ckt.run(inp)
+            outs.append(ckt.outputs)
+        outputs.append(outs)
+    assert outputs[0] == outputs[1]
+    # gate counts (e.g., for the hardware simulation's costs) include duplicates
+    assert counts[0] == counts[1]
+
+    def make(dedup):
+        LayerProver.dedup = dedup
+        layer = LayerProver(inLayer, circuit, in0v, in1v, typv)
+        LayerProver.dedup = True
+        # linear gates that share an input share a gate prover, but only whole gates are duplicates
+        assert layer.nDupGates == (len(in0v) - nDistinct if dedup else 0)
+        assert fanin > 0 or len(layer.gates) == len(in0v) - layer.nDupGates
+        layer.use_gate_table = useTable
+        return layer
+
+    compare_provers(lambda: make(True), lambda: make(False), inputs)
+
+def run_accum_test(width, nvals):
+    vecs = [ [ Defs.gen_random() * Defs.gen_random() for _ in range(0, width) ] for _ in range(0, nvals) ]
+    expect = [ sum(col) % Defs.prime for col in zip(*vecs) ]
+
+    for interval in (1, 3, Defs.reduce_interval):
+        acc = util.LazyAccum(width, interval)
+        for vec in vecs:
+            acc.add(vec)
+        assert acc.value() == expect
+
+        acc = util.LazyAccum(width, interval)
+        for (idx, val) in enumerate(util.flatten(vecs)):
+            acc.add_at(idx % width, val)
+        assert acc.value() == expect
+
 def run_tests(num_tests):
+    saveInterval = Defs.reduce_interval
+    pool = ShardPool(4)
     for _ in range(0, num_tests):
+        run_accum_test(random.randint(1, 4), random.randint(1, 128))
+
+        # reducing on every add must give the same answer as deferring
+        Defs.reduce_interval = random.choice((1, 2, saveInterval))
         run_one_test(random.randint(2, 6), 2**random.randint(1, 6))
+        Defs.reduce_interval = saveInterval
+
+        # first round from stored outputs
+        run_one_test(random.randint(2, 6), 2**random.randint(1, 6), True)
+
+        # per-gate evaluation rather than the gate table
+        LayerProver.use_gate_table = False
+        run_one_test(random.randint(2, 6), 2**random.randint(1, 6))
+        LayerProver.use_gate_table = True
+        run_engine_test(random.randint(1, 6), 2**random.randint(1, 6))
+
+        # no mul gates: quadratic messages in every round
+        run_one_test(random.randint(2, 6), 2**random.randint(1, 6), firstFast=random.choice((True, False)), linear=True)
+        LayerProver.use_gate_table = False
+        run_one_test(random.randint(2, 6), 2**random.randint(1, 6), firstFast=False, linear=True)
+        LayerProver.use_gate_table = True
+        run_engine_test(random.randint(1, 6), 2**random.randint(1, 6), True)
+
+        # high-fan-in linear gates
+        run_engine_test(random.randint(1, 6), 2**random.randint(1, 6), random.choice((True, False)), random.randint(1, 8))
+
+        # constant-operand gates, with and without the first-round fast path and the gate table
+        run_one_test(random.randint(2, 6), 2**random.randint(1, 6), random.choice((True, False)), False, True)
+        LayerProver.use_gate_table = False
+        run_one_test(random.randint(2, 6), 2**random.randint(1, 6), random.choice((True, False)), False, True)
+        LayerProver.use_gate_table = True
+        run_engine_test(random.randint(1, 6), 2**random.randint(1, 6), random.choice((True, False)), random.choice((0, 4)), True)
+
+        # Libra-style late rounds
+        run_libra_test(random.randint(1, 6), 2**random.randint(1, 6), random.choice((True, False)), random.choice((0, 4)), random.choice((True, False)))
+
+        # duplicate gates
+        run_dedup_test(random.randint(1, 6), 2**random.randint(1, 6), random.choice((True, False)), random.choice((0, 4)))
+
+        # early rounds sharded across worker processes
+        run_pool_test(pool, random.randint(1, 5), 2**random.randint(1, 6), random.choice((True, False)))
         sys.stdout.write('.')
         sys.stdout.flush()
 
+    pool.close()
     print " (layer test passed)"
 
 if __name__ == "__main__":
@@ -12,38 +12,198 @@ sys.path.insert(1, os.path.abspath(os.path.join(sys.path[0], os.pardir)))
 import random
 
 from giraffelib.circuitverifier import CircuitVerifier
-from giraffelib import randutil
+from giraffelib.defs import Defs
+from giraffelib import randutil, util
+from giraffelib.arithcircuitbuilder import ArithCircuitBuilder
+from giraffelib.gateprover import LinearGateProver
+from giraffelib.parallel import ShardPool
+from giraffelib.parse_pws import MAX_LINEAR_TERMS
 
-def run_one_test(nInBits, nCopies, nLayers, qStat):
-    nOutBits = nInBits
-
-    in0vv = []
-    in1vv = []
-    typvv = []
-    for _ in range(0, nLayers):
-        (in0v, in1v, typv) = randutil.rand_ckt(nOutBits, nInBits)
-        in0vv.append(in0v)
-        in1vv.append(in1v)
-        typvv.append(typv)
+def run_one_test(nInBits, nCopies, nLayers, qStat, evalForm=False, fanin=0, consts=False):
+    (in0vv, in1vv, typvv) = randutil.rand_layers(nLayers, nInBits, False, fanin, consts)
 
     ver = CircuitVerifier(nCopies, 2**nInBits, in0vv, in1vv, typvv)
+    ver.eval_form = evalForm
     ver.build_prover()
     inputs = randutil.rand_inputs(nInBits, nCopies)
     ver.run(inputs)
 
+    if not Defs.track_fArith:
+        assert all([ fArith.get_counts() == (0, 0, 0) for fArith in [ver.in_a, ver.out_a, ver.sc_a, ver.tV_a, ver.nlay_a] ])
+
     if not qStat:
         print "nInBits: %d, nCopies: %d, nLayers: %d" % (nInBits, nCopies, nLayers)
         for fArith in [ver.in_a, ver.out_a, ver.sc_a, ver.tV_a, ver.nlay_a]:
             print ("    %s: %%d mul, %%d add, %%d sub" % fArith.cat) % fArith.get_counts()
 
+def run_batch_test(nInBits, nCopies, nLayers, nProofs, evalForm=False):
+    (in0vv, in1vv, typvv) = randutil.rand_layers(nLayers, nInBits)
+
+    ver = CircuitVerifier(nCopies, 2**nInBits, in0vv, in1vv, typvv)
+    ver.eval_form = evalForm
+    ver.build_provers(nProofs)
+    ver.run_batch([ randutil.rand_inputs(nInBits, nCopies) for _ in range(0, nProofs) ])
+
+    # corrupt one message from one (fresh) prover and make sure the batch is rejected
+    bad = random.choice(ver.build_provers(nProofs))
+    badRound = random.randint(0, 2 * nInBits + ver.nCopyBits - 1)
+    get_outputs = bad.get_outputs
+    state = {'rd': 0}
+    def bad_get_outputs():
+        outs = list(get_outputs())
+        if state['rd'] == badRound:
+            outs[0] = (outs[0] + 1) % Defs.prime
+        state['rd'] += 1
+        return outs
+    bad.get_outputs = bad_get_outputs
+
+    try:
+        ver.run_batch([ randutil.rand_inputs(nInBits, nCopies) for _ in range(0, nProofs) ])
+    except AssertionError as e:
+        assert "proof %d" % ver.provers.index(bad) in str(e)
+    else:
+        assert False, "batch verification accepted a bad proof"
+
+def run_pool_test(pool, nInBits, nCopies, nLayers, nProofs):
+    # several provers sharing one pool, with their rounds interleaved
+    (in0vv, in1vv, typvv) = randutil.rand_layers(nLayers, nInBits, (True, False))
+
+    pool.min_late_gates = random.choice((1, ShardPool.min_late_gates))
+    ver = CircuitVerifier(nCopies, 2**nInBits, in0vv, in1vv, typvv)
+    for prover in ver.build_provers(nProofs):
+        prover.set_pool(pool)
+    ver.run_batch([ randutil.rand_inputs(nInBits, nCopies) for _ in range(0, nProofs) ])
+
+def run_degree_test(nInBits, nCopies, nLayers, evalForm):
+    # some layers have no mul gates, so their w3 rounds use quadratics
+    # and the output layer has none
+    (in0vv, in1vv, typvv) = [ lower + top for (lower, top) in zip(randutil.rand_layers(nLayers, nInBits, (True, False)),
+                                                                  randutil.rand_layers(1, nInBits, True)) ]
+
+    ver = CircuitVerifier(nCopies, 2**nInBits, in0vv, in1vv, typvv)
+    ver.eval_form = evalForm
+    ver.build_prover()
+    ver.run(randutil.rand_inputs(nInBits, nCopies))
+    assert ver.layEarlyLens[0] == 3
+
+    # a correct message padded to a higher degree must be rejected
+    ver.build_prover()
+    get_outputs = ver.prover.get_outputs
+    state = {'rd': 0}
+    def bad_get_outputs():
+        outs = list(get_outputs())
+        if state['rd'] == 0:
+            outs.append(outs[-1] if evalForm else 0)
+        state['rd'] += 1
+        return outs
+    ver.prover.get_outputs = bad_get_outputs
+
+    try:
+        ver.run(randutil.rand_inputs(nInBits, nCopies))
+    except AssertionError as e:
+        assert "Wrong degree in round 0 of layer 0" in str(e)
+    else:
+        assert False, "verifier accepted a message of the wrong degree"
+
+def run_collapse_test(nInBits, nCopies, nLayers):
+    # runs of add and sub layers collapse into linear gates without changing the outputs
+    input_pws = [[None] * (2 ** nInBits)]
+    width = 2 ** nInBits
+    for _ in range(0, nLayers):
+        gStrs = random.choice((('ADD', 'SUB'), ('ADD', 'SUB', 'MUL')))
+        nGates = random.randint(2, 2 ** nInBits)
+        input_pws.append([ (random.choice(gStrs), random.randrange(0, width), random.randrange(0, width), None) for _ in range(0, nGates) ])
+        width = 2 ** util.clog2(nGates)
+
+    (input_layer, builder) = ArithCircuitBuilder.from_pws(input_pws, nCopies)
+    (_, collapsed) = ArithCircuitBuilder.from_pws(input_pws, nCopies, True)
+    inputs = randutil.rand_inputs(0, nCopies, input_layer)
+    assert builder.run(inputs)[0] == collapsed.run(inputs)[0]
+    assert len(collapsed.arith_circuit.layers) <= len(builder.arith_circuit.layers)
+
+    (_, ver) = CircuitVerifier.from_pws(input_pws, nCopies, True)
+    for (in0v, typv) in zip(ver.in0vv, ver.typvv):
+        assert all( len(in0) <= MAX_LINEAR_TERMS for (in0, typ) in zip(in0v, typv) if typ is LinearGateProver )
+    ver.build_prover()
+    ver.run(inputs)
+
+def run_const_test(nInBits, nCopies, nLayers):
+    # gates on constant inputs become constant-operand gates without changing the outputs
+    input_layer = [ random.choice((None, None, random.randint(0, 16))) for _ in range(0, 2 ** nInBits) ]
+    input_pws = [input_layer]
+    width = 2 ** nInBits
+    for _ in range(0, nLayers):
+        nGates = random.randint(2, 2 ** nInBits)
+        layer = []
+        for _ in range(0, nGates):
+            layer.append((random.choice(('ADD', 'SUB', 'MUL')), random.randrange(0, width), random.randrange(0, width), None))
+        input_pws.append(layer)
+        width = 2 ** util.clog2(nGates)
+
+    (_, builder) = ArithCircuitBuilder.from_pws(input_pws, nCopies)
+    for collapse in (False, True):
+        (_, folded) = ArithCircuitBuilder.from_pws(input_pws, nCopies, collapse, True)
+        inputs = randutil.rand_inputs(0, nCopies, list(input_layer))
+        assert builder.run(inputs)[0] == folded.run(inputs)[0]
+
+        (_, ver) = CircuitVerifier.from_pws(input_pws, nCopies, collapse, True)
+        ver.build_prover()
+        ver.run(inputs)
+
+def run_ext_test(prime):
+    util.set_prime(prime)
+    util.set_extension()
+    run_one_test(random.randint(2, 4), 2**random.randint(3, 6), random.randint(2, 4), True)
+    util.set_extension(False)
+    util.set_prime(2 ** 61 - 1)
+
 def run_tests(num_tests, qStat=True):
-    for _ in range(0, num_tests):
+    saveTrack = Defs.track_fArith
+    pool = ShardPool(4)
+    for i in range(0, num_tests):
         run_one_test(random.randint(2, 4), 2**random.randint(3, 8), random.randint(2, 5), qStat)
 
+        # verification must not depend on op accounting
+        if i % 4 == 0:
+            Defs.track_fArith = False
+            run_one_test(random.randint(2, 4), 2**random.randint(3, 8), random.randint(2, 5), True)
+            Defs.track_fArith = saveTrack
+
+        # base field circuit, extension field challenges
+        if i % 4 == 1:
+            run_ext_test(random.choice((2 ** 61 - 1, 2 ** 31 - 1)))
+
+        # several proofs verified together
+        run_batch_test(random.randint(2, 4), 2**random.randint(1, 5), random.randint(2, 4), random.randint(1, 8), random.choice((True, False)))
+
+        # early rounds sharded across worker processes
+        run_pool_test(pool, random.randint(2, 4), 2**random.randint(1, 6), random.randint(2, 4), random.randint(1, 3))
+
+        # reduced-degree sumcheck for linear layers
+        run_degree_test(random.randint(2, 4), 2**random.randint(1, 6), random.randint(1, 3), random.choice((True, False)))
+
+        # sumcheck messages as evaluations
+        run_one_test(random.randint(2, 4), 2**random.randint(3, 8), random.randint(2, 5), True, True)
+
+        # high-fan-in linear gates, and linear layers collapsed into them
+        run_one_test(random.randint(2, 4), 2**random.randint(1, 6), random.randint(2, 4), True, random.choice((True, False)), random.randint(1, 8))
+        run_collapse_test(random.randint(2, 4), 2**random.randint(1, 4), random.randint(1, 6))
+
+        # constant-operand gates
+        run_one_test(random.randint(2, 4), 2**random.randint(1, 6), random.randint(2, 4), True, random.choice((True, False)), 0, True)
+        run_const_test(random.randint(2, 4), 2**random.randint(1, 4), random.randint(1, 6))
+
+        # Libra-style layer provers
+        CircuitVerifier.engine = "libra"
+        run_one_test(random.randint(2, 4), 2**random.randint(1, 6), random.randint(2, 4), True, random.choice((True, False)), random.choice((0, 4)), random.choice((True, False)))
+        run_batch_test(random.randint(2, 4), 2**random.randint(1, 5), random.randint(2, 4), random.randint(1, 4))
+        CircuitVerifier.engine = "giraffe"
+
         if qStat:
             sys.stdout.write('.')
             sys.stdout.flush()
 
+    pool.close()
     if qStat:
         print " (verifier test passed)"
 
@@ -14,18 +14,30 @@ except ImportError:
     print "ERROR: could not import pypws; you should run `make`. Giving up now."
     sys.exit(1)
 
+import giraffelib.circuitprover as cprv
 import giraffelib.circuitverifier as cver
+import giraffelib.fieldvec as fieldvec
 import giraffelib.randutil as randutil
 import giraffelib.util as util
+from giraffelib.defs import Defs
+from giraffelib.parallel import ShardPool
 
 class VerifierInfo(object):
     nCopyBits = 1
     nCopies = 2
     pwsFile = None
     inputFile = None
+    backend = "auto"
+    prime = None
+    extension = False
+    evalForm = False
+    collapse = False
+    consts = False
+    nWorkers = 0
+    engine = "giraffe"
 
 def get_usage():
-    uStr =  "Usage: %s [-c <nCopyBits>] [-i <inputsFile>] -p <pwsFile>\n\n" % sys.argv[0]
+    uStr =  "Usage: %s [-c <nCopyBits>] [-i <inputsFile>] [-b <backend>] [-P <prime>] [-e] [-v] [-l] [-k] [-j <nWorkers>] [-g <engine>] -p <pwsFile>\n\n" % sys.argv[0]
     uStr += " option        description                                 default\n"
     uStr += " --            --                                          --\n"
 
@@ -36,6 +48,29 @@ def get_usage():
     uStr += " -i inputFile: file containing inputs for each copy        (None)\n"
     uStr += "               (otherwise, inputs are generated at random\n"
 
+    uStr += " -b backend:   field arithmetic backend                    (%s)\n" % VerifierInfo.backend
+    uStr += "               (one of: %s)\n" % ", ".join(["auto"] + sorted(fieldvec.backends))
+
+    uStr += " -P prime:     field modulus                               (%d)\n" % Defs.prime
+    uStr += "               (e.g., 2147483647 = 2^31 - 1, with -e)\n"
+
+    uStr += " -e:           draw verifier challenges from F_p^2         (False)\n"
+
+    uStr += " -v:           sumcheck messages are evaluations, not      (False)\n"
+    uStr += "               polynomial coefficients\n"
+
+    uStr += " -l:           collapse consecutive layers of add and sub  (False)\n"
+    uStr += "               gates into one layer of linear gates\n"
+
+    uStr += " -k:           use constant-operand gates for adds and     (False)\n"
+    uStr += "               muls whose inputs are constants\n"
+
+    uStr += " -j nWorkers:  shard sumcheck rounds (by copy, then by     (%d)\n" % VerifierInfo.nWorkers
+    uStr += "               gate) across this many worker processes\n"
+
+    uStr += " -g engine:    layer prover engine                         (%s)\n" % VerifierInfo.engine
+    uStr += "               (one of: %s)\n" % ", ".join(sorted(cprv.ENGINES))
+
     return uStr
 
 def get_inputs(verifier_info, input_layer):
@@ -92,16 +127,37 @@ def run_giraffe(verifier_info):
     # pylint doesn't seed to understand how classmethods are inherited from metclasses
     from_pws = cver.CircuitVerifier.from_pws # pylint: disable=no-member
 
-    (input_layer, ver) = from_pws(pypws.parse_pws(verifier_info.pwsFile), verifier_info.nCopies)
+    if verifier_info.prime is not None:
+        util.set_prime(verifier_info.prime)
+    fieldvec.set_backend(verifier_info.backend)
+    util.set_extension(verifier_info.extension)
+    (input_layer, ver) = from_pws(pypws.parse_pws(verifier_info.pwsFile), verifier_info.nCopies, verifier_info.collapse, verifier_info.consts)
+    ver.eval_form = verifier_info.evalForm
+    ver.engine = verifier_info.engine
     ver.build_prover()
 
+    pool = None
+    if verifier_info.nWorkers > 0:
+        pool = ShardPool(verifier_info.nWorkers)
+        ver.prover.set_pool(pool)
+
     inputs = get_inputs(verifier_info, input_layer)
     ver.run(inputs)
 
+    if pool is not None:
+        pool.close()
+
     nInBits = util.clog2(len(input_layer))
     nCopies = VerifierInfo.nCopies
     nLayers = len(ver.in0vv)
     print "nInBits: %d, nCopies: %d, nLayers: %d" % (nInBits, nCopies, nLayers)
+    nDups = ver.prover.get_dedup_counts()
+    if sum(nDups) > 0:
+        print "  duplicate gates, evaluated once (per layer): %s" % " ".join([ str(nDup) for nDup in nDups ])
+    if not Defs.track_fArith:
+        print "  (field op accounting is off because GIRAFFE_NO_FARITH is set)"
+        return
+
     (tMul, tAdd, tSub) = (0, 0, 0)
     for fArith in [ver.in_a, ver.out_a, ver.sc_a, ver.tV_a, ver.nlay_a]:
         (mul, add, sub) = fArith.get_counts()
@@ -117,7 +173,7 @@ def run_giraffe(verifier_info):
 
 def main():
     uStr = get_usage()
-    oStr = "c:i:p:"
+    oStr = "c:i:p:b:P:evlkj:g:"
 
     try:
         (opts, args) = getopt.getopt(sys.argv[1:], oStr)
@@ -140,6 +196,22 @@ def main():
             VerifierInfo.inputFile = arg
         elif opt == "-p":
             VerifierInfo.pwsFile = arg
+        elif opt == "-b":
+            VerifierInfo.backend = arg
+        elif opt == "-P":
+            VerifierInfo.prime = int(arg, 0)
+        elif opt == "-e":
+            VerifierInfo.extension = True
+        elif opt == "-v":
+            VerifierInfo.evalForm = True
+        elif opt == "-l":
+            VerifierInfo.collapse = True
+        elif opt == "-k":
+            VerifierInfo.consts = True
+        elif opt == "-j":
+            VerifierInfo.nWorkers = int(arg)
+        elif opt == "-g":
+            VerifierInfo.engine = arg
         else:
             assert False, "logic error: got unexpected option %s from getopt" % opt
 
@@ -153,6 +225,31 @@ def main():
         print "ERROR: nCopyBits must be at least 1."
         sys.exit(1)
 
+    if VerifierInfo.prime is not None and (VerifierInfo.prime < 3 or VerifierInfo.prime % 2 == 0):
+        print uStr
+        print "ERROR: prime must be an odd prime."
+        sys.exit(1)
+
+    if VerifierInfo.backend != "auto" and VerifierInfo.backend not in fieldvec.available():
+        print uStr
+        print "ERROR: field backend %s is unknown or unavailable (available: %s)." % (VerifierInfo.backend, ", ".join(fieldvec.available()))
+        sys.exit(1)
+
+    if VerifierInfo.prime is not None and not fieldvec.supports(VerifierInfo.backend, VerifierInfo.prime):
+        print uStr
+        print "ERROR: field backend %s does not support prime %d." % (VerifierInfo.backend, VerifierInfo.prime)
+        sys.exit(1)
+
+    if VerifierInfo.nWorkers < 0:
+        print uStr
+        print "ERROR: nWorkers must be nonnegative."
+        sys.exit(1)
+
+    if VerifierInfo.engine not in cprv.ENGINES:
+        print uStr
+        print "ERROR: unknown layer prover engine %s." % VerifierInfo.engine
+        sys.exit(1)
+
     run_giraffe(VerifierInfo)
 
 if __name__ == "__main__":
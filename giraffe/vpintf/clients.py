@@ -22,26 +22,18 @@ class VPIntfClient(vpintf.socket_nb.SocketNB):
 
     @staticmethod
     def vpmsg_vector(vals, mtype=0):
-        retval = chr(mtype) + chr(Defs.MSG_UINT32) + struct.pack("<L", len(vals))
+        retval = [chr(mtype) + chr(Defs.MSG_UINT32) + struct.pack("<L", len(vals))]
 
         nvecs_tot = 0
         for val in vals:
-            nbits = util.clog2(val + 1)
-            n_vecs = nbits // 32
-            if (nbits % 32) != 0:
-                n_vecs += 1
+            words = util.felem_words(val)
+            n_vecs = len(words) // 8
 
             nvecs_tot += n_vecs
-            retval += chr(Defs.MSG_VECTOR) + chr(n_vecs)
-            for _ in range(0, n_vecs):
-                assert val != 0
-                thisval = 0xffffffff & val
-                val = val >> 32
-                retval += struct.pack("<L", thisval)
-                retval += '\x00\x00\x00\x00'
-
-            assert val == 0
+            retval.append(chr(Defs.MSG_VECTOR) + chr(n_vecs))
+            retval.append(words)
 
+        retval = ''.join(retval)
         assert len(retval) == 6 + 2 * len(vals) + 8 * nvecs_tot
         return retval
 
@@ -71,13 +63,11 @@ class VPIntfClient(vpintf.socket_nb.SocketNB):
 
         retval = 0
         length = ord(msg[1])
-        msg = msg[2:]
         for i in range(0, length):
-            val = struct.unpack("<L", msg[:4])[0]
-            retval += val * 2 ** (32 * i)
-            msg = msg[8:]
+            val = struct.unpack("<L", msg[2+8*i:6+8*i])[0]
+            retval += val << (32 * i)
 
-        return (retval, msg)
+        return (retval, msg[2+8*length:])
 
     @staticmethod
     def vmunpack_uint32(msg):
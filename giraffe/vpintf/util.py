@@ -1,10 +1,16 @@
 #!/usr/bin/python2.7
 
+import binascii
 import fcntl
 import math
 import random
 import socket
 
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
 from vpintf.defs import Defs
 import vpintf.socket_nb as socket_nb
 
@@ -69,3 +75,20 @@ def random_felem():
         retval = random.getrandbits(clog2(Defs.prime + 1))
 
     return retval
+
+###
+#  little-endian 32-bit words of a field element, each padded to 64 bits
+###
+def felem_words(val):
+    nwords = (val.bit_length() + 31) // 32
+    if nwords == 0:
+        return ''
+
+    if gmpy2 is not None and isinstance(val, type(gmpy2.mpz(0))):
+        # to_binary gives a 2-byte header followed by the little-endian magnitude
+        raw = gmpy2.to_binary(val)[2:]
+        raw += '\x00' * (4 * nwords - len(raw))
+    else:
+        raw = binascii.unhexlify('%0*x' % (8 * nwords, val))[::-1]
+
+    return ''.join([ raw[4*i:4*i+4] + '\x00\x00\x00\x00' for i in range(0, nwords) ])